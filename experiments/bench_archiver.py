@@ -0,0 +1,65 @@
+"""
+Bytes sent to the monitor in push mode: the old full history push (every
+snapshot with every entry, plain json) against the archiver's delta encoded,
+zlib compressed batches. The history is synthetic, each snapshot changes a
+share of the entries like a gossip round would.
+
+    python bench_archiver.py [--nodes 10,100,1000] [--snapshots 60] [--changed 0.2]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'app'))
+
+from archiver import Archiver  # noqa: E402
+from cluster_state import ClusterState  # noqa: E402
+
+
+def make_entry(key, counter):
+    return {"counter": str(counter), "cycle": str(counter), "digest": "%064x" % random.getrandbits(256),
+            "nodeState": {"id": "", "ip": key.split(':')[0], "port": "5000"},
+            "hbState": {"timestamp": str(time.time()), "failureCount": 0, "failureList": [], "nodeAlive": True},
+            "appState": {"cpu": str(random.uniform(0, 100)), "memory": str(random.uniform(0, 100)),
+                         "network": str(random.randint(0, 10 ** 9)), "storage": str(random.uniform(0, 100))},
+            "nfState": {}, "metric_sent_flags": {"cpu": True, "memory": True, "network": True, "storage": True}}
+
+
+def make_history(node_count, snapshot_count, changed):
+    keys = ["10.0.{}.{}:5000".format(i // 256, i % 256) for i in range(node_count)]
+    state = ClusterState({key: make_entry(key, 0) for key in keys})
+    history = {}
+    for counter in range(1, snapshot_count + 1):
+        state = state.copy()
+        for key in random.sample(keys, max(1, int(node_count * changed))):
+            state[key] = make_entry(key, counter)
+        history[str(counter)] = state
+    return history
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', default='10,100,1000')
+    parser.add_argument('--snapshots', type=int, default=60)
+    parser.add_argument('--changed', type=float, default=0.2)
+    args = parser.parse_args()
+
+    print("{} snapshots, {:.0%} of the entries change per snapshot".format(args.snapshots, args.changed))
+    print("  {:>7} {:>16} {:>16} {:>10} {:>14}".format('nodes', 'full push B', 'archiver B', 'ratio', 'encode ms'))
+    for count in [int(value) for value in args.nodes.split(',')]:
+        history = make_history(count, args.snapshots, args.changed)
+        full = len(json.dumps({key: snapshot.to_dict() for key, snapshot in history.items()}).encode('utf-8'))
+        archiver = Archiver("http://127.0.0.1:9/unused", lambda: {})
+        started = time.perf_counter()
+        archiver.add_history(history)
+        encode_ms = (time.perf_counter() - started) * 1000
+        sent = archiver.pending_bytes
+        print("  {:>7} {:>16} {:>16} {:>10.1f} {:>14.1f}".format(count, full, sent, full / sent, encode_ms),
+              flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Detection time and false positives of the counter and the phi accrual
+failure detector. Starts a small cluster of agents on local addresses
+(127.0.0.2, 127.0.0.3, ... all on port 5000), lets it settle, kills one
+agent and measures how long it takes until the first and until every
+other node declared it dead, and counts dead declarations of nodes that
+were never stopped.
+
+    python bench_failure_detector.py [--nodes 5] [--settle 15] [--modes counter,phi]
+"""
+import argparse
+import concurrent.futures
+import time
+
+import requests
+
+from bench_gossip_control import start_agent, stop_agents
+
+
+def init_agent(ip, node_list, args, mode):
+    body = {"monitoring_address": "127.0.0.1", "client_port": "4999", "database_address": "none",
+            "node_list": node_list, "target_count": args.target_count, "gossip_rate": args.gossip_rate,
+            "node_ip": ip, "is_send_data_back": "0", "push_mode": "0", "failure_detection": mode,
+            "phi_threshold": args.phi_threshold, "indirect_probes": args.indirect_probes}
+    # start_node waits 10s before it answers
+    requests.post("http://{}:5000/start_node".format(ip), json=body, timeout=30).raise_for_status()
+
+
+def dead_events(ip):
+    stats = requests.get("http://{}:5000/failure_detector_stats".format(ip), timeout=5).json()
+    return [event for event in stats['events'] if event['event'] == 'dead']
+
+
+def bench_mode(mode, args):
+    ips = ["127.0.0.{}".format(i + 2) for i in range(args.nodes)]
+    node_list = [{"ip": ip, "port": "5000"} for ip in ips]
+    agents = [start_agent(ip) for ip in ips]
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(ips)) as pool:
+            list(pool.map(lambda ip: init_agent(ip, node_list, args, mode), ips))
+        time.sleep(args.settle)
+
+        victim = ips.pop()
+        stop_agents([agents.pop()])
+        stopped = time.time()
+        victim_key = victim + ":5000"
+        detected = {}
+        while len(detected) < len(ips) and time.time() - stopped < args.timeout:
+            for ip in ips:
+                if ip not in detected and any(event['peer'] == victim_key for event in dead_events(ip)):
+                    detected[ip] = time.time() - stopped
+            time.sleep(0.1)
+
+        false_positives = sum(1 for ip in ips for event in dead_events(ip) if event['peer'] != victim_key)
+    finally:
+        stop_agents(agents)
+    first = min(detected.values()) if detected else None
+    everyone = max(detected.values()) if len(detected) == len(ips) else None
+    return first, everyone, false_positives
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=5)
+    parser.add_argument('--target-count', type=int, default=2)
+    parser.add_argument('--gossip-rate', type=float, default=0.1)
+    parser.add_argument('--phi-threshold', type=float, default=8.0)
+    parser.add_argument('--indirect-probes', type=int, default=3)
+    parser.add_argument('--settle', type=float, default=15)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--modes', default='counter,phi')
+    args = parser.parse_args()
+
+    print("{} nodes, target count {}, gossip rate {}s, one node killed".format(
+        args.nodes, args.target_count, args.gossip_rate), flush=True)
+    print("{:<10} {:>18} {:>18} {:>16}".format('detector', 'first detection s', 'all detected s', 'false positives'))
+    for mode in args.modes.split(','):
+        first, everyone, false_positives = bench_mode(mode, args)
+        print("{:<10} {:>18} {:>18} {:>16}".format(
+            mode, 'n/a' if first is None else "{:.2f}".format(first),
+            'n/a' if everyone is None else "{:.2f}".format(everyone), false_positives), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Bandwidth against convergence latency of the fixed and the adaptive gossip
+controller. Starts a small cluster of agents on local addresses
+(127.0.0.2, 127.0.0.3, ... all on port 5000), lets it settle, measures the
+bytes sent per second, then starts one more agent and measures how long it
+takes until every node has the newcomer's entry.
+
+    python bench_gossip_control.py [--nodes 4] [--settle 20] [--gossip-rate 0.05] [--modes fixed,adaptive]
+"""
+import argparse
+import concurrent.futures
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import requests
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'app')
+AGENT = "import priomon; priomon.gossip.run(host='{}', port=5000, threaded=True)"
+
+
+def start_agent(ip):
+    agent = subprocess.Popen([sys.executable, "-c", AGENT.format(ip)], cwd=APP_DIR, start_new_session=True,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            requests.get("http://{}:5000/hello_world".format(ip), timeout=1)
+            return agent
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError("agent on {} did not come up".format(ip))
+
+
+def stop_agents(agents):
+    for agent in agents:
+        os.killpg(agent.pid, signal.SIGKILL)
+        agent.wait()
+
+
+def init_agent(ip, node_list, args, mode):
+    body = {"monitoring_address": "127.0.0.1", "client_port": "4999", "database_address": "none",
+            "node_list": node_list, "target_count": args.target_count, "gossip_rate": args.gossip_rate,
+            "node_ip": ip, "is_send_data_back": "0", "push_mode": "0", "gossip_control": mode,
+            "gossip_bounds": {"min_rate": args.gossip_rate, "max_rate": args.max_rate,
+                              "min_fanout": 1, "max_fanout": args.target_count}}
+    # start_node waits 10s before it answers
+    requests.post("http://{}:5000/start_node".format(ip), json=body, timeout=30).raise_for_status()
+
+
+def control_stats(ip):
+    return requests.get("http://{}:5000/gossip_round_stats".format(ip), timeout=5).json()['gossip_control']
+
+
+def bench_mode(mode, args):
+    ips = ["127.0.0.{}".format(i + 2) for i in range(args.nodes + 1)]
+    newcomer = ips.pop()
+    node_list = [{"ip": ip, "port": "5000"} for ip in ips]
+    agents = [start_agent(ip) for ip in ips + [newcomer]]
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(ips)) as pool:
+            list(pool.map(lambda ip: init_agent(ip, node_list, args, mode), ips))
+
+        time.sleep(args.settle)
+        before = {ip: control_stats(ip) for ip in ips}
+        time.sleep(args.measure)
+        after = {ip: control_stats(ip) for ip in ips}
+        bytes_per_s = sum(after[ip]['bytes_out'] - before[ip]['bytes_out'] for ip in ips) / args.measure
+        rounds_per_s = sum(after[ip]['rounds'] - before[ip]['rounds'] for ip in ips) / args.measure / len(ips)
+
+        init_agent(newcomer, node_list + [{"ip": newcomer, "port": "5000"}], args, mode)
+        joined = time.time()
+        newcomer_key = newcomer + ":5000"
+        waiting = set(ips)
+        while waiting and time.time() - joined < 60:
+            for ip in list(waiting):
+                if newcomer_key in requests.get("http://{}:5000/get_recent_data_from_node".format(ip), timeout=5).json():
+                    waiting.discard(ip)
+            time.sleep(0.05)
+        join_latency = time.time() - joined if not waiting else None
+        reasons = {}
+        for stats in after.values():
+            for reason, count in stats['reasons'].items():
+                reasons[reason] = reasons.get(reason, 0) + count
+    finally:
+        stop_agents(agents)
+    return bytes_per_s, rounds_per_s, join_latency, reasons
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=4)
+    parser.add_argument('--target-count', type=int, default=2)
+    parser.add_argument('--gossip-rate', type=float, default=0.05)
+    parser.add_argument('--max-rate', type=float, default=1.0)
+    parser.add_argument('--settle', type=float, default=20)
+    parser.add_argument('--measure', type=float, default=10)
+    parser.add_argument('--modes', default='fixed,adaptive')
+    args = parser.parse_args()
+
+    print("{} nodes, target count {}, gossip rate {}s (adaptive up to {}s)".format(
+        args.nodes, args.target_count, args.gossip_rate, args.max_rate), flush=True)
+    print("{:<10} {:>14} {:>14} {:>16}  {}".format('mode', 'bytes out/s', 'rounds/s/node', 'join latency s', 'decisions'))
+    for mode in args.modes.split(','):
+        bytes_per_s, rounds_per_s, join_latency, reasons = bench_mode(mode, args)
+        print("{:<10} {:>14.0f} {:>14.2f} {:>16}  {}".format(
+            mode, bytes_per_s, rounds_per_s, 'n/a' if join_latency is None else "{:.2f}".format(join_latency),
+            reasons), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Peer selection with the full node list (what get_random_nodes did before)
+against the Cyclon partial view, and an in-process simulation of the
+shuffles: how evenly nodes show up in other views, how fast a node that
+registers with a single peer spreads, and how fast crashed nodes age out.
+
+    python bench_peer_sampling.py [--nodes 100,1000,10000] [--view-size 20] [--shuffle-length 5]
+"""
+import argparse
+import os
+import secrets
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'app'))
+
+from peer_sampling import PeerView, peer_key  # noqa: E402
+
+TARGET_COUNT = 3
+
+
+def make_node_list(count):
+    return [{"ip": "10.{}.{}.{}".format(i // 65536, i // 256 % 256, i % 256), "port": "5000"} for i in range(count)]
+
+
+def full_list_selection(node_list, own_ip):
+    # the old per round selection: filter the whole list, then sample
+    filtered_nodes = [node for node in node_list if node['ip'] != own_ip]
+    return secrets.SystemRandom().sample(filtered_nodes, TARGET_COUNT)
+
+
+def time_per_call(fn, repeat=200):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def shuffle_round(views, alive):
+    for key, view in views.items():
+        if key not in alive:
+            continue
+        started = view.start_shuffle(dict(zip(("ip", "port"), key.split(':'))))
+        if started is None:
+            continue
+        target, sent = started
+        target_view = views.get(peer_key(target))
+        if peer_key(target) not in alive:
+            # no answer, the crashed peer stays out of the view
+            view.shuffle_failures += 1
+            continue
+        view.finish_shuffle(target, sent, target_view.answer_shuffle(sent))
+
+
+def simulate(node_list, view_size, shuffle_length, rounds=30):
+    keys = [peer_key(entry) for entry in node_list]
+    views = {}
+    for key in keys:
+        views[key] = PeerView(key, view_size, shuffle_length)
+        views[key].seed(node_list)
+    alive = set(keys)
+    for _ in range(rounds):
+        shuffle_round(views, alive)
+    in_degree = {key: 0 for key in keys}
+    for view in views.values():
+        for peer in view.view:
+            in_degree[peer] += 1
+
+    # a newcomer registers with one node only
+    newcomer = {"ip": "192.168.0.1", "port": "5000"}
+    newcomer_key = peer_key(newcomer)
+    views[newcomer_key] = PeerView(newcomer_key, view_size, shuffle_length)
+    views[newcomer_key].seed([node_list[0]])
+    views[keys[0]].add(newcomer)
+    alive.add(newcomer_key)
+    spread = []
+    for _ in range(rounds):
+        shuffle_round(views, alive)
+        spread.append(sum(1 for view in views.values() if newcomer_key in view.view))
+
+    # a tenth of the nodes crash
+    crashed = set(keys[1:len(keys) // 10 + 1])
+    alive -= crashed
+    purge_rounds = None
+    for round_number in range(1, 10 * rounds + 1):
+        shuffle_round(views, alive)
+        if not any(peer in crashed for key in alive for peer in views[key].view):
+            purge_rounds = round_number
+            break
+    return statistics.mean(in_degree.values()), statistics.pstdev(in_degree.values()), spread, purge_rounds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', default='100,1000,10000')
+    parser.add_argument('--view-size', type=int, default=20)
+    parser.add_argument('--shuffle-length', type=int, default=5)
+    args = parser.parse_args()
+
+    print("peer selection per round, target count {}".format(TARGET_COUNT))
+    print("  {:>7} {:>16} {:>16}".format('nodes', 'full list us', 'view us'))
+    for count in [int(value) for value in args.nodes.split(',')]:
+        node_list = make_node_list(count)
+        view = PeerView(peer_key(node_list[0]), args.view_size, args.shuffle_length)
+        view.seed(node_list)
+        print("  {:>7} {:>16.1f} {:>16.1f}".format(
+            count, time_per_call(lambda: full_list_selection(node_list, node_list[0]["ip"])) * 1e6,
+            time_per_call(lambda: view.sample(TARGET_COUNT)) * 1e6), flush=True)
+
+    print("shuffle simulation, view size {}, shuffle length {}".format(args.view_size, args.shuffle_length))
+    print("  {:>7} {:>10} {:>10} {:>34} {:>14}".format(
+        'nodes', 'in-degree', 'stddev', 'views with newcomer after 1/5/10/30', 'crash purge'))
+    for count in [int(value) for value in args.nodes.split(',')]:
+        if count > 2000:
+            # the simulation runs every node in this process
+            continue
+        mean, stddev, spread, purge_rounds = simulate(make_node_list(count), args.view_size, args.shuffle_length)
+        print("  {:>7} {:>10.1f} {:>10.2f} {:>34} {:>14}".format(
+            count, mean, stddev, "/".join(str(spread[i - 1]) for i in (1, 5, 10, 30)),
+            "{} rounds".format(purge_rounds) if purge_rounds else "n/a"), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Cost of the per round send decisions as the number of metrics per node grows:
+the per metric evaluation against the vectorized NumPy evaluator and the
+default evaluator that picks between them by metric count, on synthetic
+rounds with a mix of point and relative metrics. Also checks all three make
+the same decisions every round.
+
+    python bench_priority.py [--metrics 4,100,1000,5000] [--rounds 200]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'app'))
+
+from collectors import COLLECTORS, DEFAULT_COLLECTORS  # noqa: E402
+from priority_eval import PriorityEvaluator  # noqa: E402
+
+# families the synthetic metrics are spread over, cpu_cores.17, disk_io.3 ...
+FAMILIES = ["cpu_cores", "network_interfaces", "disk_io", "load"]
+
+
+def metric_names(count):
+    names = list(DEFAULT_COLLECTORS[:count])
+    while len(names) < count:
+        family = FAMILIES[len(names) % len(FAMILIES)]
+        names.append("{}.{}".format(family, len(names)))
+    return names
+
+
+def make_rounds(names, rounds, seed=1):
+    rng = random.Random(seed)
+    values = {}
+    for name in names:
+        relative = COLLECTORS[name.split('.', 1)[0]].delta_kind == "relative"
+        values[name] = rng.uniform(1e6, 1e9) if relative else rng.uniform(0, 100)
+    generated = []
+    for _ in range(rounds):
+        # most metrics drift a little, a few jump
+        for name, value in values.items():
+            jump = 0.3 if rng.random() < 0.05 else 0.02
+            values[name] = max(0.0, value * (1 + rng.uniform(-jump, jump)))
+        generated.append(dict(values))
+    return generated
+
+
+def run(evaluator, rounds):
+    decisions = []
+    started = time.perf_counter()
+    for cycle, values in enumerate(rounds, start=1):
+        to_send, _ = evaluator.evaluate(values, cycle)
+        decisions.append(set(to_send))
+    return (time.perf_counter() - started) / len(rounds), decisions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--metrics', default='4,100,1000,5000')
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    print("{:>8} {:>14} {:>14} {:>9} {:>11} {:>10} {:>10}".format(
+        'metrics', 'per metric us', 'vectorized us', 'speedup', 'default us', 'sent %', 'identical'))
+    for count in [int(value) for value in args.metrics.split(',')]:
+        rounds = make_rounds(metric_names(count), args.rounds)
+        scalar_time, scalar_decisions = run(PriorityEvaluator({}, {}, vectorized=False), rounds)
+        vector_time, vector_decisions = run(PriorityEvaluator({}, {}, vectorized=True), rounds)
+        # picks the path by metric count, what the node runs
+        default_time, default_decisions = run(PriorityEvaluator({}, {}), rounds)
+        sent = sum(len(decision) for decision in vector_decisions) / (count * len(rounds)) * 100
+        identical = scalar_decisions == vector_decisions == default_decisions
+        print("{:>8} {:>14.1f} {:>14.1f} {:>8.1f}x {:>11.1f} {:>9.1f}% {:>10}".format(
+            count, scalar_time * 1e6, vector_time * 1e6, scalar_time / vector_time, default_time * 1e6, sent,
+            'yes' if identical else 'NO'), flush=True)
+
+
+if __name__ == '__main__':
+    main()
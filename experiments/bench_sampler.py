@@ -0,0 +1,77 @@
+"""
+Cost of metric collection on the gossip thread: reading psutil inline every
+round (what get_new_data used to do) against reading the background
+sampler's cache, plus how many system reads each approach does per metric.
+
+    python bench_sampler.py [--duration 10] [--gossip-rate 0.2]
+"""
+import argparse
+import os
+import sys
+import time
+
+import psutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'app'))
+
+from metric_sampler import MetricSampler  # noqa: E402
+
+
+def inline_collection():
+    # the collection get_new_data did before the sampler
+    network = psutil.net_io_counters().bytes_recv + psutil.net_io_counters().bytes_sent
+    return {
+        "cpu": psutil.cpu_percent(),
+        "memory": psutil.virtual_memory().percent,
+        "network": network,
+        "storage": psutil.disk_usage('/').free
+    }
+
+
+def run_rounds(collect, duration, gossip_rate):
+    timings = []
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        started = time.perf_counter()
+        collect()
+        timings.append(time.perf_counter() - started)
+        time.sleep(gossip_rate)
+    return sorted(timings)
+
+
+def report(label, timings):
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print("  {:<22} rounds {:>5}  avg {:>8.1f} us  p99 {:>8.1f} us  max {:>8.1f} us".format(
+        label, len(timings), sum(timings) / len(timings) * 1e6, p99 * 1e6, timings[-1] * 1e6), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--gossip-rate', type=float, default=0.2)
+    args = parser.parse_args()
+
+    print("collection time on the gossip thread per round (gossip rate {}s, {}s)".format(
+        args.gossip_rate, args.duration))
+    inline_timings = run_rounds(inline_collection, args.duration, args.gossip_rate)
+    report("inline psutil", inline_timings)
+
+    sampler = MetricSampler()
+    sampler.start()
+    cached_timings = run_rounds(sampler.latest, args.duration, args.gossip_rate)
+    sampler.stop()
+    report("sampler cache", cached_timings)
+
+    rounds = len(inline_timings)
+    print("system reads per collector over {}s".format(args.duration))
+    print("  {:<10} {:>8} {:>8} {:>10} {:>12}".format('collector', 'inline', 'sampler', 'interval', 'avg read us'))
+    stats = sampler.stats()
+    for name in sampler.collectors:
+        # the inline code read net_io_counters twice per round
+        inline_reads = rounds * 2 if name == "network" else rounds
+        print("  {:<10} {:>8} {:>8} {:>9}s {:>12}".format(
+            name, inline_reads, stats[name]['samples'], stats[name]['interval'], stats[name]['avg_read_us']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Load benchmark of the gossip agent's serving modes: the threaded werkzeug
+server (PRIOMON_SERVER=threaded, what priomon.py always ran) against the
+asyncio server (PRIOMON_SERVER=asyncio). Starts one agent per mode on
+localhost:5000, seeds it with synthetic cluster state and hammers a few
+endpoints from several client processes with keep-alive sessions.
+
+    python bench_server.py [--clients 8] [--duration 10] [--nodes 100] [--modes threaded,asyncio]
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import requests
+
+from bench_wire import make_entry
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'app')
+BASE_URL = "http://127.0.0.1:5000"
+SENDER_KEY = "10.99.0.1:5000"
+
+
+def endpoint_requests(node_count):
+    entries = {"172.19.{}.{}:{}".format(i // 250, i % 250 + 2, 5000 + i): make_entry(i, 10)
+               for i in range(node_count)}
+    metadata = {key: entry["counter"] for key, entry in entries.items()}
+    sender_entry = make_entry(node_count, 10)
+    exchange = {"metadata": metadata, SENDER_KEY: sender_entry}
+    return {
+        "GET /hello_world": ("get", "/hello_world", None),
+        "GET /metadata": ("get", "/metadata", None),
+        "POST /receive_metadata": ("post", "/receive_metadata", exchange),
+        "POST /push_pull": ("post", "/push_pull?inc_round=1", {"exchange": exchange, "push": {SENDER_KEY: sender_entry}}),
+    }, entries
+
+
+def start_agent(mode):
+    env = dict(os.environ, PRIOMON_SERVER=mode)
+    agent = subprocess.Popen([sys.executable, "priomon.py"], cwd=APP_DIR, env=env, start_new_session=True,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            requests.get(BASE_URL + "/hello_world", timeout=1)
+            return agent
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    stop_agent(agent)
+    raise RuntimeError("agent in {} mode did not come up".format(mode))
+
+
+def stop_agent(agent):
+    # the werkzeug debug server runs a reloader child, kill the whole group
+    os.killpg(agent.pid, signal.SIGKILL)
+    agent.wait()
+    time.sleep(1)
+
+
+def init_agent(entries):
+    body = {"monitoring_address": "127.0.0.1", "client_port": "4999", "database_address": "none",
+            "node_list": [{"ip": "127.0.0.1", "port": "5000"}], "target_count": 0, "gossip_rate": 0.5,
+            "node_ip": "127.0.0.1", "is_send_data_back": "0", "push_mode": "0"}
+    # start_node waits 10s before it answers
+    requests.post(BASE_URL + "/start_node", json=body, timeout=30).raise_for_status()
+    requests.post(BASE_URL + "/push_pull?inc_round=1",
+                  json={"exchange": {"metadata": {}, SENDER_KEY: make_entry(0, 1)}, "push": entries},
+                  timeout=30).raise_for_status()
+
+
+def client(args):
+    method, path, payload, duration = args
+    session = requests.Session()
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            response = session.request(method, BASE_URL + path, json=payload, timeout=10)
+            if response.status_code != 200:
+                errors += 1
+        except requests.exceptions.RequestException:
+            errors += 1
+            session = requests.Session()
+        latencies.append(time.perf_counter() - started)
+    return latencies, errors
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def bench_mode(mode, requests_by_endpoint, entries, clients, duration):
+    agent = start_agent(mode)
+    results = {}
+    try:
+        init_agent(entries)
+        with multiprocessing.Pool(clients) as pool:
+            for name, (method, path, payload) in requests_by_endpoint.items():
+                started = time.perf_counter()
+                per_client = pool.map(client, [(method, path, payload, duration)] * clients)
+                elapsed = time.perf_counter() - started
+                latencies = sorted(latency for client_latencies, _ in per_client for latency in client_latencies)
+                results[name] = {
+                    'requests': len(latencies),
+                    'errors': sum(errors for _, errors in per_client),
+                    'rps': len(latencies) / elapsed,
+                    'p50': percentile(latencies, 0.50) * 1000,
+                    'p99': percentile(latencies, 0.99) * 1000,
+                }
+    finally:
+        stop_agent(agent)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--nodes', type=int, default=100)
+    parser.add_argument('--modes', default='threaded,asyncio')
+    args = parser.parse_args()
+
+    requests_by_endpoint, entries = endpoint_requests(args.nodes)
+    print("{} client processes, {}s per endpoint, {} entries in the cluster state".format(
+        args.clients, args.duration, args.nodes), flush=True)
+    print("{:<10} {:<24} {:>9} {:>7} {:>10} {:>10}".format('mode', 'endpoint', 'req/s', 'errors', 'p50 ms', 'p99 ms'))
+    for mode in args.modes.split(','):
+        for name, result in bench_mode(mode, requests_by_endpoint, entries, args.clients, args.duration).items():
+            print("{:<10} {:<24} {:>9.1f} {:>7} {:>10.2f} {:>10.2f}".format(
+                mode, name, result['rps'], result['errors'], result['p50'], result['p99']), flush=True)
+
+
+if __name__ == '__main__':
+    main()
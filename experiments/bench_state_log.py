@@ -0,0 +1,73 @@
+"""
+Warm-restart state log: time to replay the log and its size on disk for
+growing clusters, once after a run of delta appends and once after
+compaction. The appends are synthetic, each one changes a share of the
+entries like a gossip round would.
+
+    python bench_state_log.py [--nodes 10,100,1000] [--appends 60] [--changed 0.2]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'app'))
+
+from cluster_state import ClusterState  # noqa: E402
+from state_log import StateLog  # noqa: E402
+
+
+def make_entry(key, counter):
+    return {"counter": str(counter), "cycle": str(counter), "digest": "%064x" % random.getrandbits(256),
+            "nodeState": {"id": "", "ip": key.split(':')[0], "port": "5000"},
+            "hbState": {"timestamp": str(time.time()), "failureCount": 0, "failureList": [], "nodeAlive": True},
+            "appState": {"cpu": str(random.uniform(0, 100)), "memory": str(random.uniform(0, 100)),
+                         "network": str(random.randint(0, 10 ** 9)), "storage": str(random.uniform(0, 100))},
+            "nfState": {}, "metric_sent_flags": {"cpu": True, "memory": True, "network": True, "storage": True}}
+
+
+def replay_ms(path):
+    log = StateLog(path, lambda: None)
+    entries = log.load()
+    return log.counts['load_ms'], len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', default='10,100,1000')
+    parser.add_argument('--appends', type=int, default=60)
+    parser.add_argument('--changed', type=float, default=0.2)
+    args = parser.parse_args()
+
+    print("{} appends, {:.0%} of the entries change per append".format(args.appends, args.changed))
+    print("  {:>7} {:>14} {:>12} {:>16} {:>14}".format('nodes', 'log B', 'replay ms', 'compacted B', 'replay ms'))
+    for count in [int(value) for value in args.nodes.split(',')]:
+        keys = ["10.0.{}.{}:5000".format(i // 256, i % 256) for i in range(count)]
+        box = {'state': ClusterState({key: make_entry(key, 0) for key in keys})}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'state.log')
+            # never compacts on its own, the rewrite is measured separately
+            log = StateLog(path, lambda: box['state'], compact_bytes=float('inf'))
+            # opens the log like start() does, appends are driven by hand instead of the thread
+            log.compact({})
+            for counter in range(1, args.appends + 1):
+                state = box['state'].copy()
+                for key in random.sample(keys, max(1, int(count * args.changed))):
+                    state[key] = make_entry(key, counter)
+                box['state'] = state
+                log.append_latest()
+            log_bytes = os.path.getsize(path)
+            log_ms, _ = replay_ms(path)
+            log.compact(log.logged)
+            log.file.close()
+            compact_bytes = os.path.getsize(path)
+            compact_ms, restored = replay_ms(path)
+            assert restored == count
+        print("  {:>7} {:>14} {:>12.1f} {:>16} {:>14.1f}".format(count, log_bytes, log_ms, compact_bytes,
+                                                                 compact_ms), flush=True)
+
+
+if __name__ == '__main__':
+    main()
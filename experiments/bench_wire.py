@@ -0,0 +1,91 @@
+"""
+Compares the gossip wire formats on synthetic cluster states shaped like the
+entries get_new_data() produces: bytes per message and encode/decode CPU time
+for plain json (what requests sends), json compressed with zlib as a baseline
+for any compact format, and the framed wire format (wire_format = binary).
+
+    python bench_wire.py [node_count ...]
+"""
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'app'))
+
+import wire  # noqa: E402
+
+REPEAT = 50
+
+
+def make_entry(index, cycle):
+    ip = "172.19.{}.{}".format(index // 250, index % 250 + 2)
+    return {
+        "counter": "{}".format(cycle * 3 + index % 3),
+        "cycle": "{}".format(cycle),
+        "digest": "{:040x}".format(random.getrandbits(160)),
+        "nodeState": {"id": "", "ip": ip, "port": "{}".format(5000 + index)},
+        "hbState": {
+            "timestamp": "{}".format(time.time() - random.random()),
+            "failureCount": random.randint(0, 3),
+            "failureList": [],
+            "nodeAlive": True},
+        "appState": {
+            "cpu": str(round(random.uniform(0, 100), 1)),
+            "memory": str(round(random.uniform(0, 100), 1)),
+            "network": str(random.randint(10 ** 8, 10 ** 10)),
+            "storage": str(random.randint(10 ** 9, 10 ** 11))},
+        "nfState": {},
+        "metric_sent_flags": {"cpu": True, "memory": True, "network": False, "storage": True},
+    }
+
+
+def make_messages(node_count, cycle=40):
+    entries = {"172.19.{}.{}:{}".format(i // 250, i % 250 + 2, 5000 + i): make_entry(i, cycle)
+               for i in range(node_count)}
+    metadata = {key: entry["counter"] for key, entry in entries.items()}
+    own_key = next(iter(entries))
+    return {
+        "metadata exchange": {"metadata": metadata, own_key: entries[own_key]},
+        "full state": entries,
+    }
+
+
+def timed(fn, arg):
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        result = fn(arg)
+    return result, (time.perf_counter() - started) / REPEAT * 1000
+
+
+def bench(name, message):
+    formats = [
+        ("json", lambda m: json.dumps(m).encode('utf-8'), lambda b: json.loads(b)),
+        ("json+zlib", lambda m: zlib.compress(json.dumps(m).encode('utf-8'), wire.ZLIB_LEVEL),
+         lambda b: json.loads(zlib.decompress(b))),
+        ("wire", wire.encode, wire.decode),
+    ]
+    print("  {}".format(name))
+    json_size = None
+    for label, encode, decode in formats:
+        payload, encode_ms = timed(encode, message)
+        decoded, decode_ms = timed(decode, payload)
+        assert decoded == json.loads(json.dumps(message))
+        json_size = json_size or len(payload)
+        print("    {:<12} {:>9} bytes ({:>5.1f}%)  encode {:>7.3f} ms  decode {:>7.3f} ms".format(
+            label, len(payload), 100.0 * len(payload) / json_size, encode_ms, decode_ms), flush=True)
+
+
+def main():
+    random.seed(7)
+    node_counts = [int(arg) for arg in sys.argv[1:]] or [10, 100, 500]
+    for node_count in node_counts:
+        print("{} nodes".format(node_count))
+        for name, message in make_messages(node_count).items():
+            bench(name, message)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Request parsing checks of the asyncio serving mode: keep-alive and
+Connection: close, Content-Length bodies (also pipelined behind each other),
+HEAD, and the requests it must refuse (malformed request line, chunked
+bodies, too many header lines). Runs aio_server's connection handler on a local port in front of a
+small echo app and talks raw HTTP to it.
+
+    python check_aio_server.py
+"""
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'app'))
+
+import aio_server  # noqa: E402
+
+# seconds to wait for a response, or for the server to close the connection
+READ_TIMEOUT = 5
+
+
+def echo_app(environ, start_response):
+    if environ['PATH_INFO'] == '/fail':
+        raise RuntimeError("failing on purpose")
+    body = json.dumps({
+        'method': environ['REQUEST_METHOD'],
+        'path': environ['PATH_INFO'],
+        'query': environ['QUERY_STRING'],
+        'content_type': environ.get('CONTENT_TYPE', ''),
+        'body': environ['wsgi.input'].read().decode('latin-1'),
+    }).encode()
+    start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', '999')])
+    return [body]
+
+
+async def read_response(reader, head=False):
+    status = (await asyncio.wait_for(reader.readline(), READ_TIMEOUT)).decode('latin-1').rstrip('\r\n')
+    assert status, "connection closed before a response"
+    headers = {}
+    while True:
+        line = (await asyncio.wait_for(reader.readline(), READ_TIMEOUT)).decode('latin-1')
+        if line in ('\r\n', '\n', ''):
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers['content-length'])
+    body = b'' if head else await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT)
+    return status.split(' ', 1)[1], headers, body
+
+
+async def closed(reader):
+    return await asyncio.wait_for(reader.read(), READ_TIMEOUT) == b''
+
+
+async def connect(port):
+    return await asyncio.open_connection('127.0.0.1', port)
+
+
+async def check_keep_alive(port):
+    reader, writer = await connect(port)
+    for path in ('/hello_world', '/echo'):
+        writer.write('GET {} HTTP/1.1\r\nHost: x\r\n\r\n'.format(path).encode())
+        status, headers, body = await read_response(reader)
+        assert status == '200 OK' and headers['connection'] == 'keep-alive', (path, status, headers)
+        assert json.loads(body)['path'] == path
+    # the app's own Content-Length is replaced by the real one
+    assert headers['content-length'] == str(len(body))
+    writer.write(b'GET /echo HTTP/1.1\r\nConnection: close\r\n\r\n')
+    status, headers, _ = await read_response(reader)
+    assert status == '200 OK' and headers['connection'] == 'close'
+    assert await closed(reader), "connection left open after Connection: close"
+    writer.close()
+
+    # HTTP/1.0 closes unless asked to keep the connection
+    reader, writer = await connect(port)
+    writer.write(b'GET /echo HTTP/1.0\r\nConnection: keep-alive\r\n\r\n')
+    _, headers, _ = await read_response(reader)
+    assert headers['connection'] == 'keep-alive'
+    writer.write(b'GET /echo HTTP/1.0\r\n\r\n')
+    _, headers, _ = await read_response(reader)
+    assert headers['connection'] == 'close' and await closed(reader)
+    writer.close()
+    print("  keep-alive: ok", flush=True)
+
+
+async def check_bodies(port):
+    reader, writer = await connect(port)
+    first = '{"exchange": {"metadata": {}}}'
+    second = 'x' * 70000
+    # pipelined, the handler must stop reading each body at its Content-Length
+    writer.write('POST /push_pull?inc_round=1 HTTP/1.1\r\nContent-Type: application/json\r\n'
+                 'Content-Length: {}\r\n\r\n{}'.format(len(first), first).encode())
+    writer.write('POST /echo HTTP/1.1\r\nContent-Length: {}\r\n\r\n{}'.format(len(second), second).encode())
+    writer.write(b'POST /echo%20path HTTP/1.1\r\nContent-Length: 0\r\n\r\n')
+    status, _, body = await read_response(reader)
+    echoed = json.loads(body)
+    assert status == '200 OK' and echoed['body'] == first and echoed['query'] == 'inc_round=1'
+    assert echoed['content_type'] == 'application/json'
+    _, _, body = await read_response(reader)
+    assert json.loads(body)['body'] == second
+    _, _, body = await read_response(reader)
+    echoed = json.loads(body)
+    assert echoed['path'] == '/echo path' and echoed['body'] == ''
+
+    writer.write(b'HEAD /echo HTTP/1.1\r\n\r\n')
+    status, headers, _ = await read_response(reader, head=True)
+    assert status == '200 OK' and int(headers['content-length']) > 0
+    # nothing of the HEAD body may be left on the connection in front of the next response
+    writer.write(b'GET /fail HTTP/1.1\r\n\r\n')
+    status, headers, _ = await read_response(reader)
+    assert status == '500 Internal Server Error' and headers['connection'] == 'keep-alive'
+    writer.close()
+    print("  content-length bodies: ok", flush=True)
+
+
+async def check_refused(port):
+    for name, request, expected in (
+            ("malformed request line", b'GARBAGE\r\n\r\n', '400 Bad Request'),
+            ("request line with spaces in it", b'GET /a b HTTP/1.1\r\n\r\n', '400 Bad Request'),
+            ("chunked body", b'POST /echo HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n0\r\n\r\n',
+             '411 Length Required'),
+            ("header block too long", b'GET /echo HTTP/1.1\r\n'
+             + b''.join(b'X-Header-%d: x\r\n' % i for i in range(aio_server.MAX_HEADER_LINES + 1))
+             + b'\r\nGET /smuggled HTTP/1.1\r\n\r\n', '431 Request Header Fields Too Large')):
+        reader, writer = await connect(port)
+        writer.write(request)
+        status, headers, _ = await read_response(reader)
+        assert status == expected and headers['connection'] == 'close', (name, status)
+        assert await closed(reader), "connection left open after a {}".format(name)
+        writer.close()
+
+    # a body cut short by the client just drops the connection
+    reader, writer = await connect(port)
+    writer.write(b'POST /echo HTTP/1.1\r\nContent-Length: 100\r\n\r\nshort')
+    writer.write_eof()
+    assert await closed(reader)
+    writer.close()
+    # a header block of exactly MAX_HEADER_LINES is still fine
+    reader, writer = await connect(port)
+    writer.write(b'GET /echo HTTP/1.1\r\n'
+                 + b''.join(b'X-Header-%d: x\r\n' % i for i in range(aio_server.MAX_HEADER_LINES)) + b'\r\n')
+    status, _, _ = await read_response(reader)
+    assert status == '200 OK', status
+    writer.close()
+    # blank lines between requests are skipped
+    reader, writer = await connect(port)
+    writer.write(b'\r\n\r\nGET /echo HTTP/1.1\r\n\r\n')
+    status, _, _ = await read_response(reader)
+    assert status == '200 OK'
+    writer.close()
+    print("  refused requests: ok", flush=True)
+
+
+async def main():
+    # /fail is logged as an unhandled error, on purpose
+    logging.disable(logging.ERROR)
+    aio_server.loop = asyncio.get_running_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    handlers = set()
+
+    def handle(reader, writer):
+        handler = asyncio.ensure_future(aio_server.handle_connection(reader, writer, echo_app, executor, 0))
+        handlers.add(handler)
+        return handler
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        await check_keep_alive(port)
+        await check_bodies(port)
+        await check_refused(port)
+    finally:
+        server.close()
+        await server.wait_closed()
+        # every client hung up, the handlers end on the EOF
+        await asyncio.wait_for(asyncio.gather(*handlers), READ_TIMEOUT)
+        executor.shutdown()
+    print("asyncio server: all checks passed", flush=True)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+"""
+Round-trip checks of the gossip wire format: every payload must come back
+from decode(encode(...)) exactly as json would give it back, in raw and in
+zlib frames, and frames it doesn't know must be refused.
+
+    python check_wire.py
+"""
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'app'))
+
+import wire  # noqa: E402
+
+
+def make_entry(key, counter):
+    return {"counter": str(counter), "cycle": str(counter), "digest": "%064x" % random.getrandbits(256),
+            "nodeState": {"id": "", "ip": key.split(':')[0], "port": "5000"},
+            "hbState": {"timestamp": str(time.time()), "failureCount": 0, "failureList": [], "nodeAlive": True},
+            "appState": {"cpu": str(random.uniform(0, 100)), "memory": str(random.uniform(0, 100)),
+                         "network": str(random.randint(0, 10 ** 9)), "storage": str(random.uniform(0, 100))},
+            "nfState": {}, "metric_sent_flags": {"cpu": True, "memory": False, "network": True, "storage": False}}
+
+
+def make_state(count):
+    keys = ["10.0.{}.{}:5000".format(i // 256, i % 256) for i in range(count)]
+    return {key: make_entry(key, random.randint(0, 10 ** 6)) for key in keys}
+
+
+# strings that look like numbers must stay strings, plus edge values
+TRICKY_STRINGS = ["0", "-0", "007", "-12", "1e5", "0.1", "1.10", "-0.0", "nan", "inf", "1.", ".5", "١٢",
+                  "9" * 18, "9" * 19, "-" + "9" * 18, "", "ünïcödé", "10.0.0.1:5000"]
+
+
+def roundtrip(name, payload, **kwargs):
+    expected = json.loads(json.dumps(payload))
+    encoded = wire.encode(payload, **kwargs)
+    decoded = wire.decode(encoded)
+    assert decoded == expected, "{}: decoded payload differs".format(name)
+    # same values are not enough, a str must not come back as a number or the other way round
+    assert json.dumps(decoded, sort_keys=True) == json.dumps(expected, sort_keys=True), name
+    return encoded
+
+
+def check_values():
+    payload = {"strings": TRICKY_STRINGS, "ints": [0, 1, -1, 127, 128, -129, 2 ** 62, -2 ** 62],
+               "floats": [0.0, -0.0, 0.1, 1e300, -2.5e-300], "flags": [True, False, None],
+               "nested": {"list": [[], {}, [{"a": ["b"]}]], "tuple": (1, "2")}, "keys": {1: "one", "2": 2}}
+    roundtrip("values", payload, compress_threshold=None)
+    print("  values: ok", flush=True)
+
+
+def check_frames():
+    state = make_state(200)
+    raw = roundtrip("raw frame", state, compress_threshold=None)
+    assert raw[0] == wire._FRAME_RAW
+    small = roundtrip("small payload", {"a": "b"})
+    assert small[0] == wire._FRAME_RAW, "payload under the threshold was compressed"
+
+    zlib_frame = roundtrip("zlib frame", state)
+    assert zlib_frame[0] == wire._FRAME_ZLIB and len(zlib_frame) < len(raw)
+    print("  zlib frame: ok, {} B vs {} B raw".format(len(zlib_frame), len(raw)), flush=True)
+
+
+def check_errors():
+    # 2 was the zstd frame, peers without zstandard couldn't read it
+    for name, data in (("unknown frame", b"\x07{}"), ("zstd frame", b"\x02\x28\xb5\x2f\xfd"),
+                       ("corrupt zlib frame", bytes([wire._FRAME_ZLIB]) + b"not zlib")):
+        try:
+            wire.decode(data)
+        except (ValueError, zlib.error):
+            continue
+        raise AssertionError("{} was decoded".format(name))
+    try:
+        wire.encode({"a": object()})
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("unencodable value was encoded")
+    print("  errors: ok", flush=True)
+
+
+def main():
+    random.seed(1)
+    check_values()
+    check_frames()
+    check_errors()
+    print("wire format: all checks passed", flush=True)
+
+
+if __name__ == '__main__':
+    main()
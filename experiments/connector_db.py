@@ -201,6 +201,40 @@ class PrioMonDB:
             "was_sent INTEGER, "
             "metric_value REAL, "
             "timestamp REAL)")
+        # interval and fan-out the gossip controller picked per round, with the bytes it cost
+        self.cursor.execute(
+            "CREATE TABLE IF NOT EXISTS round_gossip_control ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "run_id BIGINT references run(id), "
+            "node_ip TEXT, "
+            "node_port TEXT, "
+            "round INTEGER, "
+            "gossip_interval REAL, "
+            "fanout INTEGER, "
+            "bytes_out INTEGER, "
+            "bytes_in INTEGER, "
+            "timestamp REAL)")
+        # detection time and false positives of the node failure detector per run
+        self.cursor.execute(
+            "CREATE TABLE IF NOT EXISTS failure_detection ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "run_id BIGINT references run(id), "
+            "detector TEXT, "
+            "failure_percent REAL, "
+            "stopped_count INTEGER, "
+            "detected_count INTEGER, "
+            "avg_first_detection REAL, "
+            "avg_full_detection REAL, "
+            "false_positives INTEGER)")
+        # path that served each query (query_num as in the query table)
+        self.cursor.execute(
+            "CREATE TABLE IF NOT EXISTS query_read_path ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "run_id BIGINT references run(id), "
+            "query_num INTEGER, "
+            "target TEXT, "
+            "read_path TEXT, "
+            "max_age REAL)")
         self.connection.commit()
         self.connection.close()
 
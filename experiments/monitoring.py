@@ -11,6 +11,7 @@ import docker
 import socket
 import requests
 import traceback
+import zlib
 import queue
 import threading
 from flask import Flask, request
@@ -167,6 +168,8 @@ def spawn_node(index, node_list, client, custom_network_name, retries=0):
     try:
         new_node = docker_client.containers.run("priomonv1", auto_remove=True, detach=True,
                                                 network_mode=custom_network_name,
+                                                environment={"PRIOMON_SERVER": parser.get(
+                                                    'PriomonParam', 'server_mode', fallback='threaded')},
                                                 ports={'5000': node_list[index]["port"]})
     except Exception as e:
         print("Node not spawned: {}".format(e))
@@ -237,7 +240,40 @@ def start_node(index, run, database_address, monitoring_address, ip):
     to_send = {"node_list": run.node_list, "target_count": run.target_count, "gossip_rate": run.gossip_rate,
                "database_address": database_address, "monitoring_address": monitoring_address,
                "node_ip": run.node_list[index]["ip"], "is_send_data_back": experiment.is_send_data_back,
-               "push_mode": experiment.push_mode, "client_port": parser.get('PriomonParam', 'client_port')}
+               "push_mode": experiment.push_mode, "client_port": parser.get('PriomonParam', 'client_port'),
+               "fanout_mode": parser.get('PriomonParam', 'fanout_mode', fallback='sequential'),
+               "exchange_mode": parser.get('PriomonParam', 'exchange_mode', fallback='two_phase'),
+               "wire_format": parser.get('PriomonParam', 'wire_format', fallback='json'),
+               "collectors": [name.strip() for name in
+                              parser.get('PriomonParam', 'collectors', fallback='cpu,memory,network,storage').split(',')],
+               "gossip_control": parser.get('PriomonParam', 'gossip_control', fallback='fixed'),
+               "view_size": parser.getint('PriomonParam', 'view_size', fallback=20),
+               "shuffle_length": parser.getint('PriomonParam', 'shuffle_length', fallback=5),
+               "shuffle_interval": parser.getfloat('PriomonParam', 'shuffle_interval', fallback=1.0),
+               "failure_detection": parser.get('PriomonParam', 'failure_detection', fallback='counter'),
+               "phi_threshold": parser.getfloat('PriomonParam', 'phi_threshold', fallback=8.0),
+               "indirect_probes": parser.getint('PriomonParam', 'indirect_probes', fallback=3),
+               "health_backoff": parser.getfloat('PriomonParam', 'health_backoff', fallback=1.0),
+               "health_max_backoff": parser.getfloat('PriomonParam', 'health_max_backoff', fallback=60.0),
+               "tombstone_ttl": parser.getfloat('PriomonParam', 'tombstone_ttl', fallback=30.0),
+               "archive_interval": parser.getfloat('PriomonParam', 'archive_interval', fallback=2.0),
+               "archive_spill_bytes": parser.getint('PriomonParam', 'archive_spill_bytes', fallback=8388608),
+               "report_interval": parser.getfloat('PriomonParam', 'report_interval', fallback=0.5),
+               "report_summary_latency": parser.getfloat('PriomonParam', 'report_summary_latency', fallback=1.0),
+               "state_log": parser.get('PriomonParam', 'state_log', fallback=''),
+               "state_log_compact_bytes": parser.getint('PriomonParam', 'state_log_compact_bytes',
+                                                        fallback=4 * 1024 * 1024)}
+    if parser.has_section('GossipControl'):
+        # bounds the adaptive controller keeps the gossip interval and fan-out in
+        to_send["gossip_bounds"] = {
+            'min_rate': parser.getfloat('GossipControl', 'min_gossip_rate'),
+            'max_rate': parser.getfloat('GossipControl', 'max_gossip_rate'),
+            'min_fanout': parser.getint('GossipControl', 'min_target_count'),
+            'max_fanout': parser.getint('GossipControl', 'max_target_count')}
+    if parser.has_section('MetricSampleInterval'):
+        # seconds between two reads of each metric by the node's background sampler
+        to_send["metric_sample_intervals"] = {metric: parser.getfloat('MetricSampleInterval', metric)
+                                              for metric in parser.options('MetricSampleInterval')}
     try:
         time.sleep(0.01)
         session.post("http://{}:{}/start_node".format(ip, run.node_list[index]["port"]), json=to_send)
@@ -292,6 +328,42 @@ def stop_node_percentage(run, percent):
     print("{}% of nodes (n={}) are stopped".format(percent * 100, nodes_to_stop_count))
     return
 
+def report_failure_detection(run, failure_percent, stop_time):
+    """How fast the alive nodes declared the stopped ones dead, and how many declarations were wrong"""
+    docker_ip = parser.get('system_setting', 'docker_ip')
+    stopped_keys = {node["ip"] + ":" + node["port"] for node in run.stopped_nodes.values()}
+    alive_nodes = [node for node in run.node_list if node.get("is_alive", False)]
+    # stopped node -> {alive node: seconds from the stop to its first dead declaration}
+    detections = {key: {} for key in stopped_keys}
+    false_positives = 0
+    detector = None
+    for node in alive_nodes:
+        try:
+            stats = session.get("http://{}:{}/failure_detector_stats".format(docker_ip, node["port"]), timeout=5).json()
+        except Exception as e:
+            print("No failure detector stats from {}: {}".format(node["port"], e))
+            continue
+        detector = stats['mode']
+        for event in stats['events']:
+            if event['event'] != 'dead':
+                continue
+            if event['peer'] in stopped_keys and event['time'] >= stop_time:
+                delay = event['time'] - stop_time
+                detections[event['peer']][node["port"]] = min(delay, detections[event['peer']].get(node["port"], delay))
+            else:
+                false_positives += 1
+    first = [min(by_node.values()) for by_node in detections.values() if by_node]
+    # a stopped node counts as fully detected once every alive node declared it
+    full = [max(by_node.values()) for by_node in detections.values() if len(by_node) == len(alive_nodes)]
+    avg_first = sum(first) / len(first) if first else None
+    avg_full = sum(full) / len(full) if full else None
+    print("Failure detection ({}): {}/{} stopped nodes detected, avg first detection {}, avg detection by all {}, "
+          "false positives {}".format(detector, len(first), len(stopped_keys), avg_first, avg_full, false_positives),
+          flush=True)
+    experiment.query_queue.put((
+        "INSERT INTO failure_detection (run_id, detector, failure_percent, stopped_count, detected_count, avg_first_detection, avg_full_detection, false_positives) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (run.db_id, detector, failure_percent, len(stopped_keys), len(first), avg_first, avg_full, false_positives)))
+
 def run_converged(run):
     run.convergence_message_count = run.message_count
     run.convergence_time = (time.time() - run.start_time)
@@ -324,7 +396,32 @@ def save_query_in_database(run, i, failure_percent, target_key, time_to_query, t
 
 def run_queries(run, query_count, failure_percent):
     docker_ip = parser.get('system_setting', 'docker_ip')
+    hedge_after = parser.getfloat('system_setting', 'query_hedge_after', fallback=query_client.HEDGE_AFTER)
+    # targets resolved together against one quorum, 1 keeps one query per target
+    batch_size = parser.getint('system_setting', 'query_batch_size', fallback=1)
+    # data this many seconds old is served by a single node, 0 keeps every read on the quorum
+    max_age = parser.getfloat('system_setting', 'query_max_age', fallback=0) or None
+    # repeated targets are answered from a client-side cache, revalidated after the ttl, 0 is off
+    cache_ttl = parser.getfloat('system_setting', 'query_cache_ttl', fallback=0)
+    # cached results are also served while their heartbeat is this many seconds old, 0 falls back to query_max_age
+    cache_max_age = parser.getfloat('system_setting', 'query_cache_max_age', fallback=0) or max_age
+    cache = None
+    if cache_ttl > 0:
+        cache = query_client.QueryCache(cache_ttl, parser.getint('system_setting', 'query_cache_entries',
+                                                                 fallback=query_client.DEFAULT_CACHE_ENTRIES),
+                                        cache_max_age)
     quorum_size = 3
+    if batch_size > 1:
+        run_batch_queries(run, query_count, failure_percent, batch_size, quorum_size, docker_ip, hedge_after,
+                          max_age, cache)
+    else:
+        run_single_queries(run, query_count, failure_percent, quorum_size, docker_ip, hedge_after, max_age, cache)
+    if cache is not None:
+        print("Query cache: {}".format(cache.stats()))
+
+
+def run_single_queries(run, query_count, failure_percent, quorum_size, docker_ip, hedge_after, max_age=None,
+                       cache=None):
     for i in range(0, query_count):
         alive_nodes = [item for item in run.node_list if item.get("is_alive", False)]
         
@@ -339,8 +436,9 @@ def run_queries(run, query_count, failure_percent):
         
         try:
             start_time = time.time()
-            total_messages_for_query, query_result = query_client.query(
-                alive_nodes, quorum_size, target_node["ip"], target_node["port"], docker_ip
+            total_messages_for_query, query_result, read_path = query_client.bounded_query(
+                alive_nodes, quorum_size, target_node["ip"], target_node["port"], docker_ip, max_age=max_age,
+                hedge_after=hedge_after, cache=cache
             )
             time_to_query = time.time() - start_time
             success = True
@@ -349,9 +447,46 @@ def run_queries(run, query_count, failure_percent):
             time_to_query = time.time() - start_time
             total_messages_for_query = 0
             success = False
+            read_path = None
             
         save_query_in_database(run, i, failure_percent, target_key, time_to_query, 
                               total_messages_for_query, success)
+        save_read_path(run, i, target_key, read_path, max_age)
+
+def save_read_path(run, i, target_key, read_path, max_age):
+    # which path served the query, single node within the staleness bound or the quorum
+    experiment.query_queue.put((
+        "INSERT INTO query_read_path (run_id, query_num, target, read_path, max_age) VALUES (?, ?, ?, ?, ?)",
+        (run.db_id, i, target_key, read_path, max_age)
+    ))
+
+
+def run_batch_queries(run, query_count, failure_percent, batch_size, quorum_size, docker_ip, hedge_after,
+                      max_age=None, cache=None):
+    # one row per target like run_queries, the batch's time and its share of the messages
+    i = 0
+    while i < query_count:
+        alive_nodes = [item for item in run.node_list if item.get("is_alive", False)]
+        if not alive_nodes:
+            print("No alive nodes available for querying")
+            return
+        targets = random.sample(alive_nodes, min(batch_size, len(alive_nodes), query_count - i))
+        target_keys = [target["ip"] + ":" + target["port"] for target in targets]
+        start_time = time.time()
+        try:
+            total_messages, results, unresolved, paths = query_client.query_many(
+                alive_nodes, quorum_size, target_keys, docker_ip, hedge_after, max_age=max_age, cache=cache
+            )
+        except Exception as e:
+            print(f"Query failed: {e}")
+            total_messages, results, paths = 0, {}, {}
+        time_to_query = time.time() - start_time
+        for target_key in target_keys:
+            save_query_in_database(run, i, failure_percent, target_key, time_to_query,
+                                   round(total_messages / len(target_keys), 2), results.get(target_key) is not None)
+            save_read_path(run, i, target_key, paths.get(target_key), max_age)
+            i += 1
+
 
 def update_during_run(run):
     # TODO: stop percentage of nodes and check AoI etc. (update run.node_list or stop logic (convergence) if wanted)
@@ -368,13 +503,30 @@ def update_during_run(run):
     if parser.get('system_setting', 'query_logic') == "1":
         print(parser.get('system_setting', 'failure_rate'))
         failure_ratio = float(parser.get('system_setting', 'failure_rate'))
+        stop_time = time.time()
         stop_node_percentage(run, failure_ratio)
         time.sleep(20)
+        report_failure_detection(run, failure_ratio, stop_time)
         run_queries(run, query_count=100, failure_percent=failure_ratio)
 
 connection_pool = sqlite3.connect("NodeStorage.db", check_same_thread=False, isolation_level=None)
 database_lock = threading.Lock()
 
+def store_data_entry(cursor, node_key, round_key, key, entry):
+    # entries are stored once in unique_entries, data_entries points at them per node and round
+    v = json.dumps(entry)
+    cursor.execute('SELECT id FROM unique_entries WHERE key=? AND value=?', (key, v))
+    existing_entry = cursor.fetchone()
+    if existing_entry:
+        unique_entry_id = existing_entry[0]
+    else:
+        cursor.execute('INSERT INTO unique_entries (key, value) VALUES (?, ?)', (key, v))
+        unique_entry_id = cursor.lastrowid
+
+    cursor.execute('INSERT INTO data_entries (node, round, key, unique_entry_id) VALUES (?, ?, ?, ?)',
+                   (node_key, round_key, key, unique_entry_id))
+
+
 @monitoring_priomon.route('/push_data_to_database', methods=['POST'])
 def push_data_to_database():
     client_ip = request.args.get('ip')
@@ -391,21 +543,44 @@ def push_data_to_database():
 
         for r, va in data.items():
             for k, j in va.items():
-                v = json.dumps(j)
-                cursor.execute('SELECT id FROM unique_entries WHERE key=? AND value=?', (k, v))
-                existing_entry = cursor.fetchone()
-                if existing_entry:
-                    unique_entry_id = existing_entry[0]
-                else:
-                    cursor.execute('INSERT INTO unique_entries (key, value) VALUES (?, ?)', (k, v))
-                    unique_entry_id = cursor.lastrowid
-
-                cursor.execute('INSERT INTO data_entries (node, round, key, unique_entry_id) VALUES (?, ?, ?, ?)',
-                               (node_key, client_round, k, unique_entry_id))
+                store_data_entry(cursor, node_key, client_round, k, j)
         connection_pool.commit()
 
     return "OK"
 
+
+# (node, archiver session) -> last batch stored, a retried batch that already made it is only acknowledged
+archive_sequences = {}
+
+
+@monitoring_priomon.route('/push_archive_batch', methods=['POST'])
+def push_archive_batch():
+    """
+    Snapshot history from a node's archiver (push mode), see src/app/archiver.py.
+    Body (zlib compressed json): {'session', 'seq', 'snapshots': [{'key', 'entries', 'removed'}]}.
+    Only changed entries are stored per snapshot, a removed key is stored with unique_entry_id NULL.
+    """
+    node_key = request.args.get('ip') + ":" + request.args.get('port')
+    body = request.get_data()
+    if request.headers.get('Content-Encoding') == 'deflate':
+        body = zlib.decompress(body)
+    batch = json.loads(body)
+    with database_lock:
+        if archive_sequences.get((node_key, batch['session']), 0) >= batch['seq']:
+            return "OK"
+        cursor = connection_pool.cursor()
+        # one transaction per batch, the connection commits every statement on its own otherwise
+        cursor.execute('BEGIN')
+        for snapshot in batch['snapshots']:
+            for k, j in snapshot['entries'].items():
+                store_data_entry(cursor, node_key, snapshot['key'], k, j)
+            for k in snapshot['removed']:
+                cursor.execute('INSERT INTO data_entries (node, round, key, unique_entry_id) VALUES (?, ?, ?, NULL)',
+                               (node_key, snapshot['key'], k))
+        connection_pool.commit()
+        archive_sequences[(node_key, batch['session'])] = batch['seq']
+    return "OK"
+
 @monitoring_priomon.route('/receive_ic', methods=['GET'])
 def update_ic():
     client_ip = request.args['ip']
@@ -426,8 +601,46 @@ def update_data_entries_per_ip():
     round = request.args['round']
     inc = request.get_json()
     data_stored_in_node = inc["data"]
-    data_flow_per_round = inc["data_flow_per_round"]
+    with run_lock:
+        experiment.runs[-1].data_entries_per_ip[client_ip + ":" + client_port] = data_stored_in_node
+    return record_node_data(client_ip, client_port, round, data_stored_in_node, inc["data_flow_per_round"], 1)
+
 
+@monitoring_priomon.route('/receive_node_report', methods=['POST'])
+def receive_node_report():
+    """
+    Coalesced report from a node's reporter thread, see src/app/reporter.py. Modes:
+    full {'entries'}, delta {'entries', 'removed'} applied to what the node reported before,
+    summary {'counters', 'entries': own entry} that only moves the counters.
+    'messages' is the number of gossip messages folded into the report.
+    """
+    if not experiment:
+        print("No experiment running, but a gossip node is trying to send data")
+        return "NOK"
+    client_ip = request.args['ip']
+    client_port = request.args['port']
+    round = request.args['round']
+    report = request.get_json()
+    node_key = client_ip + ":" + client_port
+    with run_lock:
+        if report['mode'] == 'full':
+            data_stored_in_node = dict(report['entries'])
+        else:
+            data_stored_in_node = dict(experiment.runs[-1].data_entries_per_ip.get(node_key, {}))
+            if report['mode'] == 'summary':
+                for key in [key for key in data_stored_in_node if key not in report['counters']]:
+                    del data_stored_in_node[key]
+                for key, counter in report['counters'].items():
+                    data_stored_in_node[key] = dict(data_stored_in_node.get(key, {}), counter=counter)
+            for key in report.get('removed', []):
+                data_stored_in_node.pop(key, None)
+            data_stored_in_node.update(report['entries'])
+        experiment.runs[-1].data_entries_per_ip[node_key] = data_stored_in_node
+    return record_node_data(client_ip, client_port, round, data_stored_in_node, report['data_flow_per_round'],
+                            report.get('messages', 1))
+
+
+def record_node_data(client_ip, client_port, round, data_stored_in_node, data_flow_per_round, messages):
     nd = data_flow_per_round.setdefault('nd', 0)
     fd = data_flow_per_round.setdefault('fd', 0)
     rm = data_flow_per_round.setdefault('rm', 0)
@@ -437,8 +650,7 @@ def update_data_entries_per_ip():
 
     with run_lock:
         experiment.runs[-1].convergence_round = max(experiment.runs[-1].convergence_round, int(round))
-        experiment.runs[-1].message_count += 1
-        experiment.runs[-1].data_entries_per_ip[client_ip + ":" + client_port] = data_stored_in_node
+        experiment.runs[-1].message_count += messages
     if not experiment.runs[-1].is_converged:
         if int(nd) > experiment.runs[-1].node_count:
             nd = experiment.runs[-1].node_count
@@ -464,6 +676,15 @@ def update_data_entries_per_ip():
             "INSERT INTO round_metrics_stats (run_id, node_ip, node_port, round, metrics_sent, metrics_filtered, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
             metrics_params))
     
+    # Store the gossip controller's decision for this round
+    if 'gossip_interval' in data_flow_per_round:
+        control_params = (experiment.runs[-1].db_id, client_ip, client_port, round,
+                          data_flow_per_round['gossip_interval'], data_flow_per_round.get('fanout', 0),
+                          data_flow_per_round.get('bytes_out', 0), data_flow_per_round.get('bytes_in', 0), time.time())
+        experiment.query_queue.put((
+            "INSERT INTO round_gossip_control (run_id, node_ip, node_port, round, gossip_interval, fanout, bytes_out, bytes_in, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            control_params))
+
     # Store detailed per-metric transmission data
     if client_ip + ":" + client_port in data_stored_in_node:
         node_data = data_stored_in_node[client_ip + ":" + client_port]
@@ -0,0 +1,191 @@
+import asyncio
+import concurrent.futures
+import io
+import logging
+import sys
+from urllib.parse import unquote
+
+# Asyncio serving mode for the gossip agent.
+#
+# One event loop owns every connection (HTTP/1.1 with keep-alive, so peers and
+# the monitor reuse their connections) and runs the gossip and counter loops as
+# tasks. The endpoints stay the Flask app in priomon.py and are called through
+# WSGI: lock-free reads of the latest snapshot run inline on the loop, the rest
+# can block (state writer, monitor posts, start_node's sleep) and go to a
+# bounded pool instead of a new thread per request.
+
+SERVER_THREADED = "threaded"
+SERVER_ASYNCIO = "asyncio"
+
+HANDLER_WORKERS = 16
+KEEP_ALIVE_TIMEOUT = 75
+MAX_HEADER_LINES = 100
+# read only endpoints that never wait on anything
+INLINE_PATHS = {'/hello_world', '/metadata', '/merkle_sync', '/get_recent_data_from_node',
+                '/gossip_round_stats', '/get_nodelist_from_node', '/shuffle',
+                '/ping', '/failure_detector_stats'}
+
+# the serving loop, None when the agent runs on the threaded werkzeug server
+loop = None
+
+
+class LoopTask:
+    """Thread-like handle (start/join) for a coroutine running on the serving loop"""
+
+    def __init__(self, target, args=()):
+        self.target = target
+        self.args = args
+        self.future = None
+
+    def start(self):
+        self.future = asyncio.run_coroutine_threadsafe(self.target(*self.args), loop)
+
+    def join(self, timeout=None):
+        if self.future is None:
+            return
+        try:
+            self.future.result(timeout)
+        except concurrent.futures.CancelledError:
+            pass
+
+    def is_alive(self):
+        return self.future is not None and not self.future.done()
+
+
+def serve(app, host='0.0.0.0', port=5000):
+    asyncio.run(_serve(app, host, port))
+
+
+async def _serve(app, host, port):
+    global loop
+    loop = asyncio.get_running_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=HANDLER_WORKERS, thread_name_prefix="handler")
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(reader, writer, app, executor, port),
+                                        host, port, backlog=1024)
+    print("Serving on {}:{} with asyncio, {} handler workers".format(host, port, HANDLER_WORKERS), flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+async def handle_connection(reader, writer, app, executor, port):
+    peer = writer.get_extra_info('peername') or ('', 0)
+    try:
+        while True:
+            try:
+                request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+            if not request_line:
+                break
+            if request_line in (b'\r\n', b'\n'):
+                continue
+            parts = request_line.decode('latin-1').rstrip('\r\n').split(' ')
+            if len(parts) != 3:
+                await send_response(writer, '400 Bad Request', [], b'', False)
+                break
+            method, target, version = parts
+            headers = []
+            # one more read than MAX_HEADER_LINES for the blank line that ends the headers
+            for _ in range(MAX_HEADER_LINES + 1):
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers.append((name.strip(), value.strip()))
+            else:
+                # the rest of the headers would be read as the next request
+                await send_response(writer, '431 Request Header Fields Too Large', [], b'', False)
+                break
+            header_map = {name.lower(): value for name, value in headers}
+            if 'chunked' in header_map.get('transfer-encoding', '').lower():
+                # nothing in the gossip protocol sends chunked bodies
+                await send_response(writer, '411 Length Required', [], b'', False)
+                break
+            length = int(header_map.get('content-length') or 0)
+            body = await reader.readexactly(length) if length else b''
+
+            connection = header_map.get('connection', '').lower()
+            if version == 'HTTP/1.1':
+                keep_alive = connection != 'close'
+            else:
+                keep_alive = connection == 'keep-alive'
+
+            environ = make_environ(method, target, version, headers, body, peer, port)
+            if environ['PATH_INFO'] in INLINE_PATHS:
+                status, response_headers, response_body = call_app(app, environ)
+            else:
+                status, response_headers, response_body = await loop.run_in_executor(
+                    executor, call_app, app, environ)
+            await send_response(writer, status, response_headers, response_body, keep_alive,
+                                head=method == 'HEAD')
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+def make_environ(method, target, version, headers, body, peer, port):
+    path, _, query = target.partition('?')
+    environ = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': unquote(path, 'latin-1'),
+        'QUERY_STRING': query,
+        'SERVER_NAME': 'priomon',
+        'SERVER_PORT': str(port),
+        'SERVER_PROTOCOL': version,
+        'REMOTE_ADDR': peer[0],
+        'REMOTE_PORT': str(peer[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in headers:
+        key = name.upper().replace('-', '_')
+        if key == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif key == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + key
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def call_app(app, environ):
+    response = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        response['status'] = status
+        response['headers'] = response_headers
+
+    try:
+        result = app(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+    except Exception as e:
+        logging.error("Unhandled error serving {}: {}".format(environ['PATH_INFO'], e))
+        return '500 Internal Server Error', [('Content-Type', 'text/plain')], b'Internal Server Error'
+    return response['status'], response['headers'], body
+
+
+async def send_response(writer, status, headers, body, keep_alive, head=False):
+    lines = ['HTTP/1.1 ' + status]
+    for name, value in headers:
+        if name.lower() not in ('content-length', 'connection'):
+            lines.append('{}: {}'.format(name, value))
+    lines.append('Content-Length: {}'.format(len(body)))
+    lines.append('Connection: ' + ('keep-alive' if keep_alive else 'close'))
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    if not head:
+        writer.write(body)
+    await writer.drain()
@@ -0,0 +1,139 @@
+import json
+import logging
+import threading
+import time
+import zlib
+from collections import deque
+
+import requests
+
+from utility import entry_changes
+
+# seconds between two drains of the snapshot history
+DEFAULT_ARCHIVE_INTERVAL = 2.0
+# snapshots per batch sent to the monitor
+BATCH_SNAPSHOTS = 32
+# compressed batches kept on the node while the monitor is slow or down, once
+# it is full the archiver stops draining and the snapshot store's retention
+# bounds the history instead
+DEFAULT_SPILL_BYTES = 8 * 1024 * 1024
+# retry backoff after a failed send, doubled per failure
+RETRY_BASE = 0.5
+RETRY_MAX = 30.0
+SEND_TIMEOUT = 10
+# what stopping the node waits for the last batches
+FLUSH_TIMEOUT = 2
+ZLIB_LEVEL = 6
+
+
+class Archiver:
+    """
+    Ships the node's snapshot history to the monitor in push mode, off the gossip thread.
+
+    Every interval the history is popped from the store (on the state
+    writer) and turned into batches. A snapshot carries only the entries
+    that changed since the last archived snapshot plus the keys that
+    disappeared, entries are immutable so a change is an identity check.
+    Batches are zlib compressed and kept in a bounded spill buffer until the
+    monitor acknowledged them, failed sends are retried with exponential
+    backoff. A full buffer stops the draining (backpressure), deltas are
+    built against what was archived so a skipped snapshot only makes the
+    history coarser.
+    """
+
+    def __init__(self, url, drain, interval=DEFAULT_ARCHIVE_INTERVAL, spill_bytes=DEFAULT_SPILL_BYTES):
+        self.url = url
+        # returns {time key: snapshot} and removes those snapshots from the store
+        self.drain = drain
+        self.interval = interval
+        self.spill_bytes = spill_bytes
+        # (seq, compressed batch, snapshot count), oldest first
+        self.pending = deque()
+        self.pending_bytes = 0
+        # key -> entry of the last archived snapshot
+        self.archived = {}
+        self.seq = 0
+        # lets the monitor tell a restarted archiver from a retried batch
+        self.archive_session = "{:x}".format(int(time.time() * 1000))
+        self.session = requests.Session()
+        self.retry_at = 0
+        self.backoff = 0
+        self.send_timeout = SEND_TIMEOUT
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.counts = {'snapshots': 0, 'entries': 0, 'batches': 0, 'batches_sent': 0, 'raw_bytes': 0,
+                       'sent_bytes': 0, 'retries': 0, 'backpressure': 0}
+
+    def start(self):
+        self.thread = threading.Thread(target=self._loop, name="archiver", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=FLUSH_TIMEOUT):
+        self.stop_event.set()
+        if self.thread:
+            # a send to a slow monitor may still be running, the thread is a daemon
+            self.thread.join(timeout)
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.run_once()
+        # last drain on the way out, whatever doesn't make it now is lost with the node
+        self.retry_at = 0
+        self.send_timeout = FLUSH_TIMEOUT
+        self.run_once()
+
+    def run_once(self):
+        if self.pending_bytes < self.spill_bytes:
+            try:
+                self.add_history(self.drain())
+            except Exception as e:
+                logging.error("Archiver could not drain the snapshot history: {}".format(e))
+        else:
+            self.counts['backpressure'] += 1
+        self.send_pending()
+
+    def add_history(self, history):
+        keys = sorted(history, key=int)
+        for start in range(0, len(keys), BATCH_SNAPSHOTS):
+            snapshots = [self.delta(key, history[key]) for key in keys[start:start + BATCH_SNAPSHOTS]]
+            self.seq += 1
+            raw = json.dumps({'session': self.archive_session, 'seq': self.seq, 'snapshots': snapshots}).encode('utf-8')
+            batch = zlib.compress(raw, ZLIB_LEVEL)
+            self.pending.append((self.seq, batch, len(snapshots)))
+            self.pending_bytes += len(batch)
+            self.counts['batches'] += 1
+            self.counts['raw_bytes'] += len(raw)
+
+    def delta(self, time_key, snapshot):
+        current = {key: snapshot[key] for key in snapshot}
+        changed, removed = entry_changes(self.archived, current)
+        self.archived = current
+        self.counts['snapshots'] += 1
+        self.counts['entries'] += len(changed)
+        return {'key': time_key, 'entries': changed, 'removed': removed}
+
+    def send_pending(self):
+        while self.pending and time.time() >= self.retry_at:
+            seq, batch, _ = self.pending[0]
+            try:
+                response = self.session.post(self.url, data=batch, timeout=self.send_timeout,
+                                             headers={'Content-Type': 'application/json',
+                                                      'Content-Encoding': 'deflate'})
+                sent = response.status_code == 200
+            except requests.exceptions.RequestException as e:
+                logging.error("Archive batch {} not sent: {}".format(seq, e))
+                sent = False
+            if not sent:
+                self.counts['retries'] += 1
+                self.backoff = min(RETRY_MAX, self.backoff * 2 if self.backoff else RETRY_BASE)
+                self.retry_at = time.time() + self.backoff
+                return
+            self.pending.popleft()
+            self.pending_bytes -= len(batch)
+            self.backoff = 0
+            self.counts['batches_sent'] += 1
+            self.counts['sent_bytes'] += len(batch)
+
+    def stats(self):
+        return dict(self.counts, pending_batches=len(self.pending), pending_bytes=self.pending_bytes,
+                    spill_bytes=self.spill_bytes, interval=self.interval, backoff=self.backoff)
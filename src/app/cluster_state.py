@@ -0,0 +1,149 @@
+import hashlib
+import zlib
+from collections.abc import MutableMapping
+
+# number of buckets a snapshot is split into, a new version copies only the
+# bucket table plus the buckets it actually writes to. Buckets are the leaves
+# of the merkle summary, so the count grows with the cluster (x4 per step)
+# to keep about BUCKET_TARGET_KEYS keys in each. copy() is O(bucket count),
+# past MAX_BUCKET_COUNT (16k keys) buckets grow instead
+DEFAULT_BUCKET_COUNT = 64
+MAX_BUCKET_COUNT = 4096
+BUCKET_GROWTH = 4
+BUCKET_TARGET_KEYS = 4
+
+_bucket_cache = {}
+
+
+def bucket_of(key, bucket_count=DEFAULT_BUCKET_COUNT):
+    # crc32 instead of hash() so the bucket of a key is the same on every node
+    try:
+        return _bucket_cache[(key, bucket_count)]
+    except KeyError:
+        bucket = zlib.crc32(str(key).encode('utf-8')) % bucket_count
+        _bucket_cache[(key, bucket_count)] = bucket
+        return bucket
+
+
+def bucket_count_for(size):
+    # only depends on the number of keys, so nodes that know the same keys agree on it
+    count = DEFAULT_BUCKET_COUNT
+    while size > count * BUCKET_TARGET_KEYS and count < MAX_BUCKET_COUNT:
+        count *= BUCKET_GROWTH
+    return count
+
+
+def entry_hash(key, entry):
+    # only what the metadata exchange compares: which key at which counter
+    to_hash = "{}:{}".format(key, entry.get('counter'))
+    return int(hashlib.sha1(to_hash.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class ClusterState(MutableMapping):
+    """
+    Copy-on-write snapshot of the cluster (ip:port -> entry).
+
+    copy() is O(bucket_count): the new version shares every bucket with its
+    parent and only clones a bucket the first time it writes to it. Entries
+    themselves are shared between versions, exactly like the shallow dict
+    copies that were used before. Bucket hashes (XOR of the entry hashes) are
+    cached per version and only recomputed for buckets that were written.
+    When the number of keys has crossed a bucket_count_for() step, copy()
+    spreads them over the new bucket count instead, which is O(N) but only
+    happens when the cluster grows or shrinks by a factor of BUCKET_GROWTH.
+    """
+
+    def __init__(self, initial=None, bucket_count=None):
+        if bucket_count is None:
+            bucket_count = bucket_count_for(len(initial) if initial else 0)
+        self._bucket_count = bucket_count
+        self._buckets = [{} for _ in range(bucket_count)]
+        self._owned = set(range(bucket_count))
+        self._bucket_hashes = [None] * bucket_count
+        self._size = 0
+        if initial:
+            for key, value in initial.items():
+                self[key] = value
+
+    def copy(self):
+        bucket_count = bucket_count_for(self._size)
+        if bucket_count != self._bucket_count:
+            return ClusterState(self, bucket_count)
+        new_state = ClusterState.__new__(ClusterState)
+        new_state._bucket_count = self._bucket_count
+        new_state._buckets = list(self._buckets)
+        new_state._owned = set()
+        new_state._bucket_hashes = list(self._bucket_hashes)
+        new_state._size = self._size
+        # buckets are shared now, so the parent has to clone before writing too
+        self._owned = set()
+        return new_state
+
+    def _writable_bucket(self, key):
+        index = bucket_of(key, self._bucket_count)
+        self._bucket_hashes[index] = None
+        if index not in self._owned:
+            self._buckets[index] = dict(self._buckets[index])
+            self._owned.add(index)
+        return self._buckets[index]
+
+    def has_own_buckets(self):
+        # False right after copy(), until the first write clones a bucket
+        return bool(self._owned)
+
+    @property
+    def bucket_count(self):
+        return self._bucket_count
+
+    def bucket_hash(self, index):
+        cached = self._bucket_hashes[index]
+        if cached is None:
+            value = 0
+            for key, entry in list(self._buckets[index].items()):
+                value ^= entry_hash(key, entry)
+            cached = format(value, '016x')
+            self._bucket_hashes[index] = cached
+        return cached
+
+    def bucket_hashes(self):
+        return [self.bucket_hash(index) for index in range(self._bucket_count)]
+
+    def keys_in_buckets(self, indices):
+        keys = []
+        for index in indices:
+            keys.extend(self._buckets[index])
+        return keys
+
+    def __getitem__(self, key):
+        return self._buckets[bucket_of(key, self._bucket_count)][key]
+
+    def __contains__(self, key):
+        return key in self._buckets[bucket_of(key, self._bucket_count)]
+
+    def __setitem__(self, key, value):
+        bucket = self._writable_bucket(key)
+        if key not in bucket:
+            self._size += 1
+        bucket[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        del self._writable_bucket(key)[key]
+        self._size -= 1
+
+    def __iter__(self):
+        for bucket in self._buckets:
+            yield from list(bucket)
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return "ClusterState({!r})".format(self.to_dict())
+
+    def to_dict(self):
+        plain = {}
+        for bucket in self._buckets:
+            plain.update(bucket)
+        return plain
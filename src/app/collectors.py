@@ -0,0 +1,117 @@
+import os
+
+import psutil
+
+# Priority levels
+PRIORITY_HIGH = 1     # Update every round
+PRIORITY_MEDIUM = 5   # Update every 5 rounds
+PRIORITY_LOW = 10     # Update every 10 rounds
+
+# how the change of a metric is measured against its delta threshold:
+# "points" is the plain difference (cpu %, memory %, load), "relative" is the
+# change in percent of the larger value (byte counters, free space)
+DELTA_POINTS = "points"
+DELTA_RELATIVE = "relative"
+
+# what a node collects unless told otherwise, the original four metrics
+DEFAULT_COLLECTORS = ["cpu", "memory", "network", "storage"]
+
+
+class Collector:
+    """
+    One source of metrics.
+
+    read() returns a single value (reported under the collector's name) or a
+    dict {metric: value} for collectors that produce a family of metrics,
+    e.g. one per core or per interface. priority and delta are the defaults
+    for every metric it produces, METRIC_PRIORITIES / METRIC_DELTAS override
+    them per metric.
+    """
+
+    def __init__(self, name, read, interval=1.0, priority=PRIORITY_HIGH, delta=5.0, delta_kind=DELTA_POINTS):
+        self.name = name
+        self.read = read
+        self.interval = interval
+        self.priority = priority
+        self.delta = delta
+        self.delta_kind = delta_kind
+
+    def collect(self):
+        value = self.read()
+        if isinstance(value, dict):
+            return value
+        return {self.name: value}
+
+
+COLLECTORS = {}
+
+
+def register_collector(name, read, interval=1.0, priority=PRIORITY_HIGH, delta=5.0, delta_kind=DELTA_POINTS):
+    COLLECTORS[name] = Collector(name, read, interval, priority, delta, delta_kind)
+    return COLLECTORS[name]
+
+
+def get_collectors(names=None):
+    names = DEFAULT_COLLECTORS if names is None else names
+    unknown = [name for name in names if name not in COLLECTORS]
+    if unknown:
+        raise ValueError("unknown metric collectors: {}".format(", ".join(unknown)))
+    return [COLLECTORS[name] for name in names]
+
+
+def metric_collector(metric):
+    """Collector a metric came from, metrics of collector families are named <collector>.<item>"""
+    return COLLECTORS.get(metric) or COLLECTORS.get(metric.split('.', 1)[0])
+
+
+# built in collectors
+
+def read_cpu():
+    # non blocking, usage since the previous call
+    return psutil.cpu_percent()
+
+
+def read_memory():
+    return psutil.virtual_memory().percent
+
+
+def read_network():
+    counters = psutil.net_io_counters()
+    return counters.bytes_recv + counters.bytes_sent
+
+
+def read_storage():
+    return psutil.disk_usage('/').free
+
+
+def read_cpu_cores():
+    return {"cpu_cores.{}".format(index): value for index, value in enumerate(psutil.cpu_percent(percpu=True))}
+
+
+def read_network_interfaces():
+    return {"network_interfaces.{}".format(nic): counters.bytes_recv + counters.bytes_sent
+            for nic, counters in psutil.net_io_counters(pernic=True).items()}
+
+
+def read_disk_io():
+    return {"disk_io.{}".format(disk): counters.read_bytes + counters.write_bytes
+            for disk, counters in (psutil.disk_io_counters(perdisk=True) or {}).items()}
+
+
+def read_load():
+    load_1, load_5, load_15 = os.getloadavg()
+    return {"load.1m": load_1, "load.5m": load_5, "load.15m": load_15}
+
+
+register_collector("cpu", read_cpu, interval=1.0, priority=PRIORITY_HIGH, delta=5.0)
+register_collector("memory", read_memory, interval=2.0, priority=PRIORITY_MEDIUM, delta=7.0)
+register_collector("network", read_network, interval=2.0, priority=PRIORITY_MEDIUM, delta=15.0,
+                   delta_kind=DELTA_RELATIVE)
+register_collector("storage", read_storage, interval=10.0, priority=PRIORITY_LOW, delta=10.0,
+                   delta_kind=DELTA_RELATIVE)
+register_collector("cpu_cores", read_cpu_cores, interval=1.0, priority=PRIORITY_MEDIUM, delta=10.0)
+register_collector("network_interfaces", read_network_interfaces, interval=2.0, priority=PRIORITY_MEDIUM,
+                   delta=15.0, delta_kind=DELTA_RELATIVE)
+register_collector("disk_io", read_disk_io, interval=2.0, priority=PRIORITY_MEDIUM, delta=15.0,
+                   delta_kind=DELTA_RELATIVE)
+register_collector("load", read_load, interval=5.0, priority=PRIORITY_LOW, delta=0.5)
@@ -0,0 +1,182 @@
+import threading
+from collections import OrderedDict
+
+# how many past versions of every entry are kept around to build field deltas from
+VERSIONS_PER_KEY = 4
+
+_MISSING = object()
+
+
+class PeerSync:
+    """
+    Delta-state bookkeeping for one peer.
+
+    Each side reports its counters to the other as a stream of deltas. Every
+    report carries the epoch it was built on (base_epoch, 0 means a full
+    report) and the peer acknowledges the last epoch it applied. When the
+    acknowledged epoch doesn't match what we sent, a message got lost and the
+    next report is a full one again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # what we reported to the peer
+        self.sent_counters = {}
+        self.sent_epoch = 0
+        self.peer_ack = 0
+        # what the peer reported to us
+        self.view = {}
+        self.view_epoch = 0
+
+    def metadata_delta(self, counters):
+        """Counters that changed since the last report, returns (delta, base_epoch, epoch)"""
+        if self.peer_ack != self.sent_epoch:
+            # peer missed (or never got) our last report, send everything
+            self.sent_counters = {}
+        base_epoch = self.peer_ack if self.sent_counters else 0
+        delta = {k: c for k, c in counters.items() if self.sent_counters.get(k) != c}
+        for key in self.sent_counters:
+            if key not in counters:
+                delta[key] = None
+        if base_epoch == 0:
+            self.sent_counters = dict(counters)
+        else:
+            for key, counter in delta.items():
+                if counter is None:
+                    del self.sent_counters[key]
+                else:
+                    self.sent_counters[key] = counter
+        self.sent_epoch += 1
+        return delta, base_epoch, self.sent_epoch
+
+    def receive_report(self, message):
+        """Apply the peer's counter report, returns False if it was based on a report we never saw"""
+        self.peer_ack = message['ack']
+        if message['base_epoch'] == 0:
+            self.view = {}
+        elif message['base_epoch'] != self.view_epoch:
+            # keep the old view, it's only behind so we send more than needed
+            return False
+        for key, counter in message['metadata'].items():
+            if counter is None:
+                self.view.pop(key, None)
+            else:
+                self.view[key] = counter
+        self.view_epoch = message['epoch']
+        return True
+
+
+class EntryVersions:
+    """Last few versions of every entry, keyed by counter, to diff against what a peer already has"""
+
+    def __init__(self, per_key=VERSIONS_PER_KEY):
+        self.per_key = per_key
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def observe(self, state):
+        """Remember the current version of every entry and return {key: counter}"""
+        counters = {}
+        with self.lock:
+            for key in state:
+                entry = state[key]
+                if 'counter' not in entry:
+                    continue
+                counter = entry['counter']
+                counters[key] = counter
+                known = self.versions.setdefault(key, OrderedDict())
+                if counter not in known:
+                    known[counter] = entry
+                    if len(known) > self.per_key:
+                        known.popitem(last=False)
+        return counters
+
+    def get(self, key, counter):
+        with self.lock:
+            return self.versions.get(key, {}).get(counter)
+
+    def encode(self, key, entry, base_counter):
+        base_entry = self.get(key, base_counter) if base_counter is not None else None
+        if base_entry is None:
+            return {'entry': entry}
+        fields, removed = diff_entry(base_entry, entry)
+        item = {'base': base_counter, 'fields': fields}
+        if removed:
+            item['removed'] = removed
+        return item
+
+    def forget(self, key):
+        with self.lock:
+            self.versions.pop(key, None)
+
+
+def diff_entry(base_entry, entry):
+    """
+    (fields, removed) turning base_entry into entry: fields that differ, nested
+    sections diffed one level down, and the [name] / [name, key] paths entry
+    no longer has
+    """
+    fields = {}
+    removed = [[name] for name in base_entry if name not in entry]
+    for name, value in entry.items():
+        old_value = base_entry.get(name, _MISSING)
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            changed = {k: v for k, v in value.items() if old_value.get(k, _MISSING) != v}
+            if changed:
+                fields[name] = changed
+            removed.extend([name, k] for k in old_value if k not in value)
+        elif old_value is _MISSING or old_value != value:
+            fields[name] = value
+    return fields, removed
+
+
+def apply_delta(base_entry, fields, removed=()):
+    entry = dict(base_entry)
+    for path in removed:
+        if len(path) == 1:
+            entry.pop(path[0], None)
+        elif isinstance(entry.get(path[0]), dict):
+            section = dict(entry[path[0]])
+            section.pop(path[1], None)
+            entry[path[0]] = section
+    for name, value in fields.items():
+        if isinstance(value, dict) and isinstance(entry.get(name), dict):
+            section = dict(entry[name])
+            section.update(value)
+            entry[name] = section
+        else:
+            entry[name] = value
+    return entry
+
+
+def build_delta_message(sender, sync, state, versions):
+    """Counter report plus every entry the peer is behind on (as field delta when possible)"""
+    counters = versions.observe(state)
+    metadata, base_epoch, epoch = sync.metadata_delta(counters)
+    entries = {}
+    for key, counter in counters.items():
+        if sync.view_epoch == 0:
+            # never heard from this peer, its reply tells us what it is missing
+            break
+        known = sync.view.get(key)
+        if known is None or float(counter) > float(known):
+            entries[key] = versions.encode(key, state[key], known)
+    return {'sender': sender, 'metadata': metadata, 'base_epoch': base_epoch, 'epoch': epoch,
+            'ack': sync.view_epoch, 'entries': entries}
+
+
+def resolve_entries(state, entries):
+    """Turn received full entries / field deltas into full entries that are newer than ours"""
+    resolved = {}
+    for key, item in entries.items():
+        local = state.get(key)
+        if 'entry' in item:
+            entry = item['entry']
+        elif local is not None and local.get('counter') == item['base']:
+            entry = apply_delta(local, item['fields'], item.get('removed', ()))
+        else:
+            # delta against a version we don't have, the peer learns our counter from the next report
+            continue
+        if local is None or 'counter' not in local or float(entry['counter']) > float(local['counter']):
+            resolved[key] = entry
+    return resolved
@@ -0,0 +1,190 @@
+import math
+import threading
+import time
+from collections import deque
+
+# "counter" declares a peer dead after COUNTER_LIMIT failed exchanges in a row (the old behaviour),
+# "phi" uses the phi accrual detector below and confirms suspects with SWIM style probes
+DETECTOR_COUNTER = "counter"
+DETECTOR_PHI = "phi"
+COUNTER_LIMIT = 3
+
+# phi above which a peer becomes a suspect, 8 means roughly a 1 in 10^8 chance it is still alive
+DEFAULT_PHI_THRESHOLD = 8.0
+# heartbeat inter-arrival times kept per peer
+WINDOW_SIZE = 100
+# assumed interval until a peer has sent two heartbeats (entry counters advance once a second)
+FIRST_HEARTBEAT_ESTIMATE = 1.0
+# floor for the standard deviation, perfectly regular heartbeats would make phi jump
+MIN_STD_DEVIATION = 0.2
+# extra pause tolerated on top of the mean, covers gc pauses and slow rounds
+ACCEPTABLE_PAUSE = 1.0
+
+# peers asked to probe a suspect for us and the timeout of a single probe
+DEFAULT_INDIRECT_PROBES = 3
+PROBE_TIMEOUT = 0.5
+EVENT_HISTORY = 200
+
+
+def phi(elapsed, mean, std_deviation):
+    """-log10 of the chance that the next heartbeat comes later than elapsed, logistic approximation of the normal cdf"""
+    y = (elapsed - mean) / std_deviation
+    # clamped, far outside +-10 standard deviations the answer doesn't change anyway
+    e = math.exp(max(-700.0, min(700.0, -y * (1.5976 + 0.070566 * y * y))))
+    if elapsed > mean:
+        p_later = e / (1.0 + e)
+    else:
+        p_later = 1.0 - 1.0 / (1.0 + e)
+    return -math.log10(p_later) if p_later > 0 else float('inf')
+
+
+class FailureDetector:
+    """
+    Per peer heartbeat statistics and the failure decisions made from them.
+
+    A heartbeat is an advance of a peer's entry counter seen in gossip, so
+    peers are watched whether we exchange with them directly or not. In phi
+    mode a peer whose phi crosses the threshold, or whose exchange just
+    failed, becomes a suspect; suspects are probed directly and through
+    other peers before they are declared dead. Both modes log their
+    declarations so runs can compare detection time and false positives.
+    """
+
+    def __init__(self, mode=DETECTOR_COUNTER, threshold=DEFAULT_PHI_THRESHOLD, indirect_probes=DEFAULT_INDIRECT_PROBES):
+        self.mode = mode
+        self.threshold = threshold
+        self.indirect_probes = indirect_probes
+        # peer -> deque of inter-arrival seconds, peer -> last arrival
+        self.intervals = {}
+        self.last_arrival = {}
+        # peers being probed and peers declared dead (peer -> time)
+        self.probing = set()
+        self.dead = {}
+        # counter mode, failed exchanges in a row per peer
+        self.failed_exchanges = {}
+        self.events = deque(maxlen=EVENT_HISTORY)
+        self.counts = {'suspected': 0, 'probes': 0, 'direct_acks': 0, 'indirect_acks': 0, 'declared_dead': 0,
+                       'revived': 0}
+        self.lock = threading.Lock()
+
+    def heartbeat(self, peer, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            last = self.last_arrival.get(peer)
+            if last is not None:
+                self.intervals.setdefault(peer, deque(maxlen=WINDOW_SIZE)).append(now - last)
+            self.last_arrival[peer] = now
+            self.failed_exchanges.pop(peer, None)
+            if peer in self.dead:
+                # its counter moved again, whatever we declared was wrong or it came back
+                del self.dead[peer]
+                self.counts['revived'] += 1
+                self.events.append({'peer': peer, 'time': now, 'event': 'revived'})
+
+    def phi(self, peer, now=None):
+        now = time.time() if now is None else now
+        last = self.last_arrival.get(peer)
+        if last is None:
+            return 0.0
+        intervals = self.intervals.get(peer)
+        if intervals:
+            mean = sum(intervals) / len(intervals)
+            variance = sum((interval - mean) ** 2 for interval in intervals) / len(intervals)
+            std_deviation = max(math.sqrt(variance), MIN_STD_DEVIATION)
+        else:
+            mean, std_deviation = FIRST_HEARTBEAT_ESTIMATE, FIRST_HEARTBEAT_ESTIMATE / 4
+        return phi(now - last, mean + ACCEPTABLE_PAUSE, std_deviation)
+
+    def suspects(self, now=None):
+        """Peers over the threshold that are neither dead nor already being probed, marked as probing"""
+        now = time.time() if now is None else now
+        with self.lock:
+            found = [peer for peer in list(self.last_arrival)
+                     if peer not in self.dead and peer not in self.probing and self.phi(peer, now) > self.threshold]
+            for peer in found:
+                self._suspect(peer, now, 'phi')
+        return found
+
+    def exchange_failed(self, peer):
+        """
+        A failed exchange with peer. Phi mode: returns True if it should be probed now (only
+        peers we have heard from, not ones that aren't up yet). Counter mode: returns True
+        once the peer failed COUNTER_LIMIT times in a row.
+        """
+        now = time.time()
+        with self.lock:
+            if self.mode == DETECTOR_PHI:
+                if peer not in self.last_arrival or peer in self.dead or peer in self.probing:
+                    return False
+                self._suspect(peer, now, 'exchange')
+                return True
+            self.failed_exchanges[peer] = self.failed_exchanges.get(peer, 0) + 1
+            return self.failed_exchanges[peer] >= COUNTER_LIMIT and peer not in self.dead
+
+    def exchange_succeeded(self, peer):
+        self.failed_exchanges.pop(peer, None)
+
+    def _suspect(self, peer, now, reason):
+        self.probing.add(peer)
+        self.counts['suspected'] += 1
+        self.events.append({'peer': peer, 'time': now, 'event': 'suspected', 'reason': reason,
+                            'phi': round(self.phi(peer, now), 2)})
+
+    def probe_result(self, peer, direct_ack, indirect_ack):
+        now = time.time()
+        with self.lock:
+            self.probing.discard(peer)
+            self.counts['probes'] += 1
+            if direct_ack or indirect_ack:
+                self.counts['direct_acks' if direct_ack else 'indirect_acks'] += 1
+                # an ack is as good as a heartbeat, phi starts over from now
+                self.last_arrival[peer] = now
+                self.events.append({'peer': peer, 'time': now, 'event': 'cleared',
+                                    'by': 'direct' if direct_ack else 'indirect'})
+
+    def declare_dead(self, peer, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            if peer in self.dead:
+                return False
+            self.dead[peer] = now
+            self.probing.discard(peer)
+            self.failed_exchanges.pop(peer, None)
+            self.counts['declared_dead'] += 1
+            self.events.append({'peer': peer, 'time': now, 'event': 'dead'})
+            return True
+
+    def tombstoned(self, peer, now=None):
+        """Another node declared the peer dead and its tombstone reached us, it isn't watched anymore"""
+        now = time.time() if now is None else now
+        with self.lock:
+            self.intervals.pop(peer, None)
+            self.last_arrival.pop(peer, None)
+            self.failed_exchanges.pop(peer, None)
+            self.probing.discard(peer)
+            if peer not in self.dead:
+                self.dead[peer] = now
+                self.events.append({'peer': peer, 'time': now, 'event': 'dead', 'by': 'tombstone'})
+
+    def forget(self, peer):
+        """Drops everything kept for a peer that left the cluster"""
+        with self.lock:
+            self.intervals.pop(peer, None)
+            self.last_arrival.pop(peer, None)
+            self.failed_exchanges.pop(peer, None)
+            self.probing.discard(peer)
+            self.dead.pop(peer, None)
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            return {
+                'mode': self.mode,
+                'threshold': self.threshold,
+                'indirect_probes': self.indirect_probes,
+                'phi': {peer: round(self.phi(peer, now), 2) for peer in self.last_arrival},
+                'dead': dict(self.dead),
+                'probing': sorted(self.probing),
+                'counts': dict(self.counts),
+                'events': list(self.events)
+            }
@@ -0,0 +1,122 @@
+import time
+from collections import deque
+
+# "fixed" keeps the configured gossip rate and target count for the whole run,
+# "adaptive" lets GossipController move them within the configured bounds
+GOSSIP_FIXED = "fixed"
+GOSSIP_ADAPTIVE = "adaptive"
+
+# fresh entries per exchange as a share of the known peers: below LOW_FRESH
+# the exchanges mostly carry nothing new, above HIGH_FRESH gossip is falling
+# behind the changes
+LOW_FRESH = 0.1
+HIGH_FRESH = 0.6
+# calm rounds in a row before the controller starts to back off
+CALM_ROUNDS = 3
+# interval growth per calm round, halved again when fresh data piles up
+BACKOFF = 1.5
+# how many decisions /gossip_round_stats shows
+DECISION_HISTORY = 100
+
+# statuses of a peer exchange that count as a failure, PeerHealth uses the same set
+FAILED_STATUSES = ('dead', 'error', 'deadline')
+
+
+class GossipController:
+    """
+    Picks the gossip interval and fan-out of the next round from the stats of the last one.
+
+    Works like a trickle timer: while few fresh entries arrive the interval
+    grows and the fan-out shrinks one step per round, new nodes (nd) or
+    failed exchanges reset both to the fastest setting at once, and a high
+    share of fresh entries speeds gossip up again step by step. In fixed
+    mode it keeps the configured values and only records the stats.
+    """
+
+    def __init__(self, mode=GOSSIP_FIXED, gossip_rate=1.0, target_count=1,
+                 min_rate=None, max_rate=None, min_fanout=None, max_fanout=None):
+        self.mode = mode
+        self.min_rate = gossip_rate if min_rate is None else min_rate
+        self.max_rate = max(gossip_rate * 10, self.min_rate) if max_rate is None else max_rate
+        self.min_fanout = 1 if min_fanout is None else min_fanout
+        self.max_fanout = target_count if max_fanout is None else max_fanout
+        self.interval = gossip_rate
+        self.fanout = target_count
+        self.calm_rounds = 0
+        self.last_peer_count = None
+        self.decisions = deque(maxlen=DECISION_HISTORY)
+        self.reasons = {}
+        self.rounds = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.started = time.time()
+
+    def fanout_for(self, peer_count):
+        return max(0, min(self.fanout, peer_count))
+
+    def observe(self, cycle, round_stats, peer_count):
+        """Takes the stats of a finished round and decides interval and fan-out for the next one"""
+        self.rounds += 1
+        self.bytes_out += round_stats.get('bytes_out', 0)
+        self.bytes_in += round_stats.get('bytes_in', 0)
+        # every exchange can bring at most one fresh entry per peer
+        fresh_ratio = round_stats.get('fd', 0) / max(1, round_stats.get('exchanges', 0) * peer_count)
+        failures = sum(round_stats.get('peers_' + status, 0) for status in FAILED_STATUSES)
+        membership_changed = self.last_peer_count is not None and peer_count != self.last_peer_count
+        self.last_peer_count = peer_count
+
+        if fresh_ratio < LOW_FRESH:
+            self.calm_rounds += 1
+        else:
+            self.calm_rounds = 0
+
+        if self.mode != GOSSIP_ADAPTIVE:
+            reason = "fixed"
+        elif round_stats.get('nd', 0) > 0 or membership_changed:
+            reason = "churn"
+        elif failures:
+            reason = "failure"
+        elif fresh_ratio > HIGH_FRESH:
+            reason = "fresh"
+        elif self.calm_rounds >= CALM_ROUNDS:
+            reason = "calm"
+        else:
+            reason = "hold"
+
+        if reason in ("churn", "failure"):
+            self.interval = self.min_rate
+            self.fanout = self.max_fanout
+        elif reason == "fresh":
+            self.interval = max(self.min_rate, self.interval / 2)
+            self.fanout = min(self.max_fanout, self.fanout + 1)
+        elif reason == "calm":
+            self.interval = min(self.max_rate, self.interval * BACKOFF)
+            self.fanout = max(self.min_fanout, self.fanout - 1)
+
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        self.decisions.append({
+            'round': cycle,
+            'time': time.time(),
+            'fresh_ratio': round(fresh_ratio, 3),
+            'failures': failures,
+            'interval': round(self.interval, 4),
+            'fanout': self.fanout,
+            'reason': reason
+        })
+
+    def stats(self):
+        elapsed = time.time() - self.started
+        return {
+            'mode': self.mode,
+            'interval': self.interval,
+            'fanout': self.fanout,
+            'bounds': {'min_rate': self.min_rate, 'max_rate': self.max_rate,
+                       'min_fanout': self.min_fanout, 'max_fanout': self.max_fanout},
+            'rounds': self.rounds,
+            'rounds_per_s': round(self.rounds / elapsed, 3) if elapsed else None,
+            'bytes_out': self.bytes_out,
+            'bytes_in': self.bytes_in,
+            'bytes_out_per_s': round(self.bytes_out / elapsed, 1) if elapsed else None,
+            'reasons': self.reasons,
+            'decisions': list(self.decisions)
+        }
@@ -0,0 +1,33 @@
+import hashlib
+
+# every inner node of the summary tree covers this many children. ClusterState
+# keeps about 4 keys per bucket, so 64 buckets give levels of 1, 4 and 64
+# hashes and 4096 buckets (up to 16k keys) 1, 16, 256 and 4096: one /merkle_sync
+# round trip per level below the root, bytes growing with log(N). Past 16k keys
+# the bucket count stays at 4096 and only the scoped counter map grows
+MERKLE_FANOUT = 16
+# states up to this many keys skip the descent, their whole counter map is
+# about as small as one level of hashes and push_pull needs one round trip
+MERKLE_MIN_KEYS = 64
+
+
+def merkle_levels(bucket_hashes, fanout=MERKLE_FANOUT):
+    """Hash tree over the bucket hashes, levels[0] is [root] and levels[-1] the buckets"""
+    levels = [list(bucket_hashes)]
+    while len(levels[0]) > 1:
+        below = levels[0]
+        above = []
+        for start in range(0, len(below), fanout):
+            joined = "".join(below[start:start + fanout])
+            above.append(hashlib.sha1(joined.encode('utf-8')).hexdigest()[:16])
+        levels.insert(0, above)
+    return levels
+
+
+def child_indices(index, level_size, fanout=MERKLE_FANOUT):
+    return [child for child in range(index * fanout, (index + 1) * fanout) if child < level_size]
+
+
+def differing(own_hashes, their_hashes):
+    """Indices whose hash differs, their_hashes comes from json so its keys are strings"""
+    return sorted(int(index) for index, value in their_hashes.items() if own_hashes[int(index)] != value)
@@ -0,0 +1,96 @@
+import logging
+import threading
+import time
+
+from collectors import get_collectors
+
+
+class MetricSampler:
+    """
+    Runs the metric collectors on its own thread and keeps the latest reading of each metric.
+
+    Every collector has its own interval (its default, or the one from the
+    config), the gossip round only looks at the cached readings and never
+    waits on a system call.
+    """
+
+    def __init__(self, collectors=None, intervals=None):
+        # collector name -> Collector, see collectors.py
+        self.collectors = {collector.name: collector for collector in get_collectors(collectors)}
+        self.intervals = {name: collector.interval for name, collector in self.collectors.items()}
+        if intervals:
+            self.intervals.update(intervals)
+        # metric -> (value, time it was read), each key is only ever replaced
+        self.readings = {}
+        self.samples = {name: 0 for name in self.collectors}
+        self.sample_seconds = {name: 0.0 for name in self.collectors}
+        self.metric_counts = {name: 0 for name in self.collectors}
+        self.read_at = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def configure(self, intervals):
+        self.intervals.update(intervals)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        # one synchronous pass so the first round already has every metric
+        for name in self.collectors:
+            self.sample(name)
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._loop, name="metric-sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _loop(self):
+        next_due = {name: time.time() + self.interval(name) for name in self.collectors}
+        while not self.stop_event.is_set():
+            now = time.time()
+            for name, due in next_due.items():
+                if due <= now:
+                    self.sample(name)
+                    next_due[name] = now + self.interval(name)
+            self.stop_event.wait(max(0.0, min(next_due.values()) - time.time()))
+
+    def interval(self, name):
+        return self.intervals.get(name, min(self.intervals.values()))
+
+    def sample(self, name):
+        started = time.perf_counter()
+        try:
+            metrics = self.collectors[name].collect()
+        except Exception as e:
+            # keep serving the previous readings
+            logging.error("Metric collector {} failed: {}".format(name, e))
+            return
+        now = time.time()
+        for metric, value in metrics.items():
+            self.readings[metric] = (value, now)
+        self.read_at[name] = now
+        self.metric_counts[name] = len(metrics)
+        self.samples[name] += 1
+        self.sample_seconds[name] += time.perf_counter() - started
+
+    def latest(self):
+        """{metric: value} of the cached readings, no system calls"""
+        return {metric: reading[0] for metric, reading in list(self.readings.items())}
+
+    def stats(self):
+        now = time.time()
+        return {
+            name: {
+                'interval': self.interval(name),
+                'metrics': self.metric_counts[name],
+                'samples': self.samples[name],
+                'avg_read_us': round(self.sample_seconds[name] / self.samples[name] * 1e6, 1)
+                if self.samples[name] else None,
+                'age': round(now - self.read_at[name], 3) if name in self.read_at else None
+            }
+            for name in self.collectors
+        }
@@ -1,19 +1,33 @@
+import asyncio
 import time
-import psutil
+import concurrent.futures
 import requests
 from singleton import Singleton
 import logging
-import secrets
-from utility import mk_digest
+from utility import mk_digest, MetadataView
+from snapshot_store import SnapshotStore
+from cluster_state import ClusterState
+from delta import PeerSync, EntryVersions, build_delta_message, resolve_entries
+from merkle import merkle_levels, child_indices, differing, MERKLE_MIN_KEYS
+from state_writer import StateWriter
+from metric_sampler import MetricSampler
+from collectors import PRIORITY_HIGH, PRIORITY_MEDIUM, PRIORITY_LOW
+from priority_eval import PriorityEvaluator
+from gossip_control import GossipController, GOSSIP_FIXED
+from peer_sampling import PeerView, DEFAULT_VIEW_SIZE, DEFAULT_SHUFFLE_LENGTH, DEFAULT_SHUFFLE_INTERVAL, peer_key
+from failure_detector import FailureDetector, DETECTOR_COUNTER, DETECTOR_PHI, DEFAULT_PHI_THRESHOLD, \
+    DEFAULT_INDIRECT_PROBES, PROBE_TIMEOUT
+from peer_health import PeerHealth, DEFAULT_BASE_BACKOFF, DEFAULT_MAX_BACKOFF
+from archiver import Archiver, DEFAULT_ARCHIVE_INTERVAL, DEFAULT_SPILL_BYTES
+from reporter import Reporter, DEFAULT_REPORT_INTERVAL, DEFAULT_SUMMARY_LATENCY
+from state_log import StateLog, DEFAULT_COMPACT_BYTES
+from tombstones import Graveyard, DEFAULT_TOMBSTONE_TTL, BURIED_TTL_FACTOR, is_tombstone, make_tombstone
+import wire
 
 logger = logging.getLogger("demon.metrics")
 
-# Priority levels
-PRIORITY_HIGH = 1     # Update every round
-PRIORITY_MEDIUM = 5   # Update every 5 rounds
-PRIORITY_LOW = 10     # Update every 10 rounds
-
-# Configure priorities for different metrics
+# Configure priorities for different metrics, metrics not listed here use the
+# defaults of their collector (see collectors.py), a collector name sets all of its metrics
 METRIC_PRIORITIES = {
     "cpu": PRIORITY_HIGH,      # CPU is critical - update every round
     "memory": PRIORITY_MEDIUM, # Memory - update every 5 rounds
@@ -29,32 +43,38 @@ METRIC_DELTAS = {
     "storage": 10.0  # 10% change in storage
 }
 
-# Track last values to calculate deltas
-last_metric_values = {}
-# Track when each metric was last sent
-last_metric_sent_round = {}
+# Gossip fan-out: "sequential" contacts the selected peers one after another,
+# "parallel" contacts all of them at once and gives up on whatever is still
+# running once the round deadline (seconds) has passed, the http timeouts of
+# the exchanges are capped to it so no worker outlives the round
+FANOUT_SEQUENTIAL = "sequential"
+FANOUT_PARALLEL = "parallel"
+DEFAULT_ROUND_DEADLINE = 5.0
+
+# Exchange protocol: "two_phase" is POST /receive_metadata followed by GET /receive_message,
+# "push_pull" does the whole reconciliation with one POST /push_pull and falls back
+# to two_phase for peers that don't know the endpoint, "delta" is push_pull with
+# per-peer version tracking so only changed counters and changed fields travel,
+# "merkle" first compares hash summaries and then runs push_pull on the differing buckets only
+EXCHANGE_TWO_PHASE = "two_phase"
+EXCHANGE_PUSH_PULL = "push_pull"
+EXCHANGE_DELTA = "delta"
+EXCHANGE_MERKLE = "merkle"
+
+# Wire format: "binary" advertises wire.WIRE_CONTENT_TYPE (zlib framed json) and switches
+# to it for every peer that answers in it, peers that keep answering json stay on json
+WIRE_JSON = "json"
+WIRE_BINARY = "binary"
+
 
 def get_new_data():
     node = Node.instance()
-    network = psutil.net_io_counters().bytes_recv + psutil.net_io_counters().bytes_sent
-    
-    # Get current metric values
-    current_metrics = {
-        "cpu": psutil.cpu_percent(),
-        "memory": psutil.virtual_memory().percent,
-        "network": network,
-        "storage": psutil.disk_usage('/').free
-    }
-    
-    # Determine which metrics to send based on priority and delta
-    metrics_to_send = {}
-    metrics_filtered = {}
+
+    # Get current metric values, read by the background sampler so the round never waits on psutil
+    current_metrics = node.metric_sampler.latest()
     
-    for metric, value in current_metrics.items():
-        if should_send_metric(node, metric, value):
-            metrics_to_send[metric] = value
-        else:
-            metrics_filtered[metric] = value
+    # Determine which metrics to send based on priority and delta, all metrics in one pass
+    metrics_to_send, metrics_filtered = node.priority_evaluator.evaluate(current_metrics, node.cycle)
     
     # Create the data structure with only selected metrics
     app_state = {}
@@ -93,60 +113,16 @@ def get_new_data():
     return data
 
 
-def should_send_metric(node, metric, value):
-    if metric not in last_metric_values:
-        last_metric_values[metric] = value
-        last_metric_sent_round[metric] = 0
-        return True  # Always send first time
-        
-    # Get priority for this metric
-    priority = METRIC_PRIORITIES.get(metric, PRIORITY_HIGH)
-    
-    # Calculate rounds since last sent
-    rounds_since_sent = node.cycle - last_metric_sent_round[metric]
-    
-    # Calculate delta (percent change) for numeric metrics
-    if isinstance(value, (int, float)) and isinstance(last_metric_values[metric], (int, float)) and last_metric_values[metric] != 0:
-        if metric == "network" or metric == "storage":
-            # For network and storage, calculate absolute change
-            delta_percent = abs(value - last_metric_values[metric]) / max(value, last_metric_values[metric]) * 100
-        else:
-            # For CPU and memory, calculate percentage point change
-            delta_percent = abs(value - last_metric_values[metric])
-    else:
-        delta_percent = float('inf')  # Always send non-numeric or zero-based values
-        
-    # Determine if we should send this metric
-    should_send = False
-    
-    # Always send high priority metrics
-    if priority == PRIORITY_HIGH:
-        should_send = True
-    # Send medium/low priority metrics based on schedule or significant change
-    elif rounds_since_sent >= priority:
-        should_send = True
-    # Send if significant change detected
-    elif delta_percent >= METRIC_DELTAS.get(metric, 0):
-        should_send = True
-        
-    # Update last sent round if sending
-    if should_send:
-        last_metric_sent_round[metric] = node.cycle
-    
-    # Always update last value for future delta calculations
-    last_metric_values[metric] = value
-    
-    logger.debug(f"METRIC_PRIORITY: metric={metric}, value={value:.2f}, priority={priority}, " +
-                f"delta={delta_percent:.2f}%, rounds_since_sent={rounds_since_sent}, decision={'SEND' if should_send else 'SKIP'}")
-    
-    return should_send
 @Singleton
 class Node:
     def __init__(self):
         self.ip = None
         self.port = None
         self.cycle = None
-        self.node_list = None
+        # bounded random view of the cluster instead of the full node list, see peer_sampling.py
+        self.peer_view = None
+        self.shuffle_interval = DEFAULT_SHUFFLE_INTERVAL
+        self.next_shuffle = 0
         self.data = None
         self.data_flow_per_round = None
         self.is_alive = None
@@ -158,21 +134,117 @@ class Node:
         self.client_thread = None
         self.counter_thread = None
         self.data_flow_per_round = None
-        self.session_to_monitoring = requests.Session()
         self.gossip_session = requests.Session()
         self.push_mode = None
         self.is_send_data_back = None
         self.metric_last_sent = {}
+        self.fanout_mode = FANOUT_SEQUENTIAL
+        self.round_deadline = DEFAULT_ROUND_DEADLINE
+        self.gossip_pool = None
+        self.last_round_outcomes = {}
+        self.peer_outcome_totals = {}
+        self.exchange_mode = EXCHANGE_TWO_PHASE
+        # counters each peer held after our last push_pull with it, newer entries go with the next request
+        self.peer_counters = {}
+        self.legacy_peers = set()
+        self.peer_syncs = {}
+        self.entry_versions = EntryVersions()
+        self.wire_format = WIRE_JSON
+        self.binary_peers = set()
+        self.metadata_view = MetadataView()
+        self.writer = None
+        self.metric_sampler = MetricSampler()
+        self.priority_evaluator = PriorityEvaluator(METRIC_PRIORITIES, METRIC_DELTAS)
+        self.gossip_control = GOSSIP_FIXED
+        self.gossip_bounds = {}
+        self.gossip_controller = GossipController()
+        self.failure_detector = FailureDetector()
+        # suspects are probed off the gossip thread
+        self.probe_pool = None
+        # circuit breaker per peer, consulted when picking the peers of a round
+        self.peer_health = PeerHealth()
+        # dead nodes are replaced by tombstones that are collected after tombstone_ttl seconds
+        self.tombstone_ttl = DEFAULT_TOMBSTONE_TTL
+        self.graveyard = Graveyard()
+        self.next_collection = 0
+        self.live_tombstones = 0
+        # push mode ships the snapshot history from its own thread, see archiver.py
+        self.archiver = None
+        self.archive_interval = DEFAULT_ARCHIVE_INTERVAL
+        self.archive_spill_bytes = DEFAULT_SPILL_BYTES
+        # is_send_data_back reports coalesced on their own thread, see reporter.py
+        self.reporter = None
+        self.report_interval = DEFAULT_REPORT_INTERVAL
+        self.report_summary_latency = DEFAULT_SUMMARY_LATENCY
+        # optional local log of the state that a restarted agent reloads, see state_log.py
+        self.state_log = None
 
     def set_params(self, ip, port, cycle, node_list, data, is_alive, gossip_counter, failure_counter,
-                   monitoring_address, database_address, is_send_data_back, client_thread, counter_thread, data_flow_per_round, push_mode, client_port):
+                   monitoring_address, database_address, is_send_data_back, client_thread, counter_thread, data_flow_per_round, push_mode, client_port,
+                   snapshot_retention=None, snapshot_max_age=None,
+                   fanout_mode=FANOUT_SEQUENTIAL, round_deadline=DEFAULT_ROUND_DEADLINE,
+                   exchange_mode=EXCHANGE_TWO_PHASE, wire_format=WIRE_JSON, metric_sample_intervals=None,
+                   collectors=None, gossip_control=GOSSIP_FIXED, gossip_bounds=None,
+                   view_size=DEFAULT_VIEW_SIZE, shuffle_length=DEFAULT_SHUFFLE_LENGTH,
+                   shuffle_interval=DEFAULT_SHUFFLE_INTERVAL, failure_detection=DETECTOR_COUNTER,
+                   phi_threshold=DEFAULT_PHI_THRESHOLD, indirect_probes=DEFAULT_INDIRECT_PROBES,
+                   health_backoff=DEFAULT_BASE_BACKOFF, health_max_backoff=DEFAULT_MAX_BACKOFF,
+                   tombstone_ttl=DEFAULT_TOMBSTONE_TTL, archive_interval=DEFAULT_ARCHIVE_INTERVAL,
+                   archive_spill_bytes=DEFAULT_SPILL_BYTES, report_interval=DEFAULT_REPORT_INTERVAL,
+                   report_summary_latency=DEFAULT_SUMMARY_LATENCY, state_log=None,
+                   state_log_compact_bytes=DEFAULT_COMPACT_BYTES):
         self.ip = ip
         self.port = port
         self.monitoring_address = monitoring_address
         self.database_address = database_address
         self.cycle = cycle
-        self.node_list = node_list
-        self.data = data
+        # the node list from the orchestrator only bootstraps the view
+        self.peer_view = PeerView(f"{ip}:{port}", view_size, shuffle_length)
+        self.peer_view.seed(node_list)
+        self.shuffle_interval = shuffle_interval
+        self.next_shuffle = time.time() + shuffle_interval
+        self.failure_detector = FailureDetector(failure_detection, phi_threshold, indirect_probes)
+        self.peer_health = PeerHealth(health_backoff, health_max_backoff)
+        self.tombstone_ttl = tombstone_ttl
+        self.graveyard = Graveyard(tombstone_ttl * BURIED_TTL_FACTOR)
+        self.next_collection = time.time() + tombstone_ttl / 4
+        self.live_tombstones = 0
+        self.archive_interval = archive_interval
+        self.archive_spill_bytes = archive_spill_bytes
+        self.report_interval = report_interval
+        self.report_summary_latency = report_summary_latency
+        self.state_log = None
+        if state_log:
+            self.state_log = StateLog(state_log, lambda: self.data.latest(), compact_bytes=state_log_compact_bytes)
+            restored = self.state_log.load()
+            if restored:
+                # warm restart, gossip only has to bring in what changed while we were gone
+                data = {0: ClusterState(restored)}
+                own_entry = restored.get(f"{ip}:{port}")
+                if own_entry is not None and 'counter' in own_entry:
+                    # peers hold our old counter and ignore anything that isn't higher, the log
+                    # can be up to one interval behind what they saw last
+                    gossip_counter = max(gossip_counter,
+                                         int(float(own_entry['counter'])) + int(self.state_log.interval) + 2)
+                print("Restored {} entries from {} in {} ms".format(
+                    len(restored), state_log, self.state_log.counts['load_ms']), flush=True)
+        # history of snapshots, bounded so long running nodes don't grow with uptime
+        if isinstance(data, SnapshotStore):
+            self.data = data
+        else:
+            self.data = SnapshotStore(data)
+        if snapshot_retention is not None:
+            self.data.max_snapshots = snapshot_retention
+        if snapshot_max_age is not None:
+            self.data.max_age = snapshot_max_age
+        # every change of self.data goes through the writer, see state_writer.py
+        if self.writer:
+            self.writer.stop()
+        self.writer = StateWriter(self.data, lambda: self.gossip_counter)
+        self.writer.start()
+        self.metric_sampler.stop()
+        self.metric_sampler = MetricSampler(collectors=collectors, intervals=metric_sample_intervals)
+        self.priority_evaluator = PriorityEvaluator(METRIC_PRIORITIES, METRIC_DELTAS)
         self.is_alive = is_alive
         self.gossip_counter = gossip_counter
         self.failure_counter = failure_counter
@@ -182,58 +254,306 @@ class Node:
         self.is_send_data_back = is_send_data_back
         self.push_mode = push_mode
         self.client_port = client_port
+        self.fanout_mode = fanout_mode
+        self.round_deadline = round_deadline
+        self.last_round_outcomes = {}
+        self.peer_outcome_totals = {}
+        self.exchange_mode = exchange_mode
+        self.peer_counters = {}
+        self.legacy_peers = set()
+        self.peer_syncs = {}
+        self.entry_versions = EntryVersions()
+        self.wire_format = wire_format
+        self.binary_peers = set()
+        self.metadata_view = MetadataView()
+        # interval and fan-out of every round, see gossip_control.py
+        self.gossip_control = gossip_control
+        self.gossip_bounds = gossip_bounds or {}
 
-    def get_random_nodes(self, node_list, target_count):
-        filtered_nodes = [node for node in node_list if node['ip'] != self.ip]
-        return secrets.SystemRandom().sample(filtered_nodes, target_count)
+    def get_random_nodes(self, target_count):
+        # the whole view in random order, peers behind an open circuit are passed over
+        selected, skipped = self.peer_health.select(self.peer_view.sample(len(self.peer_view)), target_count)
+        self.data_flow_per_round.setdefault(self.cycle, {})['peers_skipped'] = skipped
+        return selected
     
     def start_gossip_counter(self):
         while self.is_alive:
             self.gossip_counter += 1
             time.sleep(1)
 
+    async def start_gossip_counter_async(self):
+        # asyncio serving mode, see aio_server.py
+        while self.is_alive:
+            self.gossip_counter += 1
+            await asyncio.sleep(1)
+
     def start_gossiping(self, target_count, gossip_rate):
+        self.prepare_gossiping(target_count, gossip_rate)
+        while self.is_alive:
+            self.gossip_round()
+            time.sleep(self.gossip_controller.interval)
+        self.finish_gossiping()
+
+    async def start_gossiping_async(self, target_count, gossip_rate):
+        """start_gossiping for the asyncio serving mode, rounds are scheduled on the event loop"""
+        loop = asyncio.get_running_loop()
+        self.prepare_gossiping(target_count, gossip_rate)
+        while self.is_alive:
+            # the exchanges are still blocking http calls, so the round itself runs off the loop
+            await loop.run_in_executor(None, self.gossip_round)
+            await asyncio.sleep(self.gossip_controller.interval)
+        # joins the sampler, archiver, reporter and state log threads
+        await loop.run_in_executor(None, self.finish_gossiping)
+
+    def prepare_gossiping(self, target_count, gossip_rate):
         print("Starting gossiping with target count: {} and gossip rate: {} and length of node list: {}".format(
-            target_count, gossip_rate, len(self.node_list)),
+            target_count, gossip_rate, len(self.peer_view)),
             flush=True)
-        while self.is_alive:
-            if self.push_mode == "1":
-                print("Pushing data", flush=True)
-                if self.cycle % 10 == 0 and self.cycle != 0:
-                    self.push_latest_data_and_delete_after_push()
-            self.cycle += 1
-            self.transmit(target_count)
-            time.sleep(gossip_rate)
+        self.metric_sampler.start()
+        self.gossip_controller = GossipController(self.gossip_control, gossip_rate, target_count, **self.gossip_bounds)
+        max_fanout = max(target_count, self.gossip_controller.max_fanout)
+        self.probe_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="probe")
+        if self.push_mode == "1":
+            self.archiver = Archiver(
+                'http://{}:{}/push_archive_batch?ip={}&port={}'.format(self.monitoring_address, self.client_port,
+                                                                      self.ip, self.port),
+                lambda: self.writer.run(lambda state: self.data.pop_history()),
+                self.archive_interval, self.archive_spill_bytes)
+            self.archiver.start()
+        if self.state_log:
+            self.state_log.start()
+        if self.is_send_data_back == "1":
+            self.reporter = Reporter(
+                'http://{}:{}/receive_node_report?ip={}&port={}'.format(self.monitoring_address, self.client_port,
+                                                                       self.ip, self.port),
+                self.data.latest, lambda: dict(self.data_flow_per_round.get(self.cycle, {})),
+                f"{self.ip}:{self.port}", self.report_interval, self.report_summary_latency)
+            self.reporter.start()
+        if self.fanout_mode == FANOUT_PARALLEL:
+            self.gossip_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_fanout,
+                                                                     thread_name_prefix="gossip")
+            # one pooled connection per concurrent peer
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(max_fanout, 10))
+            self.gossip_session.mount('http://', adapter)
+
+    def gossip_round(self):
+        if self.cycle > 0:
+            # the finished round, including the exchanges peers started with us while we slept
+            latest = self.data.latest()
+            known_peers = len(latest) - 1 if latest is not None else 0
+            self.gossip_controller.observe(self.cycle, self.data_flow_per_round.get(self.cycle, {}), known_peers)
+        self.cycle += 1
+        fanout = self.gossip_controller.fanout_for(len(self.peer_view))
+        round_stats = self.data_flow_per_round.setdefault(self.cycle, {})
+        round_stats['gossip_interval'] = self.gossip_controller.interval
+        round_stats['fanout'] = fanout
+        self.transmit(fanout)
+        if self.failure_detector.mode == DETECTOR_PHI:
+            for suspect in self.failure_detector.suspects():
+                self.probe_pool.submit(self.probe_suspect, suspect)
+        if time.time() >= self.next_shuffle:
+            self.shuffle_view()
+            self.next_shuffle = time.time() + self.shuffle_interval
+        if time.time() >= self.next_collection:
+            self.writer.submit(self.collect_tombstones)
+            self.next_collection = time.time() + self.tombstone_ttl / 4
+
+    def probe_suspect(self, suspect_key):
+        """SWIM style confirmation: ping the suspect, then ask a few other peers to ping it"""
+        ip, port = suspect_key.split(':')
+        target = {"ip": ip, "port": port}
+        direct_ack = self.ping(target)
+        if direct_ack:
+            self.peer_health.record_success(suspect_key)
+        indirect_ack = not direct_ack and self.indirect_ping(target)
+        self.failure_detector.probe_result(suspect_key, direct_ack, indirect_ack)
+        if not (direct_ack or indirect_ack):
+            self.writer.submit(self.mark_peer_dead, suspect_key)
+
+    def ping(self, target):
+        try:
+            return requests.get('http://' + target["ip"] + ':5000/ping', timeout=PROBE_TIMEOUT).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def indirect_ping(self, target):
+        target_key = peer_key(target)
+        helpers = [peer for peer in self.peer_view.sample(self.failure_detector.indirect_probes + 1)
+                   if peer_key(peer) != target_key][:self.failure_detector.indirect_probes]
+        if not helpers:
+            return False
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(helpers)) as pool:
+            return any(pool.map(lambda helper: self.ping_through(helper, target_key), helpers))
+
+    def ping_through(self, helper, target_key):
+        try:
+            response = requests.post('http://' + helper["ip"] + ':5000/ping_req', json={'target': target_key},
+                                     timeout=PROBE_TIMEOUT * 3)
+            return response.status_code == 200 and response.json().get('ack', False)
+        except (requests.exceptions.RequestException, ValueError):
+            return False
+
+    def note_heartbeat(self, key, entry=None):
+        # an entry counter advanced, that's the heartbeat the failure detector works on
+        if key == f"{self.ip}:{self.port}":
+            return
+        if is_tombstone(entry):
+            # the cluster declared it dead, stop watching and trying it
+            self.failure_detector.tombstoned(key)
+            self.peer_health.forget(key)
+            self.delete_node_from_nodelist(key)
+        else:
+            self.failure_detector.heartbeat(key)
+
+    def admits(self, key, entry):
+        """False for copies of collected entries and for tombstones of ourselves"""
+        if key == f"{self.ip}:{self.port}":
+            return not is_tombstone(entry)
+        return not self.graveyard.blocks(key, entry.get('counter'))
+
+    def collect_tombstones(self, state):
+        # runs on the writer, drops tombstones older than the ttl and everything kept per peer for them
+        now = time.time()
+        expired = []
+        live = 0
+        for key in state:
+            entry = state[key]
+            if is_tombstone(entry):
+                if now - entry['tombstone'] >= self.tombstone_ttl:
+                    expired.append(key)
+                else:
+                    live += 1
+        for key in expired:
+            self.graveyard.bury(key, state[key]['counter'], now)
+            del state[key]
+            self.forget_peer(key)
+        self.graveyard.expire(now)
+        self.live_tombstones = live
+
+    def forget_peer(self, key):
+        self.delete_node_from_nodelist(key)
+        self.failure_detector.forget(key)
+        self.peer_health.forget(key)
+        self.entry_versions.forget(key)
+        self.peer_syncs.pop(key, None)
+        self.peer_counters.pop(key, None)
+        self.legacy_peers.discard(key)
+        self.binary_peers.discard(key)
+
+    def shuffle_view(self):
+        """Active side of a Cyclon shuffle with the oldest peer of the view"""
+        started = self.peer_view.start_shuffle({"ip": self.ip, "port": self.port})
+        if started is None:
+            return
+        target, sent = started
+        outcome = {}
+        try:
+            status_code, reply = self.peer_request(target, '/shuffle', {'entries': sent}, outcome)
+        except Exception as e:
+            logging.error("Shuffle with node {} failed: {}".format(target, e))
+            status_code, reply = None, None
+        if status_code == 200 and reply is not None:
+            self.peer_view.finish_shuffle(target, sent, reply['entries'])
+        else:
+            # a peer that doesn't answer stays out of the view
+            self.peer_view.shuffle_failures += 1
+            self.peer_health.record_failure(peer_key(target))
+            self.writer.submit(self.update_failure_data, target)
+
+    def finish_gossiping(self):
+        self.metric_sampler.stop()
+        if self.archiver:
+            self.archiver.stop()
+        if self.reporter:
+            self.reporter.stop()
+        if self.state_log:
+            self.state_log.stop()
+        if self.probe_pool:
+            self.probe_pool.shutdown(wait=False)
+            self.probe_pool = None
+        if self.gossip_pool:
+            self.gossip_pool.shutdown(wait=False)
+            self.gossip_pool = None
 
     # Transmit data to randomly selected nodes (target_count)
     def transmit(self, target_count):
-        new_time_key = self.gossip_counter
+        # the round works on the snapshot that holds our fresh entry, later
+        # snapshots published by the writer don't change it
+        self.writer.run(self.refresh_own_entry)
+        new_time_key = self.data.latest_key()
+
+        random_nodes = self.get_random_nodes(target_count)
 
-        if self.data:
-            latest_entry = max(self.data.keys(), key=int)
-            latest_data = self.data[latest_entry].copy()
+        round_start = time.time()
+        if self.fanout_mode == FANOUT_PARALLEL and self.gossip_pool:
+            outcomes = self.fan_out(random_nodes, new_time_key)
         else:
-            latest_data = {}
+            outcomes = {}
+            for node in random_nodes:
+                outcomes[node["ip"] + ':' + node["port"]] = self.send_to_node(node, new_time_key)
+        round_time = time.time() - round_start
+        for peer, outcome in outcomes.items():
+            self.peer_health.record(peer, outcome['status'])
+        self.writer.submit(lambda state: self.record_round_outcomes(outcomes, round_time))
 
-        latest_data[f"{self.ip}:{self.port}"] = get_new_data()
-        self.data[new_time_key] = latest_data
+    def refresh_own_entry(self, state):
+        state[f"{self.ip}:{self.port}"] = get_new_data()
 
-        random_nodes = self.get_random_nodes(self.node_list, target_count)
+    def fan_out(self, random_nodes, new_time_key):
+        """Exchange with all selected peers at once, bounded by the round deadline"""
+        # every peer of this round gets the same payload, built before the workers start reading
+        data = self.prepare_metadata_and_own_fresh_data(new_time_key)
+        deadline = time.time() + self.round_deadline
+        futures = {self.gossip_pool.submit(self.exchange_with_node, node, new_time_key, data, deadline): node
+                   for node in random_nodes}
+        done, _ = concurrent.futures.wait(futures, timeout=self.round_deadline)
+
+        # results go to the writer from the gossip thread, never from the workers,
+        # and usually end up in a single new snapshot
+        outcomes = {}
+        merges = []
+        for future, node in futures.items():
+            if future in done:
+                outcome = future.result()
+            elif future.cancel():
+                # never got a worker, that says nothing about the peer
+                outcome = {'status': 'not_started', 'updates': {}, 'latency': 0.0}
+            else:
+                # its request times out with the deadline, the worker is free right after
+                outcome = {'status': 'deadline', 'updates': {}, 'latency': self.round_deadline}
+            merges.append(self.apply_exchange_outcome(node, outcome))
+            outcomes[node["ip"] + ':' + node["port"]] = outcome
+        concurrent.futures.wait([merge for merge in merges if merge is not None])
+        return outcomes
 
-        for node in random_nodes:
-            self.send_to_node(node, new_time_key)
+    def record_round_outcomes(self, outcomes, round_time):
+        self.last_round_outcomes = {peer: {'status': o['status'], 'latency': round(o['latency'], 4)}
+                                    for peer, o in outcomes.items()}
+        round_stats = self.data_flow_per_round.setdefault(self.cycle, {})
+        round_stats['round_time'] = round_time
+        round_stats['bytes_out'] = sum(o.get('bytes_out', 0) for o in outcomes.values())
+        round_stats['bytes_in'] = sum(o.get('bytes_in', 0) for o in outcomes.values())
+        round_stats['exchanges'] = round_stats.get('exchanges', 0) + \
+            sum(1 for o in outcomes.values() if o['status'] == 'ok')
+        for outcome in outcomes.values():
+            round_stats.setdefault('peers_' + outcome['status'], 0)
+            round_stats['peers_' + outcome['status']] += 1
+            self.peer_outcome_totals.setdefault(outcome['status'], 0)
+            self.peer_outcome_totals[outcome['status']] += 1
 
-    def prepare_metadata_and_own_fresh_data(self, time_key):
+    def prepare_metadata_and_own_fresh_data(self, time_key, scope=None):
         own_key = f"{self.ip}:{self.port}"
         time_data = self.data[time_key]
         own_recent_data = time_data[own_key]
 
         filtered_own_data = self.get_filtered_data_by_priority(own_recent_data)
 
+        # scope limits the metadata to some buckets of the state (merkle exchange)
+        keys = time_data.keys_in_buckets(scope) if scope is not None else list(time_data)
         metadata = {
-            key: node_data['counter']
-            for key, node_data in time_data.items()
-            if key != own_key and 'counter' in node_data
+            key: time_data[key]['counter']
+            for key in keys
+            if key != own_key and 'counter' in time_data[key]
         }
 
         return {'metadata': metadata, own_key: filtered_own_data}
@@ -244,18 +564,24 @@ class Node:
             requested_data[key] = self.data[time_key][key]
         return requested_data
     
-    def update_own_data(self, updates, new_time_key):
+    def update_own_data(self, updates, state):
         for u_key in updates:
+            if not self.admits(u_key, updates[u_key]):
+                continue
             self.data_flow_per_round.setdefault(self.cycle, {})
-            if u_key in self.data[new_time_key]:
-                self.data_flow_per_round[self.cycle].setdefault('fd', 0)
-                self.data_flow_per_round[self.cycle]['fd'] += 1
+            if u_key in state:
+                # only a higher counter is fresh data, peers also send back their copy of our own entry
+                if float(updates[u_key].get('counter', 0)) > float(state[u_key].get('counter', 0)):
+                    self.data_flow_per_round[self.cycle].setdefault('fd', 0)
+                    self.data_flow_per_round[self.cycle]['fd'] += 1
+                    self.note_heartbeat(u_key, updates[u_key])
             else:
+                self.note_heartbeat(u_key, updates[u_key])
                 self.data_flow_per_round[self.cycle].setdefault('nd', 0)
                 self.data_flow_per_round[self.cycle].setdefault('fd', 0)
                 self.data_flow_per_round[self.cycle]['nd'] += 1
                 self.data_flow_per_round[self.cycle]['fd'] += 1
-            self.data[new_time_key][u_key] = updates[u_key]
+            state[u_key] = updates[u_key]
 
         pass
     def get_filtered_data_by_priority(self, full_data):
@@ -266,18 +592,19 @@ class Node:
         filtered_data = full_data.copy()
         # not filtering if first cycle
         if self.cycle <= 1:
-            for metric in METRIC_PRIORITIES:
+            for metric in filtered_data.get("appState", {}):
                 self.metric_last_sent[metric] = self.cycle
             return filtered_data
         
         if "appState" in filtered_data:
             app_state = filtered_data["appState"].copy()
-            for metric, priority in METRIC_PRIORITIES.items():
+            # every metric the collectors produced, with the priority the evaluator uses for it
+            for metric in filtered_data["appState"]:
+                priority = self.priority_evaluator.rule(metric)[0]
                 last_sent = self.metric_last_sent.get(metric, 0)
                 if (self.cycle - last_sent) < priority:
                     # Remove metrics that don't need to be sent this round
-                    if metric in app_state:
-                        app_state[metric] = "not_updated"
+                    app_state[metric] = "not_updated"
                 else:
                     # Update last sent time for metrics being sent
                     self.metric_last_sent[metric] = self.cycle
@@ -287,64 +614,236 @@ class Node:
         return filtered_data
 
 
-    def push_latest_data_and_delete_after_push(self):
-        if self.data:
-            latest_time_key = max(self.data.keys())
-            latest_data = self.data[latest_time_key]
-            to_send = self.data
-            self.data = {latest_time_key: latest_data}
-            to_push = {k: v for k, v in to_send.items() if k != latest_time_key}
-            self.session_to_monitoring.post(
-                'http://{}:{}/push_data_to_database?ip={}&port={}&round={}'.format(self.monitoring_address,self.client_port ,self.ip,
-                                                                                 self.port,
-                                                                                 self.cycle), json=to_push)
-    
     def send_to_node(self, n, new_time_key):
-        data = self.prepare_metadata_and_own_fresh_data(new_time_key)
+        outcome = self.exchange_with_node(n, new_time_key)
+        merge = self.apply_exchange_outcome(n, outcome)
+        if merge is not None:
+            merge.result()
+        return outcome
+
+    def exchange_with_node(self, n, new_time_key, data=None, deadline=None):
+        """Run the gossip exchange with one peer, local state is only read here"""
+        if data is None:
+            data = self.prepare_metadata_and_own_fresh_data(new_time_key)
+        started = time.time()
+        outcome = {'status': 'ok', 'updates': {}}
+        if deadline is not None:
+            # read by peer_request, every request of the exchange has to finish before it
+            outcome['deadline'] = deadline
         try:
-            r_metadata_and_updated = self.gossip_session.post(
-                'http://' + n["ip"] + ':' + '5000' + '/receive_metadata',
-                json=data, timeout=5)
-
-            requested_keys = r_metadata_and_updated.json()['requested_keys']
-            requested_data = self.prepare_requested_data(new_time_key, requested_keys)
-            response = self.gossip_session.get(
-                'http://' + n["ip"] + ':' + '5000' + '/receive_message?inc_round={}'.format(self.cycle),
-                json=requested_data, timeout=5)
-            self.update_own_data(r_metadata_and_updated.json()['updates'], new_time_key)
-            if response.status_code == 500:
-                self.update_failure_data(new_time_key, n)
+            peer_key = n["ip"] + ':' + n["port"]
+            if self.exchange_mode == EXCHANGE_DELTA and peer_key not in self.legacy_peers:
+                self.delta_exchange(n, new_time_key, data, outcome)
+            elif self.exchange_mode == EXCHANGE_PUSH_PULL and peer_key not in self.legacy_peers:
+                self.push_pull_exchange(n, new_time_key, data, outcome)
+            elif self.exchange_mode == EXCHANGE_MERKLE and peer_key not in self.legacy_peers:
+                self.merkle_exchange(n, new_time_key, data, outcome)
             else:
-                self.reset_failure_data(new_time_key, n["ip"] + ':' + n["port"])
+                self.two_phase_exchange(n, new_time_key, data, outcome)
         except Exception as e:
-            logging.error("Error while sending message to node {}: {}".format(n, e))
-
-    def update_failure_data(self, new_time_key, n):
-        if self.ip + ':' + self.port not in self.data[new_time_key].get(n["ip"] + ':' + n["port"], {}).get("hbState",
-                                                                                                           {}).get(
-            "failureList", []):
-            self.data[new_time_key][n["ip"] + ':' + n["port"]]["hbState"]["failureList"].append(
-                self.ip + ':' + self.port)
-            f_count = self.data[new_time_key].get(n["ip"] + ':' + n["port"], {}).get("hbState", {}).get("failureCount",
-                                                                                                        0) + 1
-            if f_count >= 3:
-                self.delete_node_from_nodelist(n["ip"] + ':' + n["port"])
-                self.data[new_time_key][n["ip"] + ':' + n["port"]]["hbState"]["nodeAlive"] = False
-        pass
+            if deadline is not None and time.time() >= deadline:
+                outcome['status'] = 'deadline'
+            else:
+                logging.error("Error while sending message to node {}: {}".format(n, e))
+                outcome['status'] = 'error'
+        outcome.pop('deadline', None)
+        outcome['latency'] = time.time() - started
+        return outcome
 
-    def delete_node_from_nodelist(self, key_to_delete):
-        # node_list is a list of dicts with 'ip' and 'port', not a dict
-        self.node_list = [n for n in self.node_list
-                          if n["ip"] + ":" + n["port"] != key_to_delete]
-
-    def reset_failure_data(self, new_time_key, ip_key):
-        if ip_key in self.data[new_time_key]:
-            self.data[new_time_key][ip_key]["hbState"]["failureCount"] = 0
-            self.data[new_time_key][ip_key]["hbState"]["nodeAlive"] = True
-            self.data[new_time_key][ip_key]["hbState"]["failureList"] = []
+    def peer_request(self, n, path, payload, outcome, method='post'):
+        """Send payload to a peer in the negotiated wire format, returns (status code, decoded reply)"""
+        peer_key = n["ip"] + ':' + n["port"]
+        url = 'http://' + n["ip"] + ':' + '5000' + path
+        timeout = self.peer_health.timeout_for(peer_key)
+        if 'deadline' in outcome:
+            remaining = outcome['deadline'] - time.time()
+            if remaining <= 0:
+                raise requests.exceptions.Timeout("round deadline passed before {}".format(path))
+            timeout = min(timeout, remaining)
+        headers = {}
+        if self.wire_format == WIRE_BINARY:
+            headers['Accept'] = wire.WIRE_CONTENT_TYPE + ', application/json'
+        if peer_key in self.binary_peers:
+            headers['Content-Type'] = wire.WIRE_CONTENT_TYPE
+            body = wire.encode(payload)
+            response = self.gossip_session.request(method, url, data=body, headers=headers, timeout=timeout)
+        else:
+            response = self.gossip_session.request(method, url, json=payload, headers=headers, timeout=timeout)
+            body = response.request.body or b''
+        outcome['bytes_out'] = outcome.get('bytes_out', 0) + len(body)
+        outcome['bytes_in'] = outcome.get('bytes_in', 0) + len(response.content)
+        if response.status_code != 200:
+            return response.status_code, None
+        if response.headers.get('Content-Type', '').startswith(wire.WIRE_CONTENT_TYPE):
+            self.binary_peers.add(peer_key)
+            return response.status_code, wire.decode(response.content)
+        if response.headers.get('Content-Type', '').startswith('application/json'):
+            return response.status_code, response.json()
+        return response.status_code, None
+
+    def two_phase_exchange(self, n, new_time_key, data, outcome):
+        status_code, metadata_and_updated = self.peer_request(n, '/receive_metadata', data, outcome)
+        if status_code == 500:
+            outcome['status'] = 'dead'
+            return
+        requested_keys = metadata_and_updated['requested_keys']
+        requested_data = self.prepare_requested_data(new_time_key, requested_keys)
+        status_code, _ = self.peer_request(n, '/receive_message?inc_round={}'.format(self.cycle),
+                                           requested_data, outcome, method='get')
+        outcome['updates'] = metadata_and_updated['updates']
+        if status_code == 500:
+            outcome['status'] = 'dead'
+
+    def push_pull_exchange(self, n, new_time_key, data, outcome, scope=None):
+        peer_key = n["ip"] + ':' + n["port"]
+        metadata = data['metadata']
+        known = self.peer_counters.get(peer_key)
+        # entries the peer is behind on as of our last exchange with it, nothing on the first one
+        push_keys = [] if known is None else [
+            key for key in metadata if key not in known or float(metadata[key]) > float(known[key])]
+        body = {'exchange': data, 'push': self.prepare_requested_data(new_time_key, push_keys)}
+        if scope is not None:
+            body['scope'] = scope
+        status_code, reply = self.peer_request(n, '/push_pull?inc_round={}'.format(self.cycle), body, outcome)
+        if status_code == 404:
+            # older agent without /push_pull, stick to the two phase protocol for it
+            self.legacy_peers.add(peer_key)
+            self.two_phase_exchange(n, new_time_key, data, outcome)
+            return
+        if status_code == 500:
+            outcome['status'] = 'dead'
+            return
+        outcome['updates'] = reply['updates']
+        counters = {key: metadata[key] for key in push_keys}
+        counters.update((key, entry['counter']) for key, entry in reply['updates'].items() if 'counter' in entry)
+        requested_keys = [key for key in reply['requested_keys'] if key not in counters]
+        if requested_keys:
+            # the peer is behind on entries we didn't push, they go in this exchange and not the next one
+            status_code, _ = self.peer_request(n, '/receive_message?inc_round={}'.format(self.cycle),
+                                               self.prepare_requested_data(new_time_key, requested_keys),
+                                               outcome, method='get')
+            if status_code == 500:
+                outcome['status'] = 'dead'
+                return
+            counters.update((key, metadata[key]) for key in requested_keys)
+        if scope is not None:
+            # only the differing buckets were compared, the rest of what we knew still holds
+            counters = {**(known or {}), **counters}
+        outcome['peer_counters'] = counters
+
+    def merkle_exchange(self, n, new_time_key, data, outcome):
+        """Descend the peer's hash tree to the differing buckets, then push_pull only those"""
+        peer_key = n["ip"] + ':' + n["port"]
+        time_data = self.data[new_time_key]
+        if len(time_data) <= MERKLE_MIN_KEYS:
+            self.push_pull_exchange(n, new_time_key, data, outcome)
+            return
+        levels = merkle_levels(time_data.bucket_hashes())
+        request_body = {'bucket_count': time_data.bucket_count, 'root': levels[0][0]}
+        while True:
+            status_code, reply = self.peer_request(n, '/merkle_sync', request_body, outcome)
+            if status_code == 404:
+                self.legacy_peers.add(peer_key)
+                self.two_phase_exchange(n, new_time_key, data, outcome)
+                return
+            if status_code == 500:
+                outcome['status'] = 'dead'
+                return
+            if reply.get('in_sync'):
+                return
+            if reply.get('fallback'):
+                # different bucket layout, reconcile everything
+                self.push_pull_exchange(n, new_time_key, data, outcome)
+                return
+            level = reply['level']
+            different = differing(levels[level], reply['hashes'])
+            if level == len(levels) - 1:
+                break
+            request_body = {'bucket_count': time_data.bucket_count, 'level': level, 'expand': different}
+        scoped_data = self.prepare_metadata_and_own_fresh_data(new_time_key, scope=different)
+        self.push_pull_exchange(n, new_time_key, scoped_data, outcome, scope=different)
+
+    def delta_exchange(self, n, new_time_key, data, outcome):
+        peer_key = n["ip"] + ':' + n["port"]
+        sync = self.peer_syncs.setdefault(peer_key, PeerSync())
+        with sync.lock:
+            message = build_delta_message(f"{self.ip}:{self.port}", sync, self.data[new_time_key],
+                                          self.entry_versions)
+        status_code, reply = self.peer_request(n, '/delta_sync?inc_round={}'.format(self.cycle), message, outcome)
+        if status_code == 404:
+            self.legacy_peers.add(peer_key)
+            self.two_phase_exchange(n, new_time_key, data, outcome)
+            return
+        if status_code == 500:
+            outcome['status'] = 'dead'
+            return
+        with sync.lock:
+            sync.receive_report(reply)
+        # field deltas are resolved against our state later, on the gossip thread
+        outcome['entries'] = reply['entries']
+
+    def apply_exchange_outcome(self, n, outcome):
+        """Queue the state changes of one exchange on the writer, returns its future"""
+        if outcome['status'] not in ('ok', 'dead', 'error'):
+            return None
+        if 'peer_counters' in outcome:
+            self.peer_counters[n["ip"] + ':' + n["port"]] = outcome.pop('peer_counters')
+        return self.writer.submit(self.merge_exchange_outcome, n, outcome)
+
+    def merge_exchange_outcome(self, state, n, outcome):
+        if 'entries' in outcome:
+            outcome['updates'] = resolve_entries(state, outcome.pop('entries'))
+        self.update_own_data(outcome['updates'], state)
+        if outcome['status'] in ('dead', 'error'):
+            self.update_failure_data(state, n)
         else:
-            self.data[new_time_key].setdefault(ip_key, {}).setdefault("hbState", {})[
-                "failureCount"] = 0
-            self.data[new_time_key].setdefault(ip_key, {}).setdefault("hbState", {})[
-                "failureList"] = []
-            self.data[new_time_key][ip_key]["hbState"]["nodeAlive"] = True
+            self.failure_detector.exchange_succeeded(n["ip"] + ':' + n["port"])
+            self.reset_failure_data(state, n["ip"] + ':' + n["port"])
+
+    def update_failure_data(self, state, n):
+        failed_key = n["ip"] + ':' + n["port"]
+        if self.failure_detector.mode == DETECTOR_PHI:
+            # not a verdict yet, the peer is probed first
+            if self.failure_detector.exchange_failed(failed_key) and self.probe_pool:
+                self.probe_pool.submit(self.probe_suspect, failed_key)
+            return
+        self.add_to_failure_list(state, failed_key)
+        if self.failure_detector.exchange_failed(failed_key):
+            self.mark_peer_dead(state, failed_key)
+
+    def add_to_failure_list(self, state, failed_key):
+        own_key = self.ip + ':' + self.port
+        entry = state.get(failed_key, {})
+        hb_state = entry.get("hbState", {})
+        if own_key not in hb_state.get("failureList", []):
+            # entries are shared with published snapshots, replace them instead of editing
+            state[failed_key] = dict(entry, hbState=dict(hb_state, failureList=hb_state.get("failureList", []) + [own_key]))
+
+    def mark_peer_dead(self, state, dead_key):
+        # runs on the writer
+        if not self.failure_detector.declare_dead(dead_key):
+            return
+        self.delete_node_from_nodelist(dead_key)
+        self.peer_health.forget(dead_key)
+        if dead_key in state and not is_tombstone(state[dead_key]):
+            self.add_to_failure_list(state, dead_key)
+            # the tombstone spreads like any newer entry and is collected after tombstone_ttl
+            state[dead_key] = make_tombstone(state[dead_key])
+
+    def add_node_to_nodelist(self, node_entry):
+        self.peer_view.add(node_entry)
+
+    def delete_node_from_nodelist(self, key_to_delete):
+        self.peer_view.remove(key_to_delete)
+
+    def reset_failure_data(self, state, ip_key):
+        entry = state.get(ip_key, {})
+        if is_tombstone(entry):
+            # it answered, its next entry replaces the tombstone
+            return
+        hb_state = entry.get("hbState", {})
+        if hb_state.get("failureCount") == 0 and hb_state.get("failureList") == [] \
+                and hb_state.get("nodeAlive") is True:
+            # nothing to reset, don't clone the bucket for it
+            return
+        state[ip_key] = dict(entry, hbState=dict(hb_state, failureCount=0, failureList=[], nodeAlive=True))
@@ -0,0 +1,134 @@
+import random
+import threading
+import time
+
+from gossip_control import FAILED_STATUSES
+
+# circuit states of a peer: "closed" is picked as usual, "open" is left out of
+# peer selection until its backoff runs out, "half_open" has one trial exchange
+# in flight that closes the circuit again or reopens it with a longer backoff
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+# seconds a peer is skipped after its first failed exchange, doubled on every
+# further failure up to the max, 0 turns the health cache off
+DEFAULT_BASE_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 60.0
+# +-share of random jitter so peers that failed together aren't retried together
+BACKOFF_JITTER = 0.2
+# trial exchanges with recovering peers per round, the rest of the fan-out goes to healthy ones
+TRIALS_PER_ROUND = 1
+# http timeouts of a normal exchange and of a trial with a peer that failed before
+REQUEST_TIMEOUT = 5.0
+TRIAL_TIMEOUT = 1.0
+
+
+class PeerHealth:
+    """
+    Per peer circuit breaker consulted by gossip peer selection.
+
+    A failed exchange opens the peer's circuit: it isn't picked until an
+    exponential backoff has passed, then it gets a single trial exchange
+    with a short timeout. A successful trial closes the circuit, a failed
+    one reopens it with twice the backoff. Rounds so spend their fan-out on
+    peers that answer and only now and then pay for one that doesn't.
+    """
+
+    def __init__(self, base_backoff=DEFAULT_BASE_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF):
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        # peer key -> {"state", "failures", "retry_at"}, peers without an entry are healthy
+        self.peers = {}
+        self.counts = {'opened': 0, 'trials': 0, 'recovered': 0, 'skipped': 0}
+        # selection runs on the gossip thread, probes report from the probe pool
+        self.lock = threading.Lock()
+
+    def select(self, candidates, count, now=None):
+        """
+        Up to count of the (shuffled) candidates, skipping open circuits, returns (selected, skipped).
+        Failed peers that dropped out of the candidates (a failed shuffle takes them out of the view)
+        still get their trials, otherwise they could never fail often enough to be declared dead.
+        """
+        now = time.time() if now is None else now
+        selected = []
+        trials = 0
+        skipped = 0
+        with self.lock:
+            candidate_keys = set()
+            for candidate in candidates:
+                key = candidate["ip"] + ':' + candidate["port"]
+                candidate_keys.add(key)
+                if len(selected) >= count:
+                    continue
+                health = self.peers.get(key)
+                if health is None or health["state"] == CIRCUIT_CLOSED:
+                    selected.append(candidate)
+                elif trials < TRIALS_PER_ROUND and self._start_trial(health, now):
+                    trials += 1
+                    selected.append(candidate)
+                else:
+                    skipped += 1
+            # on top of the fan-out, there is no slot in the view they could take
+            for key, health in self.peers.items():
+                if trials >= TRIALS_PER_ROUND:
+                    break
+                if key not in candidate_keys and self._start_trial(health, now):
+                    ip, port = key.split(':')
+                    trials += 1
+                    selected.append({"ip": ip, "port": port})
+            self.counts['trials'] += trials
+            self.counts['skipped'] += skipped
+        return selected, skipped
+
+    def _start_trial(self, health, now):
+        if health["state"] == CIRCUIT_CLOSED or now < health["retry_at"]:
+            return False
+        # a trial that never reported back is retried after the max backoff
+        health["state"] = CIRCUIT_HALF_OPEN
+        health["retry_at"] = now + self.max_backoff
+        return True
+
+    def timeout_for(self, peer):
+        health = self.peers.get(peer)
+        return TRIAL_TIMEOUT if health is not None and health["state"] == CIRCUIT_HALF_OPEN else REQUEST_TIMEOUT
+
+    def record(self, peer, status, now=None):
+        if status in FAILED_STATUSES:
+            self.record_failure(peer, now)
+        elif status == 'ok':
+            self.record_success(peer)
+
+    def record_success(self, peer):
+        with self.lock:
+            if self.peers.pop(peer, None) is not None:
+                self.counts['recovered'] += 1
+
+    def record_failure(self, peer, now=None):
+        if not self.base_backoff:
+            return
+        now = time.time() if now is None else now
+        with self.lock:
+            health = self.peers.setdefault(peer, {"state": CIRCUIT_CLOSED, "failures": 0, "retry_at": now})
+            health["failures"] += 1
+            if health["state"] == CIRCUIT_CLOSED:
+                self.counts['opened'] += 1
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** (health["failures"] - 1))
+            health["state"] = CIRCUIT_OPEN
+            health["retry_at"] = now + backoff * random.uniform(1 - BACKOFF_JITTER, 1 + BACKOFF_JITTER)
+
+    def forget(self, peer):
+        with self.lock:
+            self.peers.pop(peer, None)
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            return {
+                'base_backoff': self.base_backoff,
+                'max_backoff': self.max_backoff,
+                'peers': {peer: {'state': health["state"], 'failures': health["failures"],
+                                 'retry_in': round(max(0.0, health["retry_at"] - now), 2)}
+                          for peer, health in self.peers.items()},
+                'counts': dict(self.counts)
+            }
@@ -0,0 +1,130 @@
+import secrets
+import threading
+
+# Cyclon defaults: peers kept in the view, entries traded per shuffle, seconds between two shuffles
+DEFAULT_VIEW_SIZE = 20
+DEFAULT_SHUFFLE_LENGTH = 5
+DEFAULT_SHUFFLE_INTERVAL = 1.0
+
+
+def peer_key(entry):
+    return entry["ip"] + ':' + entry["port"]
+
+
+class PeerView:
+    """
+    Bounded random view of the cluster, refreshed with Cyclon shuffles.
+
+    Every node keeps at most `size` peers instead of the whole node list.
+    Periodically it ages its entries, takes out the oldest peer and trades
+    a few random entries (plus a fresh one for itself) with it, the peer
+    answers with a few of its own. Both sides keep what they got in place
+    of what they gave away, so views keep mixing and departed nodes age
+    out, and a node that joins through /register_new_node spreads from the
+    view it was added to without anyone holding a global list.
+    """
+
+    def __init__(self, own_key, size=DEFAULT_VIEW_SIZE, shuffle_length=DEFAULT_SHUFFLE_LENGTH):
+        self.own_key = own_key
+        self.size = size
+        self.shuffle_length = shuffle_length
+        # peer key -> {"ip", "port", "age"}
+        self.view = {}
+        # shuffles run on the gossip thread, answers on the flask threads, removals on the writer
+        self.lock = threading.Lock()
+        self.random = secrets.SystemRandom()
+        self.shuffles = 0
+        self.shuffle_failures = 0
+        self.shuffles_answered = 0
+
+    def seed(self, node_list):
+        """Bootstraps the view with a random subset of the node list the orchestrator sent"""
+        candidates = [entry for entry in node_list or [] if peer_key(entry) != self.own_key]
+        with self.lock:
+            for entry in self.random.sample(candidates, min(self.size, len(candidates))):
+                self.view[peer_key(entry)] = {"ip": entry["ip"], "port": entry["port"], "age": 0}
+
+    def __len__(self):
+        return len(self.view)
+
+    def peers(self):
+        with self.lock:
+            return [{"ip": entry["ip"], "port": entry["port"]} for entry in self.view.values()]
+
+    def sample(self, count):
+        with self.lock:
+            entries = list(self.view.values())
+        return [{"ip": entry["ip"], "port": entry["port"]}
+                for entry in self.random.sample(entries, min(count, len(entries)))]
+
+    def add(self, entry):
+        """A node that registered with us, replaces the oldest peer when the view is full"""
+        key = peer_key(entry)
+        if key == self.own_key:
+            return
+        with self.lock:
+            if key not in self.view and len(self.view) >= self.size:
+                del self.view[max(self.view, key=lambda k: self.view[k]["age"])]
+            self.view[key] = {"ip": entry["ip"], "port": entry["port"], "age": 0}
+
+    def remove(self, key):
+        with self.lock:
+            self.view.pop(key, None)
+
+    def start_shuffle(self, own_entry):
+        """Ages the view and takes out its oldest peer, returns (peer, entries to send) or None"""
+        with self.lock:
+            if not self.view:
+                return None
+            for entry in self.view.values():
+                entry["age"] += 1
+            target_key = max(self.view, key=lambda k: self.view[k]["age"])
+            target = self.view.pop(target_key)
+            others = list(self.view.values())
+            sent = [dict(entry) for entry in self.random.sample(others, min(self.shuffle_length - 1, len(others)))]
+        self.shuffles += 1
+        return target, sent + [dict(own_entry, age=0)]
+
+    def finish_shuffle(self, target, sent, received):
+        with self.lock:
+            self._merge(received, sent)
+            # it just answered, keep it if there is room (small clusters would lose a peer every shuffle)
+            if len(self.view) < self.size and peer_key(target) not in self.view:
+                self.view[peer_key(target)] = dict(target, age=0)
+
+    def answer_shuffle(self, received):
+        """The passive side of a shuffle, returns the entries sent back"""
+        with self.lock:
+            entries = list(self.view.values())
+            reply = [dict(entry) for entry in self.random.sample(entries, min(self.shuffle_length, len(entries)))]
+            self._merge(received, reply)
+        self.shuffles_answered += 1
+        return reply
+
+    def _merge(self, received, sent):
+        # fill free slots first, then give up the entries we sent to the other side
+        replaceable = [peer_key(entry) for entry in sent]
+        for entry in received:
+            key = peer_key(entry)
+            if key == self.own_key or key in self.view:
+                continue
+            if len(self.view) >= self.size:
+                while replaceable and replaceable[0] not in self.view:
+                    replaceable.pop(0)
+                if not replaceable:
+                    break
+                del self.view[replaceable.pop(0)]
+            self.view[key] = {"ip": entry["ip"], "port": entry["port"], "age": entry.get("age", 0)}
+
+    def stats(self):
+        with self.lock:
+            ages = [entry["age"] for entry in self.view.values()]
+        return {
+            'size': len(ages),
+            'max_size': self.size,
+            'shuffle_length': self.shuffle_length,
+            'max_age': max(ages) if ages else None,
+            'shuffles': self.shuffles,
+            'shuffle_failures': self.shuffle_failures,
+            'shuffles_answered': self.shuffles_answered
+        }
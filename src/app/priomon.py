@@ -1,7 +1,22 @@
 import time
 
-from flask import Flask, request
-from node import Node, METRIC_PRIORITIES, METRIC_DELTAS
+from flask import Flask, Response, request
+from node import Node, METRIC_PRIORITIES, METRIC_DELTAS, FANOUT_SEQUENTIAL, DEFAULT_ROUND_DEADLINE, \
+    EXCHANGE_TWO_PHASE, WIRE_JSON
+from cluster_state import ClusterState
+from delta import PeerSync, build_delta_message, resolve_entries
+from merkle import merkle_levels, child_indices
+from gossip_control import GOSSIP_FIXED
+from peer_sampling import DEFAULT_VIEW_SIZE, DEFAULT_SHUFFLE_LENGTH, DEFAULT_SHUFFLE_INTERVAL
+from failure_detector import DETECTOR_COUNTER, DEFAULT_PHI_THRESHOLD, DEFAULT_INDIRECT_PROBES
+from peer_health import DEFAULT_BASE_BACKOFF, DEFAULT_MAX_BACKOFF
+from tombstones import DEFAULT_TOMBSTONE_TTL, is_tombstone, merged_failure_list
+from archiver import DEFAULT_ARCHIVE_INTERVAL, DEFAULT_SPILL_BYTES
+from reporter import DEFAULT_REPORT_INTERVAL, DEFAULT_SUMMARY_LATENCY
+from state_log import DEFAULT_COMPACT_BYTES
+import wire
+import aio_server
+import os
 import threading
 import logging
 import json
@@ -10,12 +25,26 @@ logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %
 gossip = Flask(__name__)
 
 
+def read_payload():
+    # gossip bodies come either as json or in the binary wire format
+    if request.mimetype == wire.WIRE_CONTENT_TYPE:
+        return wire.decode(request.get_data())
+    return request.get_json()
+
+
+def reply_payload(payload):
+    # only peers that asked for the binary format get it, everyone else keeps getting json
+    if wire.WIRE_CONTENT_TYPE in request.headers.get('Accept', ''):
+        return Response(wire.encode(payload), content_type=wire.WIRE_CONTENT_TYPE)
+    return payload
+
+
 @gossip.route('/receive_message', methods=['GET'])
 def receive_message():
     if not Node.instance().is_alive:
         # reset_node()
         return "Dead Node", 500
-    compare_and_update_node_data(request.get_json())
+    compare_and_update_node_data(read_payload(), int(request.args.get('inc_round')))
     return "OK"
 
 
@@ -27,69 +56,197 @@ def get_metadata():
     node = Node.instance()
     if not node.data:
         return json.dumps({})
-    latest_entry = max(node.data.keys(), key=int)
-    metadata = {}
-    for key in node.data[latest_entry]:
-        if 'counter' in node.data[latest_entry][key]:
-            metadata[key] = {'counter': node.data[latest_entry][key]['counter'],
-                             'digest': node.data[latest_entry][key]['digest']}
-    return json.dumps(metadata)
+    # counters and digests come straight from the entries, the view is only rebuilt for a new snapshot
+    return node.metadata_view.json(node.data.latest())
+
+
+def latest_entries(keys):
+    """{key: entry} for the keys the latest snapshot holds"""
+    node = Node.instance()
+    state = node.data.latest() if node.data else None
+    if state is None:
+        return {}
+    return {key: state[key] for key in keys if key in state and 'counter' in state[key]}
+
+
+def latest_entry(key):
+    return latest_entries([key]).get(key)
+
+
+def versioned_reply(entry, payload):
+    # the digest names the entry version, a client that already holds it gets a 304 without a body
+    response = Response(json.dumps(payload), content_type='application/json')
+    response.set_etag(entry['digest'])
+    return response.make_conditional(request)
+
+
+@gossip.route('/metadata/<key>', methods=['GET'])
+def get_key_metadata(key):
+    """Counter and digest of one node's entry, what /metadata holds for that key"""
+    if not Node.instance().is_alive:
+        return "Dead Node", 500
+    entry = latest_entry(key)
+    if entry is None:
+        return "Unknown key", 404
+    return versioned_reply(entry, {'counter': entry['counter'], 'digest': entry['digest']})
+
+
+@gossip.route('/entry/<key>', methods=['GET'])
+def get_entry(key):
+    """One node's entry from the latest snapshot"""
+    if not Node.instance().is_alive:
+        return "Dead Node", 500
+    entry = latest_entry(key)
+    if entry is None:
+        return "Unknown key", 404
+    return versioned_reply(entry, entry)
+
+
+@gossip.route('/batch_metadata', methods=['POST'])
+def get_batch_metadata():
+    """Counters and digests of the requested keys, keys the node doesn't hold are left out"""
+    if not Node.instance().is_alive:
+        return "Dead Node", 500
+    entries = latest_entries(request.get_json().get('keys', []))
+    return json.dumps({key: {'counter': entry['counter'], 'digest': entry['digest']}
+                       for key, entry in entries.items()})
+
+
+@gossip.route('/batch_entries', methods=['POST'])
+def get_batch_entries():
+    """Entries of the requested keys from the latest snapshot"""
+    if not Node.instance().is_alive:
+        return "Dead Node", 500
+    return json.dumps(latest_entries(request.get_json().get('keys', [])))
 
 
-def compare_node_data_with_metadata(data):
+def compare_node_data_with_metadata(data, scope=None):
     # metadata form: {ip1: counter1, ip2: counter2, .....}
     # to_send = {'metadata': metadata, key:own_recent_data}
+    # scope: optional list of bucket indices, only keys in those buckets are compared
     node = Node.instance()
     metadata = data['metadata']
     sender_key = next(key for key in data if key != 'metadata')
     sender_data = data[sender_key]
     if len(node.data) == 0:
         # node doesnt store any data yet
-        return metadata.keys()
-    latest_entry = max(node.data.keys(), key=int)
-    all_keys = set().union(node.data[latest_entry].keys(), metadata.keys())
-    all_keys.discard(sender_key)
-    node.data_flow_per_round.setdefault(node.cycle, {})
-    if sender_key in node.data[latest_entry]:
-        node.data_flow_per_round[node.cycle].setdefault('fd', 0)
-        node.data_flow_per_round[node.cycle]['fd'] += 1
+        return {'requested_keys': list(metadata.keys()), 'updates': {}}
+    # published snapshots are immutable, the comparison runs on one without locking
+    latest_data = node.data.latest()
+    if scope is not None:
+        local_keys = latest_data.keys_in_buckets(scope)
     else:
-        node.data_flow_per_round[node.cycle].setdefault('nd', 0)
-        node.data_flow_per_round[node.cycle].setdefault('fd', 0)
-        node.data_flow_per_round[node.cycle]['nd'] += 1
-        node.data_flow_per_round[node.cycle]['fd'] += 1
-
-    node.data[latest_entry][sender_key] = sender_data
+        local_keys = latest_data.keys()
+    all_keys = set().union(local_keys, metadata.keys())
+    all_keys.discard(sender_key)
+    # the sender's entry isn't part of the reply, so its merge doesn't have to be waited for
+    node.writer.submit(store_sender_data, sender_key, sender_data)
 
     # lists of ips who reclaim that this node is dead
     ips_to_update = []
     data_to_send = {}
     for key in all_keys:
         # both nodes store the data if IP
-        if key in node.data[latest_entry] and key in metadata:
+        if key in latest_data and key in metadata:
             # node doesnt store the key or counter of metadata > counter of noda.data
-            if ('counter' not in node.data[latest_entry][key]) or (
-                    float(metadata[key]) > float(node.data[latest_entry][key]['counter'])):
+            if ('counter' not in latest_data[key]) or (
+                    float(metadata[key]) > float(latest_data[key]['counter'])):
                 ips_to_update.append(key)
             else:
-                data_to_send[key] = node.data[latest_entry][key]
+                data_to_send[key] = latest_data[key]
         # metadata doesnt store the data of IP
-        elif key in node.data[latest_entry] and key not in metadata:
-            data_to_send[key] = node.data[latest_entry][key]
-        # node doesnt store the data of IP
-        else:
+        elif key in latest_data and key not in metadata:
+            data_to_send[key] = latest_data[key]
+        # node doesnt store the data of IP, unless it is one we collected the tombstone of
+        elif not node.graveyard.blocks(key, metadata[key]):
             ips_to_update.append(key)
     requests_updates = {'requested_keys': ips_to_update, 'updates': data_to_send}
     return requests_updates
 
 
+def store_sender_data(state, sender_key, sender_data):
+    # runs on the state writer
+    node = Node.instance()
+    node.data_flow_per_round.setdefault(node.cycle, {})
+    # exchanges peers started with us, the gossip controller relates fd to them
+    node.data_flow_per_round[node.cycle]['exchanges'] = node.data_flow_per_round[node.cycle].get('exchanges', 0) + 1
+    if sender_key in state:
+        # same rule as merge_node_data, only a higher counter is fresh data
+        if float(sender_data.get('counter', 0)) > float(state[sender_key].get('counter', 0)):
+            node.data_flow_per_round[node.cycle].setdefault('fd', 0)
+            node.data_flow_per_round[node.cycle]['fd'] += 1
+            node.note_heartbeat(sender_key)
+    else:
+        node.note_heartbeat(sender_key)
+        node.data_flow_per_round[node.cycle].setdefault('nd', 0)
+        node.data_flow_per_round[node.cycle].setdefault('fd', 0)
+        node.data_flow_per_round[node.cycle]['nd'] += 1
+        node.data_flow_per_round[node.cycle]['fd'] += 1
+    state[sender_key] = sender_data
+
+
 @gossip.route('/receive_metadata', methods=['POST'])
 def receive_metadata():
     if not Node.instance().is_alive:
         # reset_node()
         return "Dead Node", 500
-    data = compare_node_data_with_metadata(request.get_json())
-    return data
+    data = compare_node_data_with_metadata(read_payload())
+    return reply_payload(data)
+
+
+@gossip.route('/push_pull', methods=['POST'])
+def push_pull():
+    # single round trip version of /receive_metadata + /receive_message
+    # body: {'exchange': <same payload as /receive_metadata>, 'push': {key: entry}}
+    if not Node.instance().is_alive:
+        # reset_node()
+        return "Dead Node", 500
+    body = read_payload()
+    # merge what the sender pushed first so the reply is computed against the merged state,
+    # requested_keys in the reply are what the sender still has to send, it follows up with /receive_message
+    compare_and_update_node_data(body.get('push', {}), int(request.args.get('inc_round')))
+    return reply_payload(compare_node_data_with_metadata(body['exchange'], body.get('scope')))
+
+
+@gossip.route('/merkle_sync', methods=['POST'])
+def merkle_sync():
+    # hash summary descent, {'root': h} compares roots and
+    # {'level': l, 'expand': [indices]} returns the children of those level l nodes
+    node = Node.instance()
+    if not node.is_alive:
+        # reset_node()
+        return "Dead Node", 500
+    body = read_payload()
+    latest_data = node.data.latest() if len(node.data) > 0 else ClusterState()
+    levels = merkle_levels(latest_data.bucket_hashes())
+    if body['bucket_count'] != latest_data.bucket_count or len(levels) < 2:
+        return reply_payload({'fallback': True})
+    if 'root' in body:
+        if body['root'] == levels[0][0]:
+            return reply_payload({'in_sync': True})
+        return reply_payload({'level': 1, 'hashes': dict(enumerate(levels[1]))})
+    level = body['level'] + 1
+    hashes = {}
+    for index in body['expand']:
+        for child in child_indices(index, len(levels[level])):
+            hashes[child] = levels[level][child]
+    return reply_payload({'level': level, 'hashes': hashes})
+
+
+@gossip.route('/delta_sync', methods=['POST'])
+def delta_sync():
+    # delta-state exchange, body and reply are both built by delta.build_delta_message
+    node = Node.instance()
+    if not node.is_alive:
+        # reset_node()
+        return "Dead Node", 500
+    message = read_payload()
+    sync = node.peer_syncs.setdefault(message['sender'], PeerSync())
+    compare_and_update_node_data(message['entries'], int(request.args.get('inc_round')), resolve=True)
+    with sync.lock:
+        sync.receive_report(message)
+        reply = build_delta_message(f"{node.ip}:{node.port}", sync, node.data.latest(), node.entry_versions)
+    return reply_payload(reply)
 
 
 @gossip.route('/reset_node')
@@ -111,18 +268,26 @@ def stop_node():
     node.is_alive = False
     node.client_thread.join()
     node.counter_thread.join()
+    node.writer.stop()
     return "OK"
 
 
-def compare_and_update_node_data(inc_data):
+def compare_and_update_node_data(inc_data, inc_round, resolve=False):
+    node = Node.instance()
+    # the merge itself runs on the state writer, this returns once the new snapshot is published
+    node.writer.run(merge_node_data, inc_data, resolve)
+    # the monitor gets the state from the reporter thread, several merges end up in one report
+    if node.is_send_data_back == "1" and node.reporter:
+        node.reporter.note_update(inc_round)
+
+
+def merge_node_data(new_state, inc_data, resolve=False):
+    # runs on the state writer, new_state is the version that gets published next.
+    # entries in it are shared with published snapshots and are replaced, never edited
     node = Node.instance()
-    new_time_key = node.gossip_counter
-    latest_entry = max(node.data.keys(), key=int) if len(node.data) > 0 else new_time_key
-    new_data = inc_data
+    new_data = resolve_entries(new_state, inc_data) if resolve else inc_data
     # new_data = inc_data['data']
     # new_node_list = inc_data['node_list']
-    all_keys = set().union(node.data[latest_entry].keys(), new_data.keys())
-    inc_round = int(request.args.get('inc_round'))
     # received messages ['rm'] per round
     node.data_flow_per_round.setdefault(node.cycle, {}).setdefault('rm', 0)
     node.data_flow_per_round[node.cycle]['rm'] += 1
@@ -130,19 +295,22 @@ def compare_and_update_node_data(inc_data):
     # lists of ips who reclaim that this node is dead
     list1 = []
     list2 = []
-    for key in all_keys:
+    for key in new_data:
+        if not node.admits(key, new_data[key]):
+            continue
         # both nodes store the data if IP
-        if key in node.data[latest_entry] and key in new_data:
+        if key in new_state:
+            existing_data = new_state[key]
 
             # Handle partial metric updates - preserve existing metrics if not in incoming data
-            if 'appState' in new_data[key] and 'appState' in node.data[latest_entry][key]:
+            if 'appState' in new_data[key] and 'appState' in existing_data and not is_tombstone(new_data[key]):
                 # Get lists of metrics
-                existing_metrics = set(node.data[latest_entry][key]['appState'].keys())
+                existing_metrics = set(existing_data['appState'].keys())
                 incoming_metrics = set(new_data[key]['appState'].keys())
                 
                 # For any metric in existing but not in incoming, copy from existing
                 for metric in existing_metrics - incoming_metrics:
-                    new_data[key]['appState'][metric] = node.data[latest_entry][key]['appState'][metric]
+                    new_data[key]['appState'][metric] = existing_data['appState'][metric]
             
             if 'metric_sent_flags' in new_data[key]:
                 sent_count = sum(1 for v in new_data[key]['metric_sent_flags'].values() if v)
@@ -154,49 +322,34 @@ def compare_and_update_node_data(inc_data):
                 node.data_flow_per_round[node.cycle]['metrics_sent'] += sent_count
                 node.data_flow_per_round[node.cycle]['metrics_filtered'] += filtered_count
                 
-            list1 = node.data[latest_entry][key]["hbState"]["failureList"]
-            list2 = new_data[key]["hbState"]["failureList"]
-            if ('counter' in new_data[key] and 'counter' in node.data[latest_entry][key] \
-                and float(new_data[key]['counter']) > float(node.data[latest_entry][key]['counter'])) or \
-                    ('counter' in new_data[key] and 'counter' not in node.data[latest_entry][key]):
-                node.data.setdefault(new_time_key, {})[key] = new_data[key]
+            if ('counter' in new_data[key] and 'counter' in existing_data \
+                and float(new_data[key]['counter']) > float(existing_data['counter'])) or \
+                    ('counter' in new_data[key] and 'counter' not in existing_data):
+                # a newer version carries its own failure claims, the ones on the old version are dropped
+                new_state[key] = new_data[key]
 
                 # fresh data per round ['fd'] per round, fresh data describes data that is updated or added in this node
                 node.data_flow_per_round[node.cycle].setdefault('fd', 0)
                 node.data_flow_per_round[node.cycle]['fd'] += 1
+                node.note_heartbeat(key, new_data[key])
             else:
-                node.data.setdefault(new_time_key, {})[key] = node.data[latest_entry][key]
-        # inc data doesnt store the data of IP
-        elif key in node.data[latest_entry] and key not in new_data:
-            node.data.setdefault(new_time_key, {})[key] = node.data[latest_entry][key]
+                # same or older version, only the claims that we don't have yet are merged in
+                entry = new_state[key]
+                failure_list = merged_failure_list(entry["hbState"]["failureList"],
+                                                   new_data[key]["hbState"]["failureList"])
+                if failure_list is not None:
+                    new_state[key] = dict(entry, hbState=dict(entry["hbState"], failureList=failure_list))
         # node doesnt store the data of IP
         else:
-            node.data.setdefault(new_time_key, {})[key] = new_data[key]
+            new_state[key] = new_data[key]
+            node.note_heartbeat(key, new_data[key])
             # node.data[key] = new_data[key]
             # new data per round ['nd'] per round (nd is data from an unknown node -> fd = nd)
             node.data_flow_per_round[node.cycle].setdefault('nd', 0)
             node.data_flow_per_round[node.cycle].setdefault('fd', 0)
             node.data_flow_per_round[node.cycle]['nd'] += 1
             node.data_flow_per_round[node.cycle]['fd'] += 1
-        # only for deleted nodes
-        if key in node.data[latest_entry] and key in new_data:
-            merged_failure_list = list(set(list1).union(set(list2)))
-            node.data[new_time_key][key]["hbState"]["failureList"] = merged_failure_list
-    # TODO update Database
-    # send both data and data_flow_per_round to monitor
-    # TODO: Save latest data snapshot with key = self.gossip_counter in data
-    if new_time_key not in node.data:
-        print("No new data to send", flush=True)
-        data_to_send_to_monitor = node.data[latest_entry]
-    else:
-        data_to_send_to_monitor = node.data[new_time_key]
-    to_send = {'data': data_to_send_to_monitor, 'data_flow_per_round': node.data_flow_per_round[node.cycle]}
-    # TODO: Session here
-    if node.is_send_data_back == "1":
-        node.session_to_monitoring.post(
-            'http://{}:{}/receive_node_data?ip={}&port={}&round={}'.format(node.monitoring_address,node.client_port, node.ip,
-                                                                             node.port,
-                                                                             inc_round), json=to_send)
+    return new_state
 
 
 @gossip.route('/start_node', methods=['POST'])
@@ -213,48 +366,144 @@ def start_node():
     push_mode = init_data["push_mode"]
     node = Node.instance()
     time.sleep(10)
-    client_thread = threading.Thread(target=node.start_gossiping, args=(target_count, gossip_rate))
-    counter_thread = threading.Thread(target=node.start_gossip_counter)
+    if aio_server.loop is not None:
+        # asyncio serving mode, both loops run as tasks on the serving event loop
+        client_thread = aio_server.LoopTask(node.start_gossiping_async, (target_count, gossip_rate))
+        counter_thread = aio_server.LoopTask(node.start_gossip_counter_async)
+    else:
+        client_thread = threading.Thread(target=node.start_gossiping, args=(target_count, gossip_rate))
+        counter_thread = threading.Thread(target=node.start_gossip_counter)
+
+    # configure metric priorities and deltas if the orchestrator sent them,
+    # before set_params so the evaluator picks them up from the first round
+    if 'metric_priorities' in init_data:
+        METRIC_PRIORITIES.update(init_data['metric_priorities'])
+    
+    if 'metric_deltas' in init_data:
+        METRIC_DELTAS.update(init_data['metric_deltas'])
     node.set_params(node_ip,
                     request.headers.get('Host').split(':')[1], 0,
                     node_list, {}, True, 0, 0, monitoring_address, database_address,
                     is_send_data_back=is_send_data_back,
                     client_thread=client_thread, counter_thread=counter_thread, data_flow_per_round={},
-                    push_mode=push_mode, client_port=client_port)
+                    push_mode=push_mode, client_port=client_port,
+                    snapshot_retention=init_data.get("snapshot_retention"),
+                    snapshot_max_age=init_data.get("snapshot_max_age"),
+                    fanout_mode=init_data.get("fanout_mode", FANOUT_SEQUENTIAL),
+                    round_deadline=init_data.get("round_deadline", DEFAULT_ROUND_DEADLINE),
+                    exchange_mode=init_data.get("exchange_mode", EXCHANGE_TWO_PHASE),
+                    wire_format=init_data.get("wire_format", WIRE_JSON),
+                    metric_sample_intervals=init_data.get("metric_sample_intervals"),
+                    collectors=init_data.get("collectors"),
+                    gossip_control=init_data.get("gossip_control", GOSSIP_FIXED),
+                    gossip_bounds=init_data.get("gossip_bounds"),
+                    view_size=init_data.get("view_size", DEFAULT_VIEW_SIZE),
+                    shuffle_length=init_data.get("shuffle_length", DEFAULT_SHUFFLE_LENGTH),
+                    shuffle_interval=init_data.get("shuffle_interval", DEFAULT_SHUFFLE_INTERVAL),
+                    failure_detection=init_data.get("failure_detection", DETECTOR_COUNTER),
+                    phi_threshold=init_data.get("phi_threshold", DEFAULT_PHI_THRESHOLD),
+                    indirect_probes=init_data.get("indirect_probes", DEFAULT_INDIRECT_PROBES),
+                    health_backoff=init_data.get("health_backoff", DEFAULT_BASE_BACKOFF),
+                    health_max_backoff=init_data.get("health_max_backoff", DEFAULT_MAX_BACKOFF),
+                    tombstone_ttl=init_data.get("tombstone_ttl", DEFAULT_TOMBSTONE_TTL),
+                    archive_interval=init_data.get("archive_interval", DEFAULT_ARCHIVE_INTERVAL),
+                    archive_spill_bytes=init_data.get("archive_spill_bytes", DEFAULT_SPILL_BYTES),
+                    report_interval=init_data.get("report_interval", DEFAULT_REPORT_INTERVAL),
+                    report_summary_latency=init_data.get("report_summary_latency", DEFAULT_SUMMARY_LATENCY),
+                    state_log=init_data.get("state_log"),
+                    state_log_compact_bytes=init_data.get("state_log_compact_bytes", DEFAULT_COMPACT_BYTES))
     client_thread.start()
     counter_thread.start()
 
-    # configure metric priorities and deltas if the orchestrator sent them
-    if 'metric_priorities' in init_data:
-        METRIC_PRIORITIES.update(init_data['metric_priorities'])
-    
-    if 'metric_deltas' in init_data:
-        METRIC_DELTAS.update(init_data['metric_deltas'])
-
     return "OK"
 
 
 @gossip.route('/register_new_node', methods=['POST'])
 def register_new_node():
-    Node.instance().node_list.append(request.get_json())
+    node = Node.instance()
+    node_entry = request.get_json()
+    # goes into our view only, shuffles carry it on from there
+    node.add_node_to_nodelist(node_entry)
     return "OK"
 
 
+@gossip.route('/ping', methods=['GET'])
+def ping():
+    # direct probe of the failure detector, only a gossiping node counts as alive
+    if not Node.instance().is_alive:
+        return "Dead Node", 500
+    return "OK"
+
+
+@gossip.route('/ping_req', methods=['POST'])
+def ping_req():
+    # indirect probe: ping the target for the asking node, body {'target': "ip:port"}
+    node = Node.instance()
+    ip, port = request.get_json()['target'].split(':')
+    return {'ack': node.ping({"ip": ip, "port": port})}
+
+
+@gossip.route('/failure_detector_stats', methods=['GET'])
+def get_failure_detector_stats():
+    """Phi per peer, declared dead peers and the suspicion / probe / declaration log"""
+    return json.dumps(Node.instance().failure_detector.stats())
+
+
+@gossip.route('/shuffle', methods=['POST'])
+def shuffle():
+    # passive side of a Cyclon shuffle, see peer_sampling.py
+    # body: {'entries': [{"ip", "port", "age"}, ...]}, the reply has the same shape
+    node = Node.instance()
+    if not node.is_alive or node.peer_view is None:
+        return "Dead Node", 500
+    return reply_payload({'entries': node.peer_view.answer_shuffle(read_payload()['entries'])})
+
+
 @gossip.route('/get_data_from_node', methods=['GET'])
 def get_data_from_node():
-    return Node.instance().data
+    return Node.instance().data.to_dict()
+
+
+@gossip.route('/snapshot_store_stats', methods=['GET'])
+def get_snapshot_store_stats():
+    """Retention and memory accounting of the node's snapshot history"""
+    node = Node.instance()
+    stats = node.data.stats()
+    stats['writer'] = node.writer.stats()
+    stats['archiver'] = node.archiver.stats() if node.archiver else None
+    stats['reporter'] = node.reporter.stats() if node.reporter else None
+    stats['state_log'] = node.state_log.stats() if node.state_log else None
+    return json.dumps(stats)
 
 
 @gossip.route('/get_recent_data_from_node', methods=['GET'])
 def get_recent_data_from_node():
-    data = Node.instance().data
-    latest_entry = max(data.keys(), key=int)
-    return data[latest_entry]
+    return Node.instance().data.latest().to_dict()
+
+
+@gossip.route('/gossip_round_stats', methods=['GET'])
+def get_gossip_round_stats():
+    """Per-peer outcomes of the last gossip round and totals since start"""
+    node = Node.instance()
+    return json.dumps({
+        'fanout_mode': node.fanout_mode,
+        'exchange_mode': node.exchange_mode,
+        'legacy_peers': sorted(node.legacy_peers),
+        'wire_format': node.wire_format,
+        'binary_peers': sorted(node.binary_peers),
+        'round_deadline': node.round_deadline,
+        'gossip_control': node.gossip_controller.stats(),
+        'peer_view': node.peer_view.stats(),
+        'peer_health': node.peer_health.stats(),
+        'tombstones': dict(node.graveyard.stats(), live=node.live_tombstones, tombstone_ttl=node.tombstone_ttl),
+        'last_round': node.last_round_outcomes,
+        'totals': node.peer_outcome_totals
+    })
 
 
 @gossip.route('/get_nodelist_from_node', methods=['GET'])
 def get_nodelist_from_node():
-    return json.dumps(Node.instance().node_list)
+    return json.dumps(Node.instance().peer_view.peers())
 
 
 @gossip.route('/hello_world', methods=['GET'])
@@ -279,7 +528,7 @@ def get_metrics_priority_stats():
     
     # Get per-round metrics stats
     per_round_stats = {}
-    for round_num, stats in node.data_flow_per_round.items():
+    for round_num, stats in list(node.data_flow_per_round.items()):
         per_round_stats[round_num] = {
             'metrics_sent': stats.get('metrics_sent', 0),
             'metrics_filtered': stats.get('metrics_filtered', 0)
@@ -292,10 +541,16 @@ def get_metrics_priority_stats():
         'bandwidth_savings_percent': round(100 * metrics_filtered / (metrics_sent + metrics_filtered) if (metrics_sent + metrics_filtered) > 0 else 0, 2),
         'per_round_stats': per_round_stats,
         'priorities': {k: v for k, v in METRIC_PRIORITIES.items()},
+        'sampler': node.metric_sampler.stats(),
+        'evaluator': node.priority_evaluator.stats(),
         'deltas': {k: v for k, v in METRIC_DELTAS.items()}
     })
 
 
 if __name__ == "__main__":
     # get port from container
-    gossip.run(host='0.0.0.0', debug=True, threaded=True)
\ No newline at end of file
+    # PRIOMON_SERVER=asyncio serves everything from one event loop (see aio_server.py)
+    if os.environ.get("PRIOMON_SERVER", aio_server.SERVER_THREADED) == aio_server.SERVER_ASYNCIO:
+        aio_server.serve(gossip, host='0.0.0.0', port=5000)
+    else:
+        gossip.run(host='0.0.0.0', debug=True, threaded=True)
\ No newline at end of file
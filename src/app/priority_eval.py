@@ -0,0 +1,195 @@
+import logging
+import time
+from itertools import compress
+
+try:
+    import numpy as np
+except ImportError:
+    # no numpy, every round is evaluated metric by metric
+    np = None
+
+from collectors import PRIORITY_HIGH, DELTA_RELATIVE, metric_collector
+
+logger = logging.getLogger("demon.metrics")
+
+# initial size of the per metric arrays, doubled whenever new metrics show up
+INITIAL_CAPACITY = 64
+# metrics per round from which the arrays beat the per metric loop, measured
+# with experiments/bench_priority.py (0.2x at 4 metrics, 1.2x at 48, 1.9x at 100)
+VECTORIZE_MIN_METRICS = 40
+
+
+def is_number(value):
+    return isinstance(value, (int, float))
+
+
+class PriorityEvaluator:
+    """
+    Decides which metrics of a round go into appState.
+
+    A metric is sent the first time it is seen, every round if it is high
+    priority, once `priority` rounds have passed since it was last sent, or
+    when it moved by at least its delta threshold since the previous round.
+
+    The rules run metric by metric for small registries. From
+    VECTORIZE_MIN_METRICS metrics per round on, the state of every metric
+    (last value, round it was last sent, priority, threshold, how its delta
+    is measured) moves into NumPy arrays indexed by metric, so one round is a
+    handful of array operations however many metrics the collectors produce.
+    """
+
+    def __init__(self, priorities, deltas, vectorized=None, vectorize_min_metrics=VECTORIZE_MIN_METRICS):
+        # METRIC_PRIORITIES / METRIC_DELTAS, read when a metric is first seen
+        self.priorities = priorities
+        self.deltas = deltas
+        # None picks the path by metric count, True / False forces one
+        self.auto = vectorized is None and np is not None
+        self.vectorize_min_metrics = vectorize_min_metrics
+        self.vectorized = False
+        # metric -> row in the arrays
+        self.index = {}
+        self.names_key = None
+        self.names_index = None
+        self.rounds = 0
+        self.evaluate_seconds = 0.0
+        self.rules = {}
+        self.last_value = {}
+        self.last_sent_round = {}
+        if vectorized and np is not None:
+            self._start_arrays()
+
+    def _start_arrays(self):
+        """Moves the per metric state into the arrays, once and for good"""
+        capacity = INITIAL_CAPACITY
+        while capacity < len(self.last_value):
+            capacity *= 2
+        self.last_values = np.zeros(capacity, dtype=np.float64)
+        self.last_sent = np.zeros(capacity, dtype=np.int64)
+        self.priority = np.zeros(capacity, dtype=np.int64)
+        self.threshold = np.zeros(capacity, dtype=np.float64)
+        self.relative = np.zeros(capacity, dtype=bool)
+        self.seen = np.zeros(capacity, dtype=bool)
+        self.vectorized = True
+        for metric, value in self.last_value.items():
+            self._add(metric)
+            row = self.index[metric]
+            self.last_values[row] = value if is_number(value) else np.nan
+            self.last_sent[row] = self.last_sent_round[metric]
+            self.seen[row] = True
+        self.last_value = {}
+        self.last_sent_round = {}
+
+    def rule(self, metric):
+        """(priority, delta threshold, relative) of a metric: its own setting, then its collector's"""
+        rule = self.rules.get(metric)
+        if rule is None:
+            rule = self.rules[metric] = self._rule(metric)
+        return rule
+
+    def _rule(self, metric):
+        collector = metric_collector(metric)
+        if collector is None:
+            return self.priorities.get(metric, PRIORITY_HIGH), self.deltas.get(metric, 0), False
+        priority = self.priorities.get(metric, self.priorities.get(collector.name, collector.priority))
+        threshold = self.deltas.get(metric, self.deltas.get(collector.name, collector.delta))
+        return priority, threshold, collector.delta_kind == DELTA_RELATIVE
+
+    def evaluate(self, values, cycle):
+        """Splits {metric: value} into (to_send, filtered) and remembers the values for the next round"""
+        started = time.perf_counter()
+        if self.auto and not self.vectorized and len(values) >= self.vectorize_min_metrics:
+            self._start_arrays()
+        if self.vectorized:
+            to_send, filtered = self._evaluate_arrays(values, cycle)
+        else:
+            to_send, filtered = self._evaluate_scalar(values, cycle)
+        self.rounds += 1
+        self.evaluate_seconds += time.perf_counter() - started
+        logger.debug("METRIC_PRIORITY: cycle={}, metrics={}, sent={}, filtered={}".format(
+            cycle, len(values), len(to_send), len(filtered)))
+        return to_send, filtered
+
+    def _evaluate_scalar(self, values, cycle):
+        to_send = {}
+        filtered = {}
+        for metric, value in values.items():
+            if metric not in self.last_value:
+                self.rule(metric)
+                self.last_value[metric] = value
+                self.last_sent_round[metric] = 0
+                to_send[metric] = value
+                continue
+            priority, threshold, relative = self.rules[metric]
+            last = self.last_value[metric]
+            if is_number(value) and is_number(last) and last != 0:
+                delta = abs(value - last) / max(value, last) * 100 if relative else abs(value - last)
+            else:
+                delta = float('inf')
+            if priority == PRIORITY_HIGH or cycle - self.last_sent_round[metric] >= priority or delta >= threshold:
+                self.last_sent_round[metric] = cycle
+                to_send[metric] = value
+            else:
+                filtered[metric] = value
+            self.last_value[metric] = value
+        return to_send, filtered
+
+    def _rows(self, names):
+        # the sampler hands over the same metrics in the same order nearly every round
+        if names != self.names_key:
+            for metric in names:
+                if metric not in self.index:
+                    self._add(metric)
+            self.names_key = names
+            self.names_index = np.fromiter((self.index[metric] for metric in names), dtype=np.intp,
+                                           count=len(names))
+        return self.names_index
+
+    def _add(self, metric):
+        row = len(self.index)
+        if row == len(self.seen):
+            for name in ('last_values', 'last_sent', 'priority', 'threshold', 'relative', 'seen'):
+                array = getattr(self, name)
+                grown = np.zeros(len(array) * 2, dtype=array.dtype)
+                grown[:len(array)] = array
+                setattr(self, name, grown)
+        self.index[metric] = row
+        self.priority[row], self.threshold[row], self.relative[row] = self.rule(metric)
+
+    def _evaluate_arrays(self, values, cycle):
+        names = tuple(values)
+        rows = self._rows(names)
+        current = np.array(list(values.values()))
+        if current.dtype.kind not in 'biuf':
+            # some value isn't a number, those become nan and always count as changed
+            current = np.fromiter((value if is_number(value) else np.nan for value in values.values()),
+                                  dtype=np.float64, count=len(names))
+        current = current.astype(np.float64, copy=False)
+        last = self.last_values[rows]
+        first = ~self.seen[rows]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            difference = np.abs(current - last)
+            delta = np.where(self.relative[rows], difference / np.maximum(current, last) * 100, difference)
+        delta[np.isnan(current) | np.isnan(last) | (last == 0)] = np.inf
+
+        priority = self.priority[rows]
+        send = first | (priority == PRIORITY_HIGH) | (cycle - self.last_sent[rows] >= priority) \
+            | (delta >= self.threshold[rows])
+
+        # first sighting counts as sent in round 0
+        self.last_sent[rows] = np.where(send, np.where(first, 0, cycle), self.last_sent[rows])
+        self.last_values[rows] = current
+        self.seen[rows] = True
+
+        to_send = {metric: values[metric] for metric in compress(names, send.tolist())}
+        filtered = {metric: values[metric] for metric in compress(names, (~send).tolist())}
+        return to_send, filtered
+
+    def stats(self):
+        return {
+            'vectorized': self.vectorized,
+            'vectorize_min_metrics': self.vectorize_min_metrics if self.auto else None,
+            'metrics': len(self.index) if self.vectorized else len(self.last_value),
+            'rounds': self.rounds,
+            'avg_evaluate_us': round(self.evaluate_seconds / self.rounds * 1e6, 1) if self.rounds else None
+        }
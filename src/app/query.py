@@ -1,56 +1,429 @@
+import concurrent.futures
 import random
+import threading
 import time
+from collections import OrderedDict
 import requests
 
 # max number of quorum attempts before we give up
 MAX_QUERY_RETRIES = 30
+# a replica that hasn't answered after this many seconds gets a spare node asked alongside it
+HEDGE_AFTER = 0.1
+REQUEST_TIMEOUT = 5
+# backoff between attempts while the replicas still disagree, doubled per attempt
+RETRY_BASE = 0.05
+RETRY_MAX = 0.5
 
-def query(node_list, quorum_size, target_node_ip, target_node_port, docker_ip):
-    def build_url(node, path):
-        host = docker_ip if docker_ip else node["ip"]
-        return f"http://{host}:{node['port']}{path}"
+# which path served a read
+PATH_SINGLE = "single"
+PATH_QUORUM = "quorum"
+PATH_CACHE = "cache"
 
-    target_key = f"{target_node_ip}:{target_node_port}"
+# seconds a cached entry is served without asking any node
+DEFAULT_CACHE_TTL = 1.0
+# targets kept, the least recently used one is dropped first
+DEFAULT_CACHE_ENTRIES = 1024
 
-    for attempt in range(MAX_QUERY_RETRIES):
-        # 1. Pick a random quorum
-        random_nodes = random.sample(node_list, quorum_size)
+# keeps the connections to the nodes open between queries
+session = requests.Session()
 
-        metadatas = {}
-        total_messages = 0
 
-        # 2. Gather metadata
-        for node in random_nodes:
-            total_messages += 1
+def fetch_versions(base_url, keys, known=None):
+    """
+    {key: (counter, digest)} as one node sees it, None for a key the node
+    doesn't hold. known is {key: (counter, digest)} the caller already has,
+    a single key is then asked conditionally and a 304 returns it unchanged.
+    """
+    if len(keys) == 1:
+        headers = {'If-None-Match': f'"{known[keys[0]][1]}"'} if known and keys[0] in known else {}
+        resp = session.get(f"{base_url}/metadata/{keys[0]}", headers=headers, timeout=REQUEST_TIMEOUT)
+        if resp.status_code == 304:
+            return {keys[0]: known[keys[0]]}
+        if resp.status_code == 404:
+            return {keys[0]: None}
+        resp.raise_for_status()
+        reply = {keys[0]: resp.json()}
+    else:
+        resp = session.post(f"{base_url}/batch_metadata", json={'keys': keys}, timeout=REQUEST_TIMEOUT)
+        resp.raise_for_status()
+        reply = resp.json()
+    return {key: (reply[key]["counter"], reply[key]["digest"]) if key in reply else None for key in keys}
+
+
+def fetch_entries(base_url, keys):
+    """{key: entry} for the keys the node holds"""
+    if len(keys) == 1:
+        resp = session.get(f"{base_url}/entry/{keys[0]}", timeout=REQUEST_TIMEOUT)
+        if resp.status_code == 404:
+            return {}
+        resp.raise_for_status()
+        return {keys[0]: resp.json()}
+    resp = session.post(f"{base_url}/batch_entries", json={'keys': keys}, timeout=REQUEST_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def fresh_enough(entry, max_age, min_counter, now):
+    """True if the entry meets the caller's staleness bound"""
+    if max_age is not None and now - float(entry["hbState"]["timestamp"]) > max_age:
+        return False
+    return min_counter is None or float(entry["counter"]) >= min_counter
+
+
+def pick_node(node_list, keys):
+    """The key's owner for a single key when it is in node_list, a random node otherwise"""
+    if len(keys) == 1:
+        for node in node_list:
+            if f"{node['ip']}:{node['port']}" == keys[0]:
+                return node
+    return random.choice(node_list)
+
+
+def ask_single(pool, fetch, node, *args, hedge_after):
+    """fetch(*args) against one node, None if it fails or is slower than hedge_after"""
+    future = pool.submit(fetch, *args)
+    concurrent.futures.wait([future], timeout=hedge_after)
+    if not future.done():
+        return None
+    try:
+        return future.result()
+    except Exception as e:
+        print(f"Node {node['ip']}:{node['port']} not responding: {e}")
+        return None
+
+
+def is_current(cached, version):
+    """False once a node reports a higher counter or another digest than the cached entry"""
+    if version is None:
+        return False
+    counter, digest = version
+    return float(counter) <= float(cached["counter"]) and digest == cached["digest"]
+
+
+class QueryCache:
+    """
+    Query results of the client, keyed by target "ip:port".
+
+    An entry is served as is for ttl seconds, and beyond that for as long
+    as its heartbeat is within the staleness bound (the query's max_age, or
+    the cache's own max_age for queries without one). A live target's counter
+    goes up every round, so the bound is what keeps serving it; only an entry
+    past both is revalidated: the query asks one node for the target's
+    counter and digest (a conditional request, a 304 when nothing changed)
+    and the entry is dropped when the counter went up or the digest changed,
+    otherwise it is served for another ttl. Past max_entries the least
+    recently used target is evicted.
+    """
+
+    def __init__(self, ttl=DEFAULT_CACHE_TTL, max_entries=DEFAULT_CACHE_ENTRIES, max_age=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_age = max_age
+        # key -> (entry, validated at), least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counts = {'hits': 0, 'revalidated': 0, 'invalidated': 0, 'misses': 0, 'evictions': 0, 'probes': 0,
+                       'failed_probes': 0}
+
+    def lookup(self, key, max_age=None, now=None):
+        """(entry, expired), entry is None on a miss"""
+        now = time.time() if now is None else now
+        bound = self.max_age if max_age is None else max_age
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is None:
+                self.counts['misses'] += 1
+                return None, None
+            self.entries.move_to_end(key)
+            entry, validated_at = cached
+            expired = now - validated_at >= self.ttl and \
+                not (bound is not None and fresh_enough(entry, bound, None, now))
+            if not expired:
+                self.counts['hits'] += 1
+            return entry, expired
+
+    def confirm(self, key, version, now=None):
+        """Result of the probe of an expired entry, True if it can still be served"""
+        now = time.time() if now is None else now
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is None:
+                self.counts['misses'] += 1
+                return False
+            if is_current(cached[0], version):
+                self.entries[key] = (cached[0], now)
+                self.counts['revalidated'] += 1
+                return True
+            del self.entries[key]
+            self.counts['invalidated'] += 1
+            self.counts['misses'] += 1
+            return False
+
+    def store(self, key, entry, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            self.entries[key] = (entry, now)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counts['evictions'] += 1
+
+    def note_probe(self, keys, answered):
+        with self.lock:
+            self.counts['probes'] += 1
+            if not answered:
+                # the expired entries are read again, the cache keeps them until that read replaces them
+                self.counts['failed_probes'] += 1
+                self.counts['misses'] += len(keys)
+
+    def stats(self):
+        with self.lock:
+            served = self.counts['hits'] + self.counts['revalidated']
+            lookups = served + self.counts['misses']
+            return dict(self.counts, entries=len(self.entries), ttl=self.ttl, max_age=self.max_age,
+                        max_entries=self.max_entries,
+                        hit_ratio=round(served / lookups, 3) if lookups else None)
+
+
+def read_quorum(pool, candidates, quorum_size, keys, base_url, hedge_after):
+    """
+    One quorum attempt. The first quorum_size candidates are asked for the
+    keys' metadata at once, the others are spares: a slow replica gets a
+    spare asked alongside it after hedge_after, and whenever the outstanding
+    replies can no longer complete a quorum for some key (a node failed or
+    disagreed) spares are asked right away, for the keys still open only.
+    A key is settled once quorum_size replies agree on its counter and
+    digest, or agree that they don't hold it. Returns (messages,
+    {key: ((counter, digest) or None, agreeing nodes)}) as soon as every key
+    is settled or no more candidates are left.
+    """
+    spares = list(reversed(candidates[quorum_size:]))
+    # future -> (node, sent at)
+    pending = {}
+    hedged = set()
+    # key -> {version: nodes that reported it}
+    votes = {key: {} for key in keys}
+    settled = {}
+    messages = 0
+
+    def ask(node):
+        open_keys = [key for key in keys if key not in settled]
+        pending[pool.submit(fetch_versions, base_url(node), open_keys)] = (node, time.time())
+
+    for node in candidates[:quorum_size]:
+        ask(node)
+        messages += 1
+
+    while pending:
+        now = time.time()
+        for future, (node, sent) in list(pending.items()):
+            if future not in hedged and now - sent >= hedge_after:
+                hedged.add(future)
+                if spares:
+                    ask(spares.pop())
+                    messages += 1
+        deadlines = [sent + hedge_after for future, (node, sent) in pending.items() if future not in hedged]
+        timeout = max(0, min(deadlines) - now) if deadlines else REQUEST_TIMEOUT
+        done, _ = concurrent.futures.wait(pending, timeout=timeout,
+                                          return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            node, _ = pending.pop(future)
             try:
-                resp = requests.get(build_url(node, "/metadata"), timeout=5)
-                resp.raise_for_status()
-                data = resp.json()[target_key]
-                metadatas[f"{node['ip']}:{node['port']}"] = data
+                versions = future.result()
             except Exception as e:
                 print(f"Node {node['ip']}:{node['port']} not responding: {e}")
+                continue
+            for key, version in versions.items():
+                if key in settled:
+                    continue
+                nodes = votes[key].setdefault(version, [])
+                nodes.append(node)
+                if len(nodes) >= quorum_size:
+                    settled[key] = (version, nodes)
+        if len(settled) == len(keys):
+            break
+        # the open key furthest from a quorum decides how many more replies are needed,
+        # a hedged straggler isn't counted on to complete it
+        best = min(max((len(nodes) for nodes in votes[key].values()), default=0)
+                   for key in keys if key not in settled)
+        while spares and best + len([future for future in pending if future not in hedged]) < quorum_size:
+            ask(spares.pop())
+            messages += 1
+    return messages, settled
+
+
+def resolve(node_list, quorum_size, keys, docker_ip, hedge_after, max_age=None, min_counter=None, cache=None):
+    """
+    Quorum reads the keys until each one is settled and its entry fetched.
+    With a staleness bound (max_age seconds since the entry's heartbeat
+    timestamp, and/or min_counter, a number or {key: counter}) one node is
+    asked first and the entries it holds within the bound are served from
+    it, only the rest go through the quorum. For a single key that node is
+    the key's owner when it is in node_list. With a cache, entries within
+    its ttl or the staleness bound are served from it and expired ones are
+    revalidated by one conditional metadata read before any of that. Returns (messages,
+    {key: entry, None if a quorum doesn't hold it}, keys that never reached
+    a quorum, {key: PATH_CACHE, PATH_SINGLE or PATH_QUORUM}).
+    """
+    def base_url(node):
+        host = docker_ip if docker_ip else node["ip"]
+        return f"http://{host}:{node['port']}"
+
+    if len(node_list) < quorum_size:
+        raise ValueError(f"Query needs {quorum_size} nodes for a quorum, only {len(node_list)} given")
+    total_messages = 0
+    results = {}
+    paths = {}
+    remaining = list(keys)
+    backoff = RETRY_BASE
+    # stragglers finish in the background, a query never waits for them
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(node_list) + 1, thread_name_prefix="query")
+    try:
+        if cache is not None:
+            expired = {}
+            for key in remaining:
+                entry, stale = cache.lookup(key, max_age)
+                if entry is None:
+                    continue
+                if stale:
+                    expired[key] = entry
+                else:
+                    results[key] = entry
+                    paths[key] = PATH_CACHE
+            if expired:
+                node = pick_node(node_list, list(expired))
+                known = {key: (entry["counter"], entry["digest"]) for key, entry in expired.items()}
+                versions = ask_single(pool, fetch_versions, node, base_url(node), list(expired), known,
+                                      hedge_after=hedge_after)
+                total_messages += 1
+                cache.note_probe(expired, versions is not None)
+                for key, entry in expired.items():
+                    if versions is not None and cache.confirm(key, versions.get(key)):
+                        results[key] = entry
+                        paths[key] = PATH_CACHE
+            remaining = [key for key in remaining if key not in results]
+
+        if remaining and (max_age is not None or min_counter is not None):
+            node = pick_node(node_list, remaining)
+            served = ask_single(pool, fetch_entries, node, base_url(node), remaining, hedge_after=hedge_after) or {}
+            total_messages += 1
+            now = time.time()
+            for key, entry in served.items():
+                bound = min_counter.get(key) if isinstance(min_counter, dict) else min_counter
+                if key in remaining and fresh_enough(entry, max_age, bound, now):
+                    results[key] = entry
+                    paths[key] = PATH_SINGLE
+            remaining = [key for key in remaining if key not in results]
+
+        for attempt in range(MAX_QUERY_RETRIES):
+            if not remaining:
+                break
+            if attempt:
+                # small backoff before next attempt, gossip needs a moment to settle the disagreement
+                time.sleep(backoff)
+                backoff = min(RETRY_MAX, backoff * 2)
+            # 1. Random order, the first quorum_size nodes are asked, the rest are spares
+            candidates = random.sample(node_list, len(node_list))
+
+            # 2. The data is fetched alongside the metadata and checked against the agreed digests afterwards
+            speculative = pool.submit(fetch_entries, base_url(candidates[0]), remaining)
+            messages, settled = read_quorum(pool, candidates, quorum_size, remaining, base_url, hedge_after)
+            total_messages += messages + 1
+
+            # 3. Consistent quorum per key: same counter and digest on quorum_size nodes
+            if settled:
+                fetched = {}
+                # a slow data node is hedged like a slow replica
+                concurrent.futures.wait([speculative], timeout=hedge_after)
+                if speculative.done():
+                    try:
+                        fetched = speculative.result()
+                    except Exception as e:
+                        print(f"Node {candidates[0]['ip']}:{candidates[0]['port']} did not send the data: {e}")
+                # the entries carry their digest, no need to hash them again to
+                # check they are the versions the quorum agreed on
+                refetch = {}
+                for key, (version, nodes) in settled.items():
+                    if version is None:
+                        results[key] = None
+                        paths[key] = PATH_QUORUM
+                    elif fetched.get(key, {}).get("digest") != version[1]:
+                        node = nodes[0]
+                        refetch.setdefault(f"{node['ip']}:{node['port']}", (node, []))[1].append(key)
+                futures = {pool.submit(fetch_entries, base_url(node), node_keys): node
+                           for node, node_keys in refetch.values()}
+                total_messages += len(futures)
+                for future in concurrent.futures.as_completed(futures):
+                    node = futures[future]
+                    try:
+                        fetched.update(future.result())
+                    except Exception as e:
+                        print(f"Node {node['ip']}:{node['port']} did not send the data: {e}")
+                for key, (version, nodes) in settled.items():
+                    if version is None:
+                        continue
+                    if fetched.get(key, {}).get("digest") == version[1]:
+                        results[key] = fetched[key]
+                        paths[key] = PATH_QUORUM
+                    else:
+                        print(f"Node {nodes[0]['ip']}:{nodes[0]['port']} moved past the agreed digest of {key}, "
+                              f"retrying")
+
+            remaining = [key for key in remaining if key not in results]
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    if cache is not None:
+        for key, entry in results.items():
+            if entry is not None and paths[key] != PATH_CACHE:
+                cache.store(key, entry)
+    return total_messages, results, remaining, paths
+
+
+def query(node_list, quorum_size, target_node_ip, target_node_port, docker_ip, hedge_after=HEDGE_AFTER,
+          cache=None):
+    total_messages, result, _ = bounded_query(node_list, quorum_size, target_node_ip, target_node_port, docker_ip,
+                                              hedge_after=hedge_after, cache=cache)
+    return total_messages, result
+
+
+def bounded_query(node_list, quorum_size, target_node_ip, target_node_port, docker_ip, max_age=None,
+                  min_counter=None, hedge_after=HEDGE_AFTER, cache=None):
+    """
+    query() that accepts data up to max_age seconds old and/or from
+    min_counter on, served by the target itself when its entry is within the
+    bound, and from the QueryCache if one is given. Returns (total_messages,
+    result, the path that served it).
+    """
+    target_key = f"{target_node_ip}:{target_node_port}"
+    total_messages, results, unresolved, paths = resolve(node_list, quorum_size, [target_key], docker_ip,
+                                                         hedge_after, max_age, min_counter, cache)
+    if unresolved:
+        # if we get here, quorum was never reached
+        raise RuntimeError(f"Query failed: could not reach quorum consensus after {MAX_QUERY_RETRIES} attempts")
+    if results[target_key] is None:
+        raise RuntimeError(f"Query failed: a quorum does not know {target_key}")
+    print(f"Query result ({paths[target_key]} read): {results[target_key]}")
+    return total_messages, results[target_key], paths[target_key]
+
 
-        # 3. Check if full quorum replied
-        if len(metadatas) == quorum_size:
-            # Counter consensus
-            counters = [d["counter"] for d in metadatas.values()]
-            if len(set(counters)) == 1:
-                # Digest consensus
-                digests = [d["digest"] for d in metadatas.values()]
-                if len(set(digests)) == 1:
-                    # 4. Fetch actual data
-                    first_node = random_nodes[0]
-                    data_resp = requests.get(
-                        build_url(first_node, "/get_recent_data_from_node"),
-                        timeout=5
-                    )
-                    data_resp.raise_for_status()
-                    result = data_resp.json()[target_key]
-                    print(f"Query result: {result}")
-                    return total_messages, result
-
-        # small backoff before next attempt
-        time.sleep(0.5)
-
-    # if we get here, quorum was never reached
-    raise RuntimeError(f"Query failed: could not reach quorum consensus after {MAX_QUERY_RETRIES} attempts")
+def query_many(node_list, quorum_size, target_keys, docker_ip, hedge_after=HEDGE_AFTER, max_age=None,
+               min_counter=None, cache=None):
+    """
+    Resolves many "ip:port" keys against one quorum per attempt, e.g. for a
+    view of the whole cluster. Returns (total_messages, {key: entry or None},
+    keys without consensus after MAX_QUERY_RETRIES attempts, {key: path that
+    served it}), a key is None when a quorum agrees it doesn't hold it.
+    max_age and min_counter bound the staleness as in bounded_query, keys
+    one node serves within the bound skip the quorum. With a QueryCache the
+    expired cached keys of the batch are revalidated with one request.
+    """
+    keys = list(dict.fromkeys(target_keys))
+    if not keys:
+        return 0, {}, [], {}
+    total_messages, results, unresolved, paths = resolve(node_list, quorum_size, keys, docker_ip, hedge_after,
+                                                         max_age, min_counter, cache)
+    single = sum(1 for path in paths.values() if path == PATH_SINGLE)
+    cached = sum(1 for path in paths.values() if path == PATH_CACHE)
+    print(f"Query for {len(keys)} keys: {len(results)} resolved ({cached} cached, {single} from a single node), "
+          f"{len(unresolved)} without consensus, {total_messages} messages")
+    return total_messages, results, unresolved, paths
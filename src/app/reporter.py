@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+
+import requests
+
+from utility import entry_changes
+
+# seconds between two reports, every update in between is folded into one
+DEFAULT_REPORT_INTERVAL = 0.5
+# a report slower than this switches to summary mode, CALM_REPORTS fast ones switch back
+DEFAULT_SUMMARY_LATENCY = 1.0
+CALM_REPORTS = 3
+# more changed entries than this are sent as a summary too
+MAX_DELTA_ENTRIES = 1000
+REPORT_TIMEOUT = 5
+
+REPORT_FULL = "full"
+REPORT_DELTA = "delta"
+REPORT_SUMMARY = "summary"
+
+
+class Reporter:
+    """
+    Reports the node's state to the monitor (is_send_data_back) off the request path.
+
+    Handlers only mark that the state changed, a thread sends at most one
+    report per interval. The first report carries the whole state, later
+    ones only the entries that changed since the last full or delta report
+    and the keys that are gone. When the monitor is slow, or too much
+    changed at once, the reporter drops to summary reports (counters and
+    our own entry) until the monitor keeps up again; the next delta then
+    carries everything since the last detailed report.
+    """
+
+    def __init__(self, url, latest_state, round_stats, own_key, interval=DEFAULT_REPORT_INTERVAL,
+                 summary_latency=DEFAULT_SUMMARY_LATENCY):
+        self.url = url
+        self.latest_state = latest_state
+        self.round_stats = round_stats
+        self.own_key = own_key
+        self.interval = interval
+        self.summary_latency = summary_latency
+        # key -> entry as of the last full or delta report, None until the first one went out
+        self.reported = None
+        self.summary = False
+        self.fast_reports = 0
+        self.seq = 0
+        # updates since the last report and the highest sender round among them
+        self.updates = 0
+        self.inc_round = 0
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.counts = {'updates': 0, REPORT_FULL: 0, REPORT_DELTA: 0, REPORT_SUMMARY: 0, 'failed': 0,
+                       'entries_sent': 0, 'bytes_sent': 0}
+
+    def start(self):
+        self.thread = threading.Thread(target=self._loop, name="reporter", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=REPORT_TIMEOUT):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def note_update(self, inc_round):
+        """Called by the handlers after a merge, cheap, the report is built later"""
+        with self.lock:
+            self.updates += 1
+            self.inc_round = max(self.inc_round, inc_round)
+            self.counts['updates'] += 1
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.report_once()
+
+    def report_once(self):
+        with self.lock:
+            updates, inc_round = self.updates, self.inc_round
+            self.updates = 0
+        state = self.latest_state()
+        if not updates or state is None:
+            return
+        current = {key: state[key] for key in state}
+        report, mode, entry_count = self.build(current)
+        report.update({'seq': self.seq + 1, 'messages': updates, 'data_flow_per_round': self.round_stats()})
+
+        started = time.time()
+        try:
+            response = self.session.post('{}&round={}'.format(self.url, inc_round), json=report,
+                                         timeout=REPORT_TIMEOUT)
+            sent = response.status_code == 200
+            sent_bytes = len(response.request.body or b'')
+        except requests.exceptions.RequestException as e:
+            logging.error("Report to the monitor failed: {}".format(e))
+            sent = False
+        latency = time.time() - started
+        if not sent:
+            self.counts['failed'] += 1
+            # the updates are reported with the next one, in summary form until the monitor answers again
+            with self.lock:
+                self.updates += updates
+            self.summary = True
+            self.fast_reports = 0
+            return
+        self.seq += 1
+        self.counts[mode] += 1
+        self.counts['entries_sent'] += entry_count
+        self.counts['bytes_sent'] += sent_bytes
+        if mode != REPORT_SUMMARY:
+            self.reported = current
+        if latency > self.summary_latency:
+            self.summary = True
+            self.fast_reports = 0
+        elif self.summary:
+            self.fast_reports += 1
+            if self.fast_reports >= CALM_REPORTS:
+                self.summary = False
+
+    def build(self, current):
+        """Returns (report, mode, entries in it)"""
+        if self.reported is None:
+            return {'mode': REPORT_FULL, 'entries': current}, REPORT_FULL, len(current)
+        changed, removed = entry_changes(self.reported, current)
+        if self.summary or len(changed) > MAX_DELTA_ENTRIES:
+            counters = {key: entry.get('counter') for key, entry in current.items()}
+            own = {self.own_key: current[self.own_key]} if self.own_key in current else {}
+            return {'mode': REPORT_SUMMARY, 'counters': counters, 'entries': own}, REPORT_SUMMARY, len(own)
+        return {'mode': REPORT_DELTA, 'entries': changed, 'removed': removed}, REPORT_DELTA, len(changed)
+
+    def stats(self):
+        return dict(self.counts, summary_mode=self.summary, interval=self.interval,
+                    summary_latency=self.summary_latency, pending_updates=self.updates)
@@ -0,0 +1,134 @@
+import sys
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+# keep about two minutes of history with the 1s gossip counter
+DEFAULT_MAX_SNAPSHOTS = 120
+
+
+class SnapshotStore(MutableMapping):
+    """
+    Bounded history of cluster snapshots keyed by gossip counter.
+
+    Behaves like the plain dict that Node.data used to be, but remembers the
+    newest key so handlers don't have to scan the whole history, and drops the
+    oldest snapshots once the retention window (count and/or age in seconds)
+    is exceeded. The latest snapshot is never evicted.
+
+    Only the node's StateWriter changes the store, readers iterate over a
+    list() copy of the history that is taken in one step under the GIL.
+    """
+
+    def __init__(self, initial=None, max_snapshots=DEFAULT_MAX_SNAPSHOTS, max_age=None):
+        self._snapshots = OrderedDict()
+        self._created = {}
+        self._latest_key = None
+        self.max_snapshots = max_snapshots
+        self.max_age = max_age
+        self.evicted_count = 0
+        if initial:
+            for key in sorted(initial, key=int):
+                self[key] = initial[key]
+
+    def __getitem__(self, key):
+        return self._snapshots[key]
+
+    def __setitem__(self, key, snapshot):
+        if key not in self._snapshots:
+            self._created[key] = time.time()
+        self._snapshots[key] = snapshot
+        if self._latest_key is None or int(key) > int(self._latest_key):
+            self._latest_key = key
+        self._evict()
+
+    def __delitem__(self, key):
+        del self._snapshots[key]
+        del self._created[key]
+        if key == self._latest_key:
+            # only happens on manual deletes, eviction never touches the latest key
+            self._latest_key = max(self._snapshots, key=int) if self._snapshots else None
+
+    def __iter__(self):
+        return iter(list(self._snapshots))
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def latest_key(self):
+        return self._latest_key
+
+    def latest(self):
+        if self._latest_key is None:
+            return None
+        return self._snapshots[self._latest_key]
+
+    def pop_history(self):
+        """Remove and return every snapshot except the latest one (used by push mode)"""
+        history = {k: v for k, v in list(self._snapshots.items()) if k != self._latest_key}
+        for key in history:
+            del self._snapshots[key]
+            del self._created[key]
+        return history
+
+    def _evict(self):
+        now = time.time()
+        while len(self._snapshots) > 1:
+            oldest_key = next(iter(self._snapshots))
+            if oldest_key == self._latest_key:
+                # out of order inserts can put the latest key at the front, keep it
+                self._snapshots.move_to_end(oldest_key)
+                continue
+            over_count = self.max_snapshots and len(self._snapshots) > self.max_snapshots
+            too_old = self.max_age and now - self._created[oldest_key] > self.max_age
+            if not (over_count or too_old):
+                break
+            del self._snapshots[oldest_key]
+            del self._created[oldest_key]
+            self.evicted_count += 1
+
+    def memory_usage(self):
+        """Approximate number of bytes held by the stored snapshots (shared objects counted once)"""
+        return deep_sizeof(list(self._snapshots.values()))
+
+    def stats(self):
+        keys = list(self._snapshots)
+        return {
+            'snapshots': len(keys),
+            'entries': sum(len(s) for s in list(self._snapshots.values())),
+            'latest_key': self._latest_key,
+            'oldest_key': keys[0] if keys else None,
+            'max_snapshots': self.max_snapshots,
+            'max_age': self.max_age,
+            'evicted': self.evicted_count,
+            'approx_bytes': self.memory_usage()
+        }
+
+    def to_dict(self):
+        return {k: plain_snapshot(v) for k, v in list(self._snapshots.items())}
+
+
+def plain_snapshot(snapshot):
+    # snapshots are ClusterState versions, json only understands plain dicts
+    if hasattr(snapshot, 'to_dict'):
+        return snapshot.to_dict()
+    return snapshot
+
+
+def deep_sizeof(obj, seen=None):
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += deep_sizeof(k, seen) + deep_sizeof(v, seen)
+    elif hasattr(obj, '__dict__'):
+        # e.g. ClusterState, walk its buckets so shared buckets are only counted once
+        size += deep_sizeof(vars(obj), seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+    return size
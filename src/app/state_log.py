@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from utility import entry_changes
+
+# seconds between two appends, only the latest published snapshot is logged
+DEFAULT_LOG_INTERVAL = 1.0
+# the log is rewritten as one full record once it grows past this
+DEFAULT_COMPACT_BYTES = 4 * 1024 * 1024
+
+
+class StateLog:
+    """
+    Append-only local log of the cluster state, for warm restarts.
+
+    Every interval the latest snapshot is compared with the last logged one
+    (entries are immutable, so by identity) and one json line with the
+    changed entries and the removed keys is appended. Past compact_bytes the
+    log is rewritten as a single full record into a temp file that replaces
+    it atomically. load() replays the records, a torn last line from a crash
+    mid-write is skipped, and returns the last logged state.
+    """
+
+    def __init__(self, path, latest_state, interval=DEFAULT_LOG_INTERVAL, compact_bytes=DEFAULT_COMPACT_BYTES):
+        self.path = path
+        self.latest_state = latest_state
+        self.interval = interval
+        self.compact_bytes = compact_bytes
+        # key -> entry as of the last record
+        self.logged = {}
+        self.logged_state = None
+        self.file = None
+        self.size = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.counts = {'appends': 0, 'compactions': 0, 'entries_written': 0, 'restored_entries': 0,
+                       'restored_records': 0, 'load_ms': None}
+
+    def load(self):
+        """The state of the last record as {key: entry}, None if there is no log"""
+        started = time.perf_counter()
+        entries = {}
+        records = 0
+        try:
+            with open(self.path, encoding='utf-8') as log_file:
+                for line in log_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logging.error("State log {} ends in a torn record, replay stops there".format(self.path))
+                        break
+                    if 'full' in record:
+                        entries = dict(record['full'])
+                    else:
+                        for key in record.get('del', []):
+                            entries.pop(key, None)
+                        entries.update(record.get('set', {}))
+                    records += 1
+        except FileNotFoundError:
+            return None
+        self.logged = dict(entries)
+        self.counts['restored_entries'] = len(entries)
+        self.counts['restored_records'] = records
+        self.counts['load_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        return entries
+
+    def start(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # starts from one full record of what was restored, drops whatever was replayed to get there
+        self.compact(self.logged)
+        self.thread = threading.Thread(target=self._loop, name="state-log", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.append_latest()
+        # the last state before a reset or stop is what the next start restores
+        self.append_latest()
+
+    def append_latest(self):
+        state = self.latest_state()
+        if state is None or state is self.logged_state:
+            return
+        current = {key: state[key] for key in state}
+        changed, removed = entry_changes(self.logged, current)
+        self.logged_state = state
+        if not changed and not removed:
+            return
+        try:
+            record = json.dumps({'set': changed, 'del': removed}) + '\n'
+            self.file.write(record)
+            self.file.flush()
+            self.size += len(record)
+            self.logged = current
+            self.counts['appends'] += 1
+            self.counts['entries_written'] += len(changed)
+            if self.size > self.compact_bytes:
+                self.compact(current)
+        except (OSError, TypeError, ValueError) as e:
+            logging.error("State log append failed: {}".format(e))
+
+    def compact(self, entries):
+        temp_path = self.path + '.tmp'
+        record = json.dumps({'full': entries}) + '\n'
+        with open(temp_path, 'w', encoding='utf-8') as temp_file:
+            temp_file.write(record)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        if self.file:
+            self.file.close()
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.size = len(record)
+        self.logged = dict(entries)
+        self.counts['compactions'] += 1
+
+    def stats(self):
+        return dict(self.counts, path=self.path, size=self.size, compact_bytes=self.compact_bytes,
+                    interval=self.interval)
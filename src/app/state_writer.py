@@ -0,0 +1,114 @@
+import concurrent.futures
+import logging
+import queue
+import threading
+
+from cluster_state import ClusterState
+
+# how many queued changes are folded into one new snapshot at most
+MAX_BATCH = 64
+# bounded, a flood of inbound merges makes the handlers wait instead of piling up
+MAX_PENDING = 1024
+
+_STOP = object()
+
+
+class StateWriter:
+    """
+    Single writer of a node's SnapshotStore.
+
+    Every change to the cluster state is a task fn(state, *args) queued here.
+    The writer thread drains the queue, applies a batch of tasks to one
+    copy-on-write version of the latest snapshot and publishes that version
+    under the current time key. A published snapshot is never written again,
+    so readers just take store.latest() and iterate it without any lock.
+
+    Tasks must replace entries instead of editing them in place, entries are
+    shared with the snapshots that are already published.
+    """
+
+    def __init__(self, store, time_key):
+        self.store = store
+        self.time_key = time_key
+        self.queue = queue.Queue(maxsize=MAX_PENDING)
+        self.thread = None
+        self.running = False
+        self.batches = 0
+        self.tasks = 0
+        self.largest_batch = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, name="state-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Apply what is already queued, then stop the writer thread"""
+        if not self.running:
+            return
+        self.running = False
+        self.queue.put(_STOP)
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        if not self.running:
+            future.set_exception(RuntimeError("state writer is stopped"))
+            return future
+        self.queue.put((fn, args, future))
+        return future
+
+    def run(self, fn, *args):
+        """Queue a task and wait until the snapshot it wrote to is published"""
+        if threading.current_thread() is self.thread:
+            raise RuntimeError("tasks can't wait on the state writer from the writer thread")
+        return self.submit(fn, *args).result()
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not _STOP and len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is _STOP
+            if stop:
+                batch.pop()
+            if batch:
+                self._apply(batch)
+            if stop:
+                return
+
+    def _apply(self, batch):
+        latest = self.store.latest()
+        state = latest.copy() if latest is not None else ClusterState()
+        results = []
+        for fn, args, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                results.append((future, fn(state, *args)))
+            except Exception as e:
+                logging.error("State writer task {} failed: {}".format(getattr(fn, '__name__', fn), e))
+                future.set_exception(e)
+        # tasks that only touch node bookkeeping leave the snapshot alone
+        if latest is None or state.has_own_buckets():
+            self.store[self.time_key()] = state
+        # callers are released only after their change is visible to readers
+        for future, result in results:
+            future.set_result(result)
+        self.batches += 1
+        self.tasks += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'pending': self.queue.qsize(),
+            'batches': self.batches,
+            'tasks': self.tasks,
+            'largest_batch': self.largest_batch,
+            'tasks_per_batch': round(self.tasks / self.batches, 2) if self.batches else 0
+        }
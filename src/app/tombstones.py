@@ -0,0 +1,82 @@
+import threading
+import time
+
+from utility import mk_digest
+
+# seconds a tombstone stays in the state so it can spread before it is collected
+DEFAULT_TOMBSTONE_TTL = 30.0
+# collected keys are remembered this many TTLs longer, so stale copies a slow
+# peer still gossips don't bring the entry back
+BURIED_TTL_FACTOR = 3
+
+
+def is_tombstone(entry):
+    return entry is not None and 'tombstone' in entry
+
+
+def make_tombstone(entry, now=None):
+    """
+    Replaces the entry of a dead node: metrics are dropped, the counter goes
+    one up so the tombstone wins over the last live version on every peer
+    """
+    now = time.time() if now is None else now
+    hb_state = entry.get("hbState", {})
+    tombstone = {
+        "counter": "{}".format(int(float(entry.get("counter", 0))) + 1),
+        "cycle": entry.get("cycle", "0"),
+        "digest": "",
+        "nodeState": entry.get("nodeState", {}),
+        "hbState": {"timestamp": "{}".format(now), "failureCount": hb_state.get("failureCount", 0),
+                    "failureList": hb_state.get("failureList", []), "nodeAlive": False},
+        "appState": {},
+        "nfState": {},
+        "metric_sent_flags": {},
+        "tombstone": now
+    }
+    tombstone["digest"] = mk_digest(tombstone)
+    return tombstone
+
+
+def merged_failure_list(current, *others):
+    """Sorted union of the failure lists, None if current already holds every claim"""
+    extra = [ip for other in others if other and other is not current for ip in other]
+    if not extra:
+        return None
+    known = set(current)
+    if known.issuperset(extra):
+        return None
+    return sorted(known.union(extra))
+
+
+class Graveyard:
+    """Keys whose tombstone was collected, with the counter it had"""
+
+    def __init__(self, ttl=DEFAULT_TOMBSTONE_TTL * BURIED_TTL_FACTOR):
+        self.ttl = ttl
+        # key -> (counter, buried at)
+        self.buried = {}
+        self.collected = 0
+        self.lock = threading.Lock()
+
+    def bury(self, key, counter, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            self.buried[key] = (float(counter), now)
+            self.collected += 1
+
+    def blocks(self, key, counter):
+        """True for a copy of a collected entry that isn't newer than its tombstone"""
+        buried = self.buried.get(key)
+        return buried is not None and float(counter or 0) <= buried[0]
+
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            for key in [key for key, (_, buried_at) in self.buried.items() if now - buried_at >= self.ttl]:
+                del self.buried[key]
+
+    def __len__(self):
+        return len(self.buried)
+
+    def stats(self):
+        return {'buried': len(self.buried), 'collected': self.collected, 'ttl': self.ttl}
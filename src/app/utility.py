@@ -1,5 +1,6 @@
 import json
 import hashlib
+import threading
 
 
 # Utility functions for the Node class
@@ -11,3 +12,43 @@ def mk_digest(to_digest):
     return digest
 
 
+class MetadataView:
+    """
+    {key: {'counter', 'digest'}} of one snapshot, built once per snapshot.
+
+    Digests travel inside the entries, so serving /metadata (and answering the
+    quorum query) never hashes anything, this only avoids rebuilding and
+    re-serializing the same view for every request until the next snapshot.
+    """
+
+    def __init__(self):
+        self.state = None
+        self.view = {}
+        self.text = None
+        self.lock = threading.Lock()
+
+    def get(self, state):
+        with self.lock:
+            if state is not self.state:
+                self.view = {key: {'counter': state[key]['counter'], 'digest': state[key]['digest']}
+                             for key in state if 'counter' in state[key]}
+                self.text = None
+                self.state = state
+            return self.view
+
+    def json(self, state):
+        view = self.get(state)
+        with self.lock:
+            if self.text is None or view is not self.view:
+                self.text = json.dumps(view)
+            return self.text
+
+
+def entry_changes(previous, current):
+    """
+    (changed, removed) between two {key: entry} maps. Entries are replaced,
+    never changed, so an entry that is still the same object is unchanged.
+    """
+    changed = {key: entry for key, entry in current.items() if previous.get(key) is not entry}
+    removed = [key for key in previous if key not in current]
+    return changed, removed
@@ -1,2 +1,2 @@
-# re-export query() so monitoring.py can do: from src import query_client
-from src.app.query import query  # noqa: F401
+# re-export the query functions, the cache and their defaults so monitoring.py can do: from src import query_client
+from src.app.query import query, bounded_query, query_many, QueryCache, HEDGE_AFTER, DEFAULT_CACHE_ENTRIES  # noqa: F401